@@ -0,0 +1,582 @@
+import asyncio
+import json
+import os
+import time
+
+import httpx
+from ollama import AsyncClient
+
+import tracing
+import transport
+from manifest import DocumentManifest
+from page_filter import PAGE_FILTER_ENABLED
+from segment_cache import SegmentCache
+from services import (
+    OCR_CONCURRENCY,
+    OCR_IMAGE_OPTIONS,
+    OLLAMA_KEEP_ALIVE,
+    RENDER_BATCH_PAGES,
+    RST_CONCURRENCY,
+    SEGMENT_MODE,
+    SEGMENT_MODES,
+    TEXT_LAYER_MODE,
+    TEXT_LAYER_MODES,
+    _encode_image,
+    _format_failures,
+    ollama_services,
+)
+from utility import (
+    ISANLP_TIMEOUT,
+    WTPSPLIT_TIMEOUT,
+    JsonlBatchWriter,
+    _apply_boundary_fix,
+    _boundary_window,
+    _isanlp_request,
+    _isanlp_segments,
+    _read_jsonl_texts,
+    _write_jsonl,
+    _wtpsplit_cache_key,
+    _wtpsplit_request,
+    _wtpsplit_segments,
+    get_pdf_page_count,
+)
+
+try:
+    import config as _config
+except ImportError:
+    try:
+        from . import config as _config
+    except ImportError:
+        _config = None
+
+WTPSPLIT_CONCURRENCY = getattr(_config, "WTPSPLIT_CONCURRENCY", 4) if _config else 4
+
+
+class async_ollama_services:
+    def __init__(self,
+                 service: ollama_services | None = None,
+                 ocr_concurrency: int | None = None,
+                 wtpsplit_concurrency: int | None = None,
+                 rst_concurrency: int | None = None):
+        # 同步服务负责缓存目录与清单，这里只替换所有远程调用为异步版本
+        self._service = service or ollama_services()
+        # 与同步版本共用 OllamaHostPool 的选择、并发上限和故障冷却；每台主机一个 AsyncClient
+        self._hosts = self._service._hosts
+        self._clients: dict[str, AsyncClient] = {}
+        self._http: httpx.AsyncClient | None = None
+        # 每个远程端点一个信号量，所有文档共享
+        self._ocr_concurrency = max(
+            1, ocr_concurrency or self._hosts.capacity or OCR_CONCURRENCY
+        )
+        self._ocr_limit = asyncio.Semaphore(self._ocr_concurrency)
+        self._wtpsplit_limit = asyncio.Semaphore(
+            max(1, wtpsplit_concurrency or WTPSPLIT_CONCURRENCY)
+        )
+        self._rst_limit = asyncio.Semaphore(max(1, rst_concurrency or RST_CONCURRENCY))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def _ollama_client(self, host) -> AsyncClient:
+        client = self._clients.get(host.url)
+        if client is None:
+            client = AsyncClient(host=host.url, headers=self._service._auth_headers())
+            self._clients[host.url] = client
+        return client
+
+    async def _run_on_host(self, fn):
+        # 与 OllamaHostPool.run 相同：最空闲的健康主机执行 fn(client)，失败后换一台没试过的主机。
+        # acquire 可能等待空闲名额，放到线程中执行
+        tried: set[str] = set()
+        last_error: BaseException | None = None
+        for _ in range(len(self._hosts.hosts)):
+            try:
+                host = await asyncio.to_thread(self._hosts.acquire, tried)
+            except RuntimeError:
+                break
+            if tried:
+                tracing.add("retries")
+            started = time.monotonic()
+            try:
+                result = await fn(self._ollama_client(host))
+            except Exception as exc:
+                self._hosts.release(host, time.monotonic() - started, exc)
+                tried.add(host.url)
+                last_error = exc
+                continue
+            except BaseException:
+                self._hosts.release(host, time.monotonic() - started)
+                raise
+            self._hosts.release(host, time.monotonic() - started)
+            return result
+        raise last_error or RuntimeError("No Ollama host available.")
+
+    def _http_client(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = transport.create_async_client()
+        return self._http
+
+    async def get_models(self):
+        try:
+            response = await transport.async_request(
+                self._http_client(),
+                "GET",
+                f"{self._service._base_url()}/api/tags",
+                headers=self._service._auth_headers(),
+            )
+            response.raise_for_status()
+            data = response.json()
+            return [model["name"] for model in data.get("models", [])]
+        except httpx.HTTPError as exc:
+            return [f"Error: {exc}"]
+
+    async def say_hello(self, select_model: str):
+        if not select_model:
+            return "No model selected."
+        payload = {
+            "model": select_model,
+            "prompt": "Say hello!",
+            "stream": False,
+        }
+        try:
+            response = await transport.async_request(
+                self._http_client(),
+                "POST",
+                f"{self._service._base_url()}/api/generate",
+                json=payload,
+                headers=self._service._auth_headers(),
+            )
+            response.raise_for_status()
+            data = response.json()
+            return data.get("response", "No response")
+        except httpx.HTTPError as exc:
+            return f"Error: {exc}"
+
+    async def ocr_image(self, image_bytes: bytes, model: str | None = None) -> str:
+        image_payload = _encode_image(image_bytes)
+        async with self._ocr_limit:
+            with tracing.span("ollama_chat", model=model, bytes_out=len(image_payload)) as span:
+                response = await self._run_on_host(
+                    lambda client: client.chat(
+                        model=model,
+                        keep_alive=OLLAMA_KEEP_ALIVE,
+                        messages=[
+                            {
+                                "role": "user",
+                                "content": "<image>\nFree OCR.",
+                                "images": [image_payload],
+                            }
+                        ],
+                    )
+                )
+                text = getattr(response, "message", None)
+                content = getattr(text, "content", "") if text else ""
+                span.set(bytes_in=len(content.encode("utf-8")))
+        return content
+
+    async def warm_up_model(self, model: str | None, keep_alive: str | int | None = None) -> str:
+        if not model:
+            return "No model selected."
+        # 与同步版本一样每台主机都预热，全部失败才报错
+        results = await asyncio.gather(
+            *(
+                self._ollama_client(host).generate(
+                    model=model,
+                    keep_alive=keep_alive if keep_alive is not None else OLLAMA_KEEP_ALIVE,
+                )
+                for host in self._hosts.hosts
+            ),
+            return_exceptions=True,
+        )
+        errors = [
+            f"{host.url}: {result}"
+            for host, result in zip(self._hosts.hosts, results)
+            if isinstance(result, Exception)
+        ]
+        if len(errors) == len(self._hosts.hosts):
+            return f"Error: {'; '.join(errors)}"
+        return "ok"
+
+    async def get_pdfimg_text(self,
+                              pdf_path: str,
+                              model: str | None = None,
+                              image_options: dict | None = None,
+                              text_mode: str | None = None,
+                              filter_pages: bool | None = None):
+        if not pdf_path:
+            return "No PDF path."
+        text_mode = text_mode or TEXT_LAYER_MODE
+        if text_mode not in TEXT_LAYER_MODES:
+            return f"Unknown text mode: {text_mode}"
+
+        page_count = await asyncio.to_thread(get_pdf_page_count, pdf_path)
+        if isinstance(page_count, str):
+            return page_count
+        if page_count < 1:
+            return "Invalid page count."
+
+        manifest = await asyncio.to_thread(self._service._open_document, pdf_path, page_count)
+        pending = manifest.pending("ocr", page_count)
+        if not pending:
+            return "ok"
+
+        if text_mode != "ocr":
+            total = len(pending)
+            pending, failures = await asyncio.to_thread(
+                self._service._read_text_layer,
+                pdf_path,
+                manifest,
+                pending,
+                text_mode == "text",
+            )
+            if text_mode == "text":
+                return _format_failures(failures, total)
+            if not pending:
+                return "ok"
+
+        deferred: dict[int, int] = {}
+        if PAGE_FILTER_ENABLED if filter_pages is None else filter_pages:
+            pending, deferred = await asyncio.to_thread(
+                self._service._filter_pages, pdf_path, manifest, pending
+            )
+            if not pending and not deferred:
+                return "ok"
+
+        await self.warm_up_model(model)
+        if image_options is None:
+            image_options = OCR_IMAGE_OPTIONS
+        batch_size = 1 if image_options else RENDER_BATCH_PAGES
+        loop = asyncio.get_running_loop()
+        rendered = {page_number: loop.create_future() for page_number in pending}
+        # 渲染领先 OCR 的页数上限，页面 OCR 完成后才释放名额
+        ahead = asyncio.Semaphore(max(batch_size, self._ocr_concurrency * 2))
+
+        async def _render():
+            for batch in self._service._render_batches(pending, batch_size):
+                for _ in batch:
+                    await ahead.acquire()
+                try:
+                    result = await asyncio.to_thread(
+                        self._service._render_pages,
+                        pdf_path,
+                        manifest,
+                        batch,
+                        image_options,
+                    )
+                except Exception as exc:
+                    for page_number in batch:
+                        rendered[page_number].set_exception(exc)
+                    continue
+                for page_number in batch:
+                    rendered[page_number].set_result(result)
+
+        async def _ocr(page_number: int):
+            try:
+                image_bytes = await rendered[page_number]
+                image_bytes = await asyncio.to_thread(
+                    self._service._load_page_image,
+                    manifest,
+                    page_number,
+                    image_bytes,
+                )
+                text = await self.ocr_image(image_bytes, model)
+                await asyncio.to_thread(
+                    self._service._save_page_text, manifest, page_number, text, model
+                )
+            finally:
+                ahead.release()
+
+        render_task = asyncio.create_task(_render())
+        results = await asyncio.gather(
+            *(_ocr(page_number) for page_number in pending),
+            return_exceptions=True,
+        )
+        await render_task
+        await asyncio.to_thread(manifest.save)
+        failures = {
+            page_number: str(result)
+            for page_number, result in zip(pending, results)
+            if isinstance(result, BaseException)
+        }
+        failures.update(
+            await asyncio.to_thread(self._service._copy_duplicates, manifest, deferred)
+        )
+        return _format_failures(failures, len(pending) + len(deferred))
+
+    async def split_text_with_wtpsplit(self,
+                                       text: str | list[str],
+                                       threshold: float | None = None,
+                                       base_url: str | None = None,
+                                       token: str | None = None):
+        if isinstance(text, list) and not text:
+            return []
+        url, headers, payload = _wtpsplit_request(text, threshold, base_url, token)
+        cache = self._service._get_segment_cache()
+        texts = text if isinstance(text, list) else [text]
+        keys = [_wtpsplit_cache_key(url, threshold, item) for item in texts]
+        # 结果缓存在 SQLite 中，读写都放到线程里，不阻塞事件循环
+        groups = await asyncio.to_thread(
+            lambda: [cache.get(key, kind="wtpsplit") for key in keys]
+        )
+        missing = [index for index, group in enumerate(groups) if group is None]
+        if missing:
+            missing_texts = [texts[index] for index in missing]
+            payload["texts"] = missing_texts
+            async with self._wtpsplit_limit:
+                with tracing.span(
+                    "wtpsplit",
+                    texts=len(texts),
+                    cache_hits=len(texts) - len(missing),
+                    cache_misses=len(missing),
+                ) as span:
+                    if span:
+                        span.set(bytes_out=sum(len(item) for item in missing_texts))
+                    response = await transport.async_request(
+                        self._http_client(),
+                        "POST",
+                        url,
+                        headers=headers,
+                        json=payload,
+                        timeout=WTPSPLIT_TIMEOUT,
+                        idempotent=True,
+                    )
+                    span.set(bytes_in=len(response.content))
+            for index, group in zip(missing, _wtpsplit_segments(response, missing_texts)):
+                groups[index] = group
+            await asyncio.to_thread(
+                lambda: [cache.put(keys[index], groups[index]) for index in missing]
+            )
+        if isinstance(text, list):
+            return groups
+        return groups[0]
+
+    async def split_text_with_isanlp_rst(self,
+                                         text: str,
+                                         base_url: str | None = None,
+                                         token: str | None = None) -> list[str]:
+        url, headers, payload = _isanlp_request(text, base_url, token)
+        cache = self._service._get_segment_cache()
+        key = SegmentCache.make_key("isanlp", url, text)
+        cached = await asyncio.to_thread(cache.get, key, kind="isanlp")
+        if cached is not None:
+            return cached
+        async with self._rst_limit:
+            with tracing.span("isanlp_rst", bytes_out=len(text), cache_misses=1) as span:
+                response = await transport.async_request(
+                    self._http_client(),
+                    "POST",
+                    url,
+                    json=payload,
+                    headers=headers,
+                    timeout=ISANLP_TIMEOUT,
+                    idempotent=True,
+                )
+                span.set(bytes_in=len(response.content))
+        segments = _isanlp_segments(response, text)
+        await asyncio.to_thread(cache.put, key, segments)
+        return segments
+
+    async def split_cache_json_to_jsonl(self, threshold: float | None = None, mode: str | None = None):
+        mode = mode or SEGMENT_MODE
+        if mode not in SEGMENT_MODES:
+            raise ValueError(f"Unknown segment mode: {mode}")
+        manifests = await asyncio.to_thread(self._document_manifests)
+        await asyncio.gather(
+            *(self._split_document(manifest, threshold, mode) for manifest in manifests)
+        )
+
+    def _document_manifests(self) -> list[DocumentManifest]:
+        cache_root = self._service._cache_root
+        if not os.path.isdir(cache_root):
+            return []
+        return [
+            self._service._manifest_for_dir(entry.path)
+            for entry in os.scandir(cache_root)
+            if entry.is_dir() and DocumentManifest.is_document_dir(entry.path)
+        ]
+
+    async def _split_document(self,
+                              manifest: DocumentManifest,
+                              threshold: float | None,
+                              mode: str | None = None):
+        # 与同步版本使用同一种分句模式，两者写出的记录格式一致
+        if (mode or SEGMENT_MODE) == "stream":
+            # 按页顺序带着上一页尾句分句，一本书只能串行；直接使用同步实现，每本书占一个 wtpsplit 名额
+            async with self._wtpsplit_limit:
+                await asyncio.to_thread(self._service._stream_split_document, manifest, threshold)
+            return
+        if await asyncio.to_thread(self._service._stream_segmented, manifest):
+            # 已按 stream 模式分句的书不能再做逐页的边界修复
+            return
+        await self._split_pages(manifest, threshold)
+
+    async def _split_pages(self, manifest: DocumentManifest, threshold: float | None):
+        cache_dir = manifest.cache_dir
+        pending = [
+            page_number
+            for page_number in manifest.pages_with("ocr")
+            if not manifest.page(page_number).get("split")
+        ]
+
+        def _read_texts(batch: list[int]) -> list[str]:
+            texts = []
+            for page_number in batch:
+                text_path = os.path.join(cache_dir, f"page_{page_number}.json")
+                with open(text_path, "r", encoding="utf-8") as handle:
+                    texts.append(json.load(handle)["text"])
+            return texts
+
+        def _write_segments(batch: list[int], groups: list[list[str]]) -> None:
+            with JsonlBatchWriter() as writer:
+                for page_number, segments in zip(batch, groups):
+                    writer.write(os.path.join(cache_dir, f"page_{page_number}.jsonl"), segments)
+            manifest.mark(batch, split=True)
+
+        async def _split_batch(batch: list[int]):
+            texts = await asyncio.to_thread(_read_texts, batch)
+            groups = await self.split_text_with_wtpsplit(texts, threshold=threshold)
+            await asyncio.to_thread(_write_segments, batch, groups)
+
+        batches = await asyncio.to_thread(self._service._split_batches, cache_dir, pending)
+        await asyncio.gather(*(_split_batch(batch) for batch in batches))
+        changed = set(pending)
+
+        def _read_window(prev_path: str, next_path: str):
+            # 任一页的文件不存在时返回 False
+            if not os.path.exists(prev_path) or not os.path.exists(next_path):
+                return False
+            return _boundary_window(prev_path, next_path)
+
+        def _mark_fixed(page_num, next_num, prev_path, next_path, prev_fixed, next_fixed) -> None:
+            if not prev_fixed:
+                os.replace(prev_path, self._service._segment_path(cache_dir, page_num, True))
+            if not next_fixed:
+                os.replace(next_path, self._service._segment_path(cache_dir, next_num, True))
+            manifest.mark([page_num, next_num], fixed=True)
+
+        # 相邻页的边界修复互相依赖（会改写下一页开头），按顺序执行
+        page_nums = manifest.pages_with("split")
+        for page_num, next_num in zip(page_nums, page_nums[1:]):
+            if next_num != page_num + 1:
+                continue
+
+            prev_fixed = bool(manifest.page(page_num).get("fixed"))
+            next_fixed = bool(manifest.page(next_num).get("fixed"))
+            if prev_fixed and next_fixed:
+                continue
+
+            prev_path = self._service._segment_path(cache_dir, page_num, prev_fixed)
+            next_path = self._service._segment_path(cache_dir, next_num, next_fixed)
+            window = await asyncio.to_thread(_read_window, prev_path, next_path)
+            if window is False:
+                continue
+            if window is not None:
+                segments = await self.split_text_with_wtpsplit(
+                    " ".join(window[0]),
+                    threshold=threshold,
+                )
+                await asyncio.to_thread(_apply_boundary_fix, prev_path, next_path, window, segments)
+
+            await asyncio.to_thread(
+                _mark_fixed, page_num, next_num, prev_path, next_path, prev_fixed, next_fixed
+            )
+            changed.update((page_num, next_num))
+
+        # 与同步版本一样更新检索索引；索引写入 SQLite，放到线程中执行
+        if changed:
+            await asyncio.to_thread(self._service._update_index, manifest, changed)
+
+    async def split_long_sentences_in_jsonl(self,
+                                            jsonl_path: str,
+                                            min_length: int = 120,
+                                            output_path: str | None = None,
+                                            base_url: str | None = None,
+                                            token: str | None = None) -> str:
+        if not await asyncio.to_thread(os.path.exists, jsonl_path):
+            return f"File not found: {jsonl_path}"
+
+        output_path = output_path or (os.path.splitext(jsonl_path)[0] + ".rst.jsonl")
+        sentences = await asyncio.to_thread(
+            lambda: [text for text in _read_jsonl_texts(jsonl_path) if isinstance(text, str)]
+        )
+
+        async def _split(text: str) -> list[str]:
+            if len(text) < min_length:
+                return []
+            return await self.split_text_with_isanlp_rst(text, base_url=base_url, token=token)
+
+        # gather 保持输入顺序
+        results = await asyncio.gather(*(_split(text) for text in sentences))
+        texts: list[str] = []
+        changed = False
+        for text, segments in zip(sentences, results):
+            if segments:
+                texts.extend(segments)
+                changed = True
+            else:
+                texts.append(text)
+
+        if not texts:
+            return f"No text segments found in {jsonl_path}"
+
+        await asyncio.to_thread(_write_jsonl, texts, output_path)
+        # 清单和检索索引的更新同样在线程中执行
+        await asyncio.to_thread(self._service._mark_segment_file, jsonl_path, rst=True)
+        if not changed:
+            return f"No long segments found; wrote {output_path}"
+        return f"Split long segments and wrote {output_path}"
+
+    async def process_document(self,
+                               pdf_path: str,
+                               model: str | None = None,
+                               threshold: float | None = None,
+                               min_length: int = 120,
+                               segment_mode: str | None = None) -> dict:
+        result = {"ocr": await self.get_pdfimg_text(pdf_path, model=model)}
+        page_count = await asyncio.to_thread(get_pdf_page_count, pdf_path)
+        if isinstance(page_count, str):
+            return result
+        manifest = await asyncio.to_thread(self._service._open_document, pdf_path, page_count)
+        await self._split_document(manifest, threshold, segment_mode)
+
+        # 与同步的 rst_document 一致，只处理已修复边界的页面；
+        # 未修复的页面开头或结尾之后还会改变，提前做 RST 会过期（只有一页的书没有页边界）
+        pages = [
+            page_number
+            for page_number in manifest.pages_with("split" if page_count == 1 else "fixed")
+            if not manifest.page(page_number).get("rst")
+        ]
+        result["rst"] = await asyncio.gather(
+            *(
+                self.split_long_sentences_in_jsonl(
+                    self._service._segment_path(
+                        manifest.cache_dir,
+                        page_number,
+                        bool(manifest.page(page_number).get("fixed")),
+                    ),
+                    min_length=min_length,
+                )
+                for page_number in pages
+            ),
+            return_exceptions=True,
+        )
+        result["rst"] = [str(item) for item in result["rst"]]
+        return result
+
+    async def process_documents(self, pdf_paths: list[str], **kwargs) -> dict[str, dict]:
+        results = await asyncio.gather(
+            *(self.process_document(pdf_path, **kwargs) for pdf_path in pdf_paths),
+            return_exceptions=True,
+        )
+        return {
+            pdf_path: result if isinstance(result, dict) else {"error": str(result)}
+            for pdf_path, result in zip(pdf_paths, results)
+        }
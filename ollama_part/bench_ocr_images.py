@@ -0,0 +1,109 @@
+import argparse
+import difflib
+import json
+import sys
+import time
+
+from services import ollama_services
+from utility import get_pdf_page_count, render_pdf_page_bytes
+
+# 第一项作为质量基准，其余设置与它的识别结果比较
+DEFAULT_SETTINGS = [
+    {"dpi": 300, "gray": False, "image_format": "png"},
+    {"dpi": 200, "gray": False, "image_format": "png"},
+    {"dpi": 150, "gray": True, "image_format": "png"},
+    {"dpi": 150, "gray": True, "image_format": "jpeg"},
+    {"dpi": 200, "gray": True, "image_format": "jpeg", "max_pixels": 1_000_000},
+    {"dpi": 200, "gray": True, "image_format": "jpeg", "max_pixels": 500_000},
+]
+
+
+def _label(setting: dict) -> str:
+    parts = [f"{setting.get('dpi', 150)}dpi", setting.get("image_format", "png")]
+    if setting.get("gray"):
+        parts.append("gray")
+    if setting.get("max_pixels"):
+        parts.append(f"<={setting['max_pixels']}px")
+    return " ".join(parts)
+
+
+def run_benchmark(service, pdf_path: str, model: str | None, pages: list[int], settings: list[dict]):
+    reference: dict[int, str] = {}
+    rows = []
+    for setting in settings:
+        render_seconds = 0.0
+        ocr_seconds = 0.0
+        payload_bytes = 0
+        similarity = 0.0
+        for page_number in pages:
+            started = time.perf_counter()
+            image_bytes = render_pdf_page_bytes(pdf_path, page_number, **setting)
+            render_seconds += time.perf_counter() - started
+            if isinstance(image_bytes, str):
+                raise RuntimeError(image_bytes)
+            payload_bytes += len(image_bytes)
+
+            started = time.perf_counter()
+            text = service.ocr_image(image_bytes, model)
+            ocr_seconds += time.perf_counter() - started
+
+            if page_number not in reference:
+                reference[page_number] = text
+            similarity += difflib.SequenceMatcher(None, reference[page_number], text).ratio()
+        count = len(pages)
+        rows.append({
+            "setting": _label(setting),
+            "avg_payload_kb": round(payload_bytes / count / 1024, 1),
+            "avg_render_ms": round(render_seconds / count * 1000, 1),
+            "avg_ocr_ms": round(ocr_seconds / count * 1000, 1),
+            "similarity": round(similarity / count, 4),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare OCR latency and quality across page image settings."
+    )
+    parser.add_argument("pdf_path", help="Path to a PDF file.")
+    parser.add_argument("--model", default=None, help="Ollama vision model name.")
+    parser.add_argument(
+        "--pages",
+        default="1-3",
+        help="Page range to sample, e.g. 1-3 (default: 1-3).",
+    )
+    parser.add_argument(
+        "--settings",
+        default=None,
+        help="JSON list of render settings; the first one is the quality reference.",
+    )
+    parser.add_argument("--json", action="store_true", help="Print rows as JSON.")
+    args = parser.parse_args()
+
+    page_count = get_pdf_page_count(args.pdf_path)
+    if isinstance(page_count, str):
+        print(page_count)
+        return 1
+    first, _, last = args.pages.partition("-")
+    first_page = max(1, int(first))
+    last_page = min(page_count, int(last or first))
+    pages = list(range(first_page, last_page + 1))
+    settings = json.loads(args.settings) if args.settings else DEFAULT_SETTINGS
+
+    rows = run_benchmark(ollama_services(), args.pdf_path, args.model, pages, settings)
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return 0
+
+    header = f"{'setting':<36}{'payload KB':>12}{'render ms':>12}{'ocr ms':>12}{'similarity':>12}"
+    print(header)
+    for row in rows:
+        print(
+            f"{row['setting']:<36}{row['avg_payload_kb']:>12}{row['avg_render_ms']:>12}"
+            f"{row['avg_ocr_ms']:>12}{row['similarity']:>12}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
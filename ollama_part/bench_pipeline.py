@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from fake_servers import fake_isanlp_server, fake_ollama_server, fake_page_text, fake_wtpsplit_server
+
+
+def write_sample_pdf(path: str, page_count: int, seed: str = "") -> None:
+    # 生成只含 Helvetica 文本的最小 PDF，供 pdfinfo/pdftoppm 使用
+    objects: list[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for page_number in range(1, page_count + 1):
+        text = fake_page_text(f"{seed}:{page_number}", sentences=8)
+        lines = []
+        line = ""
+        for word in text.split():
+            if len(line) + len(word) > 80:
+                lines.append(line)
+                line = ""
+            line = f"{line} {word}".strip()
+        lines.append(line)
+        escaped = [
+            item.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            for item in lines
+        ]
+        stream = "BT /F1 11 Tf 14 TL 72 720 Td " + " ".join(f"({item}) Tj T*" for item in escaped) + " ET"
+        stream_bytes = stream.encode("latin-1")
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream_bytes), stream_bytes)
+        )
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, page_count)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for index, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (index, body)
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref_offset,
+    )
+    with open(path, "wb") as handle:
+        handle.write(output)
+
+
+class _Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: dict[str, list[float]] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage, fn):
+        def _timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                name = stage(*args, **kwargs) if callable(stage) else stage
+                self.add(name, time.perf_counter() - started)
+        return _timed
+
+    def summary(self) -> dict:
+        result = {}
+        for stage, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            result[stage] = {
+                "count": len(ordered),
+                "p50_ms": round(_percentile(ordered, 50) * 1000, 2),
+                "p95_ms": round(_percentile(ordered, 95) * 1000, 2),
+                "p99_ms": round(_percentile(ordered, 99) * 1000, 2),
+            }
+        return result
+
+
+def _percentile(ordered: list[float], percent: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 计，macOS 以字节计
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def run_benchmark(args) -> dict:
+    server_options = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "burst_every": args.burst_every,
+        "burst_length": args.burst_length,
+    }
+    work_dir = tempfile.mkdtemp(prefix="echo_player_bench_")
+    ollama = fake_ollama_server(**server_options).start()
+    wtpsplit = fake_wtpsplit_server(**server_options).start()
+    isanlp = fake_isanlp_server(**server_options).start()
+    os.environ["OLLAMA_BASE_URL"] = ollama.url
+    os.environ["WTPSPLIT_BASE_URL"] = f"{wtpsplit.url}/split"
+    os.environ["ISANLP_RST_URL"] = f"{isanlp.url}/rst"
+
+    # 导入放在环境变量设置之后
+    import tracing
+    import transport
+    from job_queue import FAILURE_PREFIXES
+    from services import ollama_services
+
+    tracer = tracing.get_tracer()
+    tracer.enable(args.trace or None)
+    tracer.reset()
+
+    recorder = _Recorder()
+    transport.request = recorder.wrap(
+        lambda method, url, **kwargs: "wtpsplit" if url.endswith("/split") else (
+            "isanlp" if url.endswith("/rst") else "ollama_http"
+        ),
+        transport.request,
+    )
+    try:
+        service = ollama_services()
+        service._cache_root = os.path.join(work_dir, "cache")
+        service._client.chat = recorder.wrap("ocr_chat", service._client.chat)
+        service._render_pages = recorder.wrap("render", service._render_pages)
+
+        pdf_paths = []
+        for index in range(args.documents):
+            pdf_path = os.path.join(work_dir, f"book_{index + 1}.pdf")
+            write_sample_pdf(pdf_path, args.pages, seed=str(index))
+            pdf_paths.append(pdf_path)
+
+        stages = {}
+        started = time.perf_counter()
+        ocr_results = [
+            service.get_pdfimg_text(
+                pdf_path,
+                model=args.model,
+                concurrency=args.concurrency,
+                text_mode=args.text_mode,
+            )
+            for pdf_path in pdf_paths
+        ]
+        stages["ocr"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        service.split_cache_json_to_jsonl()
+        stages["split"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        rst_files = 0
+        rst_results = []
+        for pdf_path in pdf_paths:
+            cache_dir = service._open_document(pdf_path, args.pages).cache_dir
+            for name in sorted(os.listdir(cache_dir)):
+                if name.endswith(".fixed.jsonl"):
+                    rst_results.append(service.split_long_sentences_in_jsonl(
+                        os.path.join(cache_dir, name),
+                        min_length=args.min_length,
+                    ))
+                    rst_files += 1
+        stages["rst"] = time.perf_counter() - started
+
+        total_pages = args.pages * args.documents
+        # 阶段报错时吞吐量没有意义（例如缺少 pdfinfo 时每个阶段都立即返回）
+        failures = {
+            "ocr": sum(str(result).startswith(FAILURE_PREFIXES) for result in ocr_results),
+            "split": args.documents * args.pages - rst_files,
+            "rst": sum(str(result).startswith(FAILURE_PREFIXES) for result in rst_results),
+        }
+        # 某一阶段失败后，后面阶段处理的页面也不完整
+        throughput = {}
+        failed = False
+        for name, value in stages.items():
+            failed = failed or bool(failures[name])
+            throughput[name] = round(total_pages / value, 2) if value and not failed else None
+        return {
+            "ok": not any(failures.values()),
+            "documents": args.documents,
+            "pages": total_pages,
+            "ocr_results": ocr_results,
+            "rst_files": rst_files,
+            "failures": failures,
+            "stage_seconds": {name: round(value, 3) for name, value in stages.items()},
+            "pages_per_second": throughput,
+            "latency": recorder.summary(),
+            "spans": tracer.summary(),
+            "server_requests": {
+                "ollama": ollama.requests,
+                "wtpsplit": wtpsplit.requests,
+                "isanlp": isanlp.requests,
+            },
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+    finally:
+        ollama.stop()
+        wtpsplit.stop()
+        isanlp.stop()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the OCR/split/RST pipeline against local stand-in servers."
+    )
+    parser.add_argument("--documents", type=int, default=2, help="Number of generated PDFs.")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per generated PDF.")
+    parser.add_argument("--model", default="fake-vision:latest", help="Model name to request.")
+    parser.add_argument("--concurrency", type=int, default=4, help="In-flight OCR pages.")
+    parser.add_argument(
+        "--text-mode",
+        default="ocr",
+        choices=("auto", "text", "ocr"),
+        help="Text layer mode; generated PDFs have a text layer, so 'auto' skips OCR.",
+    )
+    parser.add_argument("--min-length", type=int, default=120, help="RST split threshold.")
+    parser.add_argument("--latency", type=float, default=0.02, help="Base server latency (s).")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Extra random latency (s).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Random 500 probability.")
+    parser.add_argument("--burst-every", type=int, default=0, help="503 burst period (requests).")
+    parser.add_argument("--burst-length", type=int, default=0, help="503s at the start of each burst.")
+    parser.add_argument("--trace", default="", help="Also write the span trace to this JSONL file.")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated work directory.")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if result["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Iterator
+
+BOOK_STORE_NAME = "book.sqlite3"
+SEGMENT_KINDS = ("split", "rst")
+
+
+class BookStore:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " page INTEGER PRIMARY KEY,"
+            " text TEXT,"
+            " model TEXT,"
+            " state TEXT NOT NULL DEFAULT '{}')"
+        )
+        # seq 是整本书内的句子编号（从 1 开始），按 (page, idx) 顺序在读取时重排
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS segments ("
+            " kind TEXT NOT NULL,"
+            " page INTEGER NOT NULL,"
+            " idx INTEGER NOT NULL,"
+            " text TEXT NOT NULL,"
+            " seq INTEGER,"
+            " PRIMARY KEY (kind, page, idx)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS segments_seq ON segments (kind, seq)"
+        )
+        self._dirty = {
+            kind
+            for (kind,) in self._conn.execute(
+                "SELECT DISTINCT kind FROM segments WHERE seq IS NULL"
+            )
+        }
+
+    @classmethod
+    def for_cache_dir(cls, cache_dir: str) -> "BookStore":
+        return cls(os.path.join(cache_dir, BOOK_STORE_NAME))
+
+    @staticmethod
+    def exists(cache_dir: str) -> bool:
+        return os.path.exists(os.path.join(cache_dir, BOOK_STORE_NAME))
+
+    def put_page_text(self, page_number: int, text: str, model: str | None = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pages (page, text, model) VALUES (?, ?, ?)"
+                " ON CONFLICT(page) DO UPDATE SET text = excluded.text, model = excluded.model",
+                (page_number, text, model),
+            )
+
+    def get_page_text(self, page_number: int) -> str | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM pages WHERE page = ?", (page_number,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_segments(self, page_number: int, texts: list[str], kind: str = "split") -> None:
+        if kind not in SEGMENT_KINDS:
+            raise ValueError(f"Unknown segment kind: {kind}")
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "DELETE FROM segments WHERE kind = ? AND page = ?", (kind, page_number)
+                )
+                self._conn.executemany(
+                    "INSERT INTO segments (kind, page, idx, text) VALUES (?, ?, ?, ?)",
+                    [(kind, page_number, idx, text) for idx, text in enumerate(texts, start=1)],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._dirty.add(kind)
+
+    def get_segments(self, page_number: int, kind: str = "split") -> list[str] | None:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT text FROM segments WHERE kind = ? AND page = ? ORDER BY idx",
+                (kind, page_number),
+            ).fetchall()
+        return [row[0] for row in rows] if rows else None
+
+    def segment_counts(self, kind: str = "split") -> dict[int, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page, COUNT(*) FROM segments WHERE kind = ? GROUP BY page", (kind,)
+            ).fetchall()
+        return dict(rows)
+
+    def set_state(self, page_number: int, **state) -> None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM pages WHERE page = ?", (page_number,)
+            ).fetchone()
+            merged = json.loads(row[0]) if row else {}
+            merged.update(state)
+            self._conn.execute(
+                "INSERT INTO pages (page, state) VALUES (?, ?)"
+                " ON CONFLICT(page) DO UPDATE SET state = excluded.state",
+                (page_number, json.dumps(merged)),
+            )
+
+    def states(self) -> dict[str, dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT page, state FROM pages").fetchall()
+        return {str(page_number): json.loads(state) for page_number, state in rows}
+
+    def _renumber(self, kind: str) -> None:
+        if kind not in self._dirty:
+            return
+        self._conn.execute("BEGIN")
+        self._conn.execute(
+            "UPDATE segments SET seq = numbered.seq FROM ("
+            " SELECT page, idx, ROW_NUMBER() OVER (ORDER BY page, idx) AS seq"
+            " FROM segments WHERE kind = ?) AS numbered"
+            " WHERE segments.kind = ? AND segments.page = numbered.page"
+            " AND segments.idx = numbered.idx",
+            (kind, kind),
+        )
+        self._conn.execute("COMMIT")
+        self._dirty.discard(kind)
+
+    def sentence_count(self, kind: str = "split") -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM segments WHERE kind = ?", (kind,)
+            ).fetchone()[0]
+
+    def get_sentence(self, sentence_id: int, kind: str = "split") -> tuple[int, int, str] | None:
+        # 返回 (页码, 页内序号, 文本)
+        with self._lock:
+            self._renumber(kind)
+            row = self._conn.execute(
+                "SELECT page, idx, text FROM segments WHERE kind = ? AND seq = ?",
+                (kind, sentence_id),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def sentence_id(self, page_number: int, idx: int, kind: str = "split") -> int | None:
+        with self._lock:
+            self._renumber(kind)
+            row = self._conn.execute(
+                "SELECT seq FROM segments WHERE kind = ? AND page = ? AND idx = ?",
+                (kind, page_number, idx),
+            ).fetchone()
+        return row[0] if row else None
+
+    def iter_sentences(self,
+                       kind: str = "split",
+                       start_id: int = 1,
+                       batch_size: int = 500) -> Iterator[tuple[int, int, int, str]]:
+        # 逐批读取 (编号, 页码, 页内序号, 文本)，不一次载入整本书
+        next_id = start_id
+        while True:
+            with self._lock:
+                self._renumber(kind)
+                rows = self._conn.execute(
+                    "SELECT seq, page, idx, text FROM segments"
+                    " WHERE kind = ? AND seq >= ? ORDER BY seq LIMIT ?",
+                    (kind, next_id, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            yield from (tuple(row) for row in rows)
+            next_id = rows[-1][0] + 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
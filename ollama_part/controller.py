@@ -1,63 +1,329 @@
-from PySide6.QtCore import QObject, QThread, Signal
+import itertools
+import threading
+import time
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
 
 from ui import MainWindow
 
+PROGRESS_INTERVAL = 0.1
+TOKEN_INTERVAL = 0.05
+# 检索结果附带的前文句数
+CONTEXT_SENTENCES = 3
+
+
+class _JobSignals(QObject):
+    finished = Signal(str, object)
+    error = Signal(str, str)
+    progress = Signal(str, int, int)
+    tokens = Signal(str, str)
 
-class _Worker(QObject):
-    finished = Signal(object)
-    error = Signal(str)
 
-    def __init__(self, fn, *args, **kwargs):
+class _Job(QRunnable):
+    def __init__(self, job_id: str, fn, signals: _JobSignals):
         super().__init__()
+        # 任务对象由控制器持有，结束后再释放，保证 cancel 时仍然有效
+        self.setAutoDelete(False)
+        self.job_id = job_id
+        self.cancel_event = threading.Event()
         self._fn = fn
-        self._args = args
-        self._kwargs = kwargs
+        self._signals = signals
+        self._last_progress = 0.0
+        self._token_lock = threading.Lock()
+        self._token_buffer: list[str] = []
+        self._last_tokens = 0.0
+
+    def report_progress(self, done: int, total: int):
+        # 在工作线程中调用；限制信号频率，避免淹没 GUI 线程
+        now = time.monotonic()
+        if done < total and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        self._signals.progress.emit(self.job_id, done, total)
+
+    def report_tokens(self, token: str):
+        # 按时间批量发送流式文本，最多每 TOKEN_INTERVAL 秒重绘一次
+        with self._token_lock:
+            self._token_buffer.append(token)
+            now = time.monotonic()
+            if now - self._last_tokens < TOKEN_INTERVAL:
+                return
+            self._last_tokens = now
+            text = "".join(self._token_buffer)
+            self._token_buffer.clear()
+        self._signals.tokens.emit(self.job_id, text)
+
+    def flush_tokens(self):
+        with self._token_lock:
+            text = "".join(self._token_buffer)
+            self._token_buffer.clear()
+        if text:
+            self._signals.tokens.emit(self.job_id, text)
 
     def run(self):
         try:
-            result = self._fn(*self._args, **self._kwargs)
-            self.finished.emit(result)
+            result = self._fn(self)
+            self.flush_tokens()
+            self._signals.finished.emit(self.job_id, result)
         except Exception as exc:
-            self.error.emit(str(exc))
+            self._signals.error.emit(self.job_id, str(exc))
+
+
+class _PageTokens:
+    # 并发识别时各页的文本会交错到达：只直接显示一页，其余页面先缓存，
+    # 轮到它们时按页码顺序整段追加
+    def __init__(self, job: _Job):
+        self._job = job
+        self._lock = threading.Lock()
+        self._current: int | None = None
+        self._buffers: dict[int, list[str]] = {}
+        self._finished: set[int] = set()
+
+    def token(self, page_number: int, token: str):
+        with self._lock:
+            if self._current is None:
+                self._current = page_number
+            if page_number != self._current:
+                self._buffers.setdefault(page_number, []).append(token)
+                return
+            self._job.report_tokens(token)
+
+    def page_finished(self, page_number: int):
+        with self._lock:
+            if page_number != self._current:
+                self._finished.add(page_number)
+                return
+            self._current = None
+            parts = ["\n\n"]
+            while self._buffers:
+                next_page = min(self._buffers)
+                parts.append("".join(self._buffers.pop(next_page)))
+                if next_page not in self._finished:
+                    self._current = next_page
+                    break
+                self._finished.discard(next_page)
+                parts.append("\n\n")
+            # 在锁内发送，保证下一页的后续片段排在缓存内容之后
+            self._job.report_tokens("".join(parts))
+
+    def flush(self):
+        with self._lock:
+            parts = [
+                "".join(self._buffers.pop(page_number))
+                for page_number in sorted(self._buffers)
+            ]
+            self._current = None
+            self._finished.clear()
+            if parts:
+                self._job.report_tokens("\n\n".join(parts))
+
 
 class MainController:
-    def __init__(self, view: MainWindow , analysis_service):
+    def __init__(self,
+                 view: MainWindow ,
+                 analysis_service,
+                 max_workers: int | None = None,
+                 tts_service=None):
         self.view = view
         self.service = analysis_service
-        self._threads = []
-        self._workers = []
+        self.tts_service = tts_service
+        # 当前文档和句子编号；播放原音从这里开始
+        self.current_pdf: str | None = None
+        self.current_sentence = 1
+        # (文档, 读取函数)；每次播放都重新打开会统计所有页面文件的行数
+        self._reader: tuple[str, object] | None = None
+        self._reader_lock = threading.Lock()
+        self._pool = QThreadPool()
+        if max_workers:
+            self._pool.setMaxThreadCount(max_workers)
+        self._job_ids = itertools.count(1)
+        self._jobs: dict[str, tuple[_Job, object, str | None]] = {}
+        self._keys: dict[str, str] = {}
+        self._signals = _JobSignals()
+        self._signals.finished.connect(self._on_job_finished)
+        self._signals.error.connect(self._on_job_error)
+        self._signals.progress.connect(self._on_job_progress)
+        self._signals.tokens.connect(self._on_job_tokens)
         self.view.get_models_signal.connect(self.on_get_models)
         self.view.say_hello_signal.connect(self.on_say_hello)
+        self.view.ocr_pdf_signal.connect(self.on_ocr_pdf)
+        self.view.cancel_signal.connect(self.cancel_all)
+        self.view.metrics_signal.connect(self.on_show_metrics)
+        self.view.play_original_signal.connect(self.on_play_original)
+        self.view.show_segments_signal.connect(self.on_show_segments)
+        self.view.search_library_signal.connect(self.on_search_library)
+        self.view.segment_browser.sentence_selected.connect(self.on_sentence_selected)
+        self.view.segment_browser.search_requested.connect(self.on_search_segments)
+
+    def submit(self, fn, on_success, key: str | None = None) -> str:
+        # 相同 key 的任务仍在运行时直接复用，不重复提交
+        if key is not None and key in self._keys:
+            return self._keys[key]
+        job_id = str(next(self._job_ids))
+        job = _Job(job_id, fn, self._signals)
+        self._jobs[job_id] = (job, on_success, key)
+        if key is not None:
+            self._keys[key] = job_id
+        self._pool.start(job)
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        entry = self._jobs.get(job_id)
+        if entry is None:
+            return False
+        job = entry[0]
+        job.cancel_event.set()
+        # 尚未开始的任务直接从队列中移除
+        if self._pool.tryTake(job):
+            self._finish_job(job_id)
+        return True
+
+    def cancel_all(self):
+        for job_id in list(self._jobs):
+            self.cancel(job_id)
+
+    def _finish_job(self, job_id: str):
+        job, on_success, key = self._jobs.pop(job_id, (None, None, None))
+        if key is not None and self._keys.get(key) == job_id:
+            del self._keys[key]
+        return on_success
 
-    def _run_in_thread(self, fn, on_success):
-        worker = _Worker(fn)
-        thread = QThread()
-        worker.moveToThread(thread)
-        thread.started.connect(worker.run)
-        worker.finished.connect(on_success)
-        worker.error.connect(self.view.show_error)
-        worker.error.connect(thread.quit)
-        worker.error.connect(worker.deleteLater)
-        worker.finished.connect(thread.quit)
-        worker.finished.connect(worker.deleteLater)
-        thread.finished.connect(thread.deleteLater)
-        thread.finished.connect(lambda: self._cleanup_thread(thread, worker))
-        self._threads.append(thread)
-        self._workers.append(worker)
-        thread.start()
-
-    def _cleanup_thread(self, thread, worker):
-        if thread in self._threads:
-            self._threads.remove(thread)
-        if worker in self._workers:
-            self._workers.remove(worker)
+    def _on_job_finished(self, job_id: str, result):
+        on_success = self._finish_job(job_id)
+        if on_success is not None:
+            on_success(result)
+
+    def _on_job_error(self, job_id: str, message: str):
+        self._finish_job(job_id)
+        self.view.show_error(message)
+
+    def _on_job_progress(self, job_id: str, done: int, total: int):
+        if job_id in self._jobs:
+            self.view.show_progress(done, total)
+
+    def _on_job_tokens(self, job_id: str, text: str):
+        if job_id in self._jobs:
+            self.view.append_response(text)
 
     def on_get_models(self):
-        self._run_in_thread(self.service.get_models, self.view.show_result)
+        self.submit(
+            lambda job: self.service.get_models(),
+            self.view.show_result,
+            key="get_models",
+        )
+
+    def on_show_metrics(self):
+        self.submit(
+            lambda job: self.service.get_trace_summary(),
+            self.view.show_result,
+            key="metrics",
+        )
+
+    def on_play_original(self):
+        if self.tts_service is None or self.current_pdf is None:
+            self.view.show_error("Open a document first.")
+            return
+        pdf_path = self.current_pdf
+        sentence_id = self.current_sentence
+        self.submit(
+            lambda job: self.tts_service.get_utterance(
+                self._sentence_reader(pdf_path),
+                sentence_id,
+            ),
+            self.view.play_audio,
+            key=f"tts:{pdf_path}:{sentence_id}",
+        )
+
+    def _sentence_reader(self, pdf_path: str, rows=None):
+        # 在工作线程中调用；同一文档复用同一个读取函数，句子浏览器打开后改用它的 SegmentRows
+        with self._reader_lock:
+            if rows is not None or self._reader is None or self._reader[0] != pdf_path:
+                self._reader = (pdf_path, self.service.sentence_reader(pdf_path, rows=rows))
+            return self._reader[1]
+
+    def _show_segments(self, pdf_path: str, rows):
+        self._sentence_reader(pdf_path, rows)
+        self.view.show_segments(rows)
+
+    def on_show_segments(self):
+        if self.current_pdf is None:
+            self.view.show_error("Open a document first.")
+            return
+        pdf_path = self.current_pdf
+        self.submit(
+            lambda job: self.service.open_segment_rows(pdf_path),
+            lambda rows: self._show_segments(pdf_path, rows),
+            key=f"segments:{pdf_path}",
+        )
+
+    def on_sentence_selected(self, sentence_id: int):
+        self.current_sentence = sentence_id
+
+    def on_search_segments(self, query: str, start: int):
+        browser = self.view.segment_browser
+        rows = browser.model.rows
+        if rows is None:
+            return
+
+        def _show(row):
+            # 结果返回前关键字已经改变时丢弃
+            if browser.search_edit.text() == query:
+                browser.show_search_result(row)
+
+        self.submit(lambda job: rows.find(query, start), _show)
+
+    def on_search_library(self, query: str):
+        def _search(job: _Job) -> list[str]:
+            hits = self.service.search_sentences(query, context=CONTEXT_SENTENCES)
+            lines = []
+            for hit in hits:
+                context = " ".join(item["text"] for item in hit["context"])
+                lines.append(
+                    f"{hit['document']} p.{hit['page']} #{hit['idx']}: "
+                    f"{context + ' | ' if context else ''}{hit['text']}"
+                )
+            return lines or [f"No matches for {query}"]
+
+        self.submit(_search, self.view.show_result, key=f"search:{query}")
 
     def on_say_hello(self):
         selected_model = self.view.get_selected_value()
-        self._run_in_thread(
-            lambda: self.service.say_hello(selected_model),
-            self.view.show_response,
-        )
+
+        def _stream_hello(job: _Job) -> str:
+            parts = []
+            for token in self.service.say_hello_stream(selected_model):
+                if job.cancel_event.is_set():
+                    break
+                parts.append(token)
+                job.report_tokens(token)
+            return "".join(parts)
+
+        key = f"say_hello:{selected_model}"
+        if key not in self._keys:
+            self.view.show_response("")
+        self.submit(_stream_hello, self.view.show_response, key=key)
+
+    def on_ocr_pdf(self, pdf_path: str):
+        if pdf_path != self.current_pdf:
+            self.current_pdf = pdf_path
+            self.current_sentence = 1
+        selected_model = self.view.get_selected_value()
+        key = f"ocr:{pdf_path}"
+        if key not in self._keys:
+            self.view.show_response("")
+
+        def _ocr(job: _Job) -> str:
+            pages = _PageTokens(job)
+            result = self.service.get_pdfimg_text(
+                pdf_path,
+                model=selected_model,
+                cancel_event=job.cancel_event,
+                progress=job.report_progress,
+                on_token=pages.token,
+                on_page_finished=pages.page_finished,
+            )
+            # 失败或取消的页面没有轮到显示时，结束前补上
+            pages.flush()
+            return result
+
+        self.submit(_ocr, self.view.finish_stream, key=key)
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_WORDS = (
+    "the boy looked at the owl and the letter on the table while his aunt "
+    "shouted from the kitchen about breakfast and the rain outside kept falling "
+    "over the quiet street where nobody ever expected anything strange to happen"
+).split()
+
+
+def fake_page_text(seed: str, sentences: int = 12) -> str:
+    rng = random.Random(seed)
+    result = []
+    for _ in range(sentences):
+        words = [rng.choice(_WORDS) for _ in range(rng.randint(4, 28))]
+        result.append(" ".join(words).capitalize() + rng.choice([".", ".", ".", "!", "?"]))
+    return " ".join(result)
+
+
+class FakeServer:
+    def __init__(self,
+                 routes: dict,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 error_rate: float = 0.0,
+                 burst_every: int = 0,
+                 burst_length: int = 0,
+                 seed: int = 0):
+        # routes: {("POST", "/api/chat"): handler(body) -> (status, payload)}
+        self.routes = routes
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _next_fault(self) -> int | None:
+        # 每 burst_every 个请求中前 burst_length 个返回 503，其余按 error_rate 随机返回 500
+        with self._lock:
+            index = self.requests
+            self.requests += 1
+            roll = self._rng.random()
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if self.burst_every and index % self.burst_every < self.burst_length:
+            return 503
+        if roll < self.error_rate:
+            return 500
+        return None
+
+    def _handler_class(self):
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _dispatch(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                handler = server.routes.get((method, self.path.split("?", 1)[0]))
+                if handler is None:
+                    self._send(404, {"error": "not found"})
+                    return
+                fault = server._next_fault()
+                if fault is not None:
+                    self._send(fault, {"error": "injected failure"})
+                    return
+                body = json.loads(raw) if raw else {}
+                status, payload = handler(body)
+                if isinstance(payload, list) and payload and isinstance(payload[0], bytes):
+                    self._send_stream(status, payload)
+                else:
+                    self._send(status, payload)
+
+            def _send(self, status: int, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, status: int, lines: list[bytes]):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for line in lines:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def log_message(self, *args):
+                pass
+
+        return _Handler
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _ndjson(chunks: list[dict]) -> list[bytes]:
+    return [json.dumps(chunk).encode("utf-8") + b"\n" for chunk in chunks]
+
+
+def _stream_words(text: str) -> list[str]:
+    return re.findall(r"\S+\s*", text) or [""]
+
+
+def fake_ollama_server(models: list[str] | None = None, **options) -> FakeServer:
+    models = models or ["fake-vision:latest"]
+
+    def _tags(body):
+        return 200, {"models": [{"name": name, "model": name} for name in models]}
+
+    def _generate(body):
+        model = body.get("model", "")
+        text = "Hello! I am a stand-in model." if body.get("prompt") else ""
+        if body.get("stream", True) and text:
+            chunks = [
+                {"model": model, "created_at": _now(), "response": word, "done": False}
+                for word in _stream_words(text)
+            ]
+            chunks.append({"model": model, "created_at": _now(), "response": "", "done": True})
+            return 200, _ndjson(chunks)
+        return 200, {"model": model, "created_at": _now(), "response": text, "done": True}
+
+    def _chat(body):
+        model = body.get("model", "")
+        messages = body.get("messages", [])
+        images = [image for message in messages for image in message.get("images") or []]
+        seed = hashlib.sha256("".join(images).encode("ascii")).hexdigest()
+        text = fake_page_text(seed)
+        if messages and messages[-1].get("role") == "assistant":
+            prefix = messages[-1].get("content", "")
+            text = text[len(prefix):] if text.startswith(prefix) else text
+        if body.get("stream", True):
+            chunks = [
+                {
+                    "model": model,
+                    "created_at": _now(),
+                    "message": {"role": "assistant", "content": word},
+                    "done": False,
+                }
+                for word in _stream_words(text)
+            ]
+            chunks.append({
+                "model": model,
+                "created_at": _now(),
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+            })
+            return 200, _ndjson(chunks)
+        return 200, {
+            "model": model,
+            "created_at": _now(),
+            "message": {"role": "assistant", "content": text},
+            "done": True,
+        }
+
+    return FakeServer(
+        {
+            ("GET", "/api/tags"): _tags,
+            ("POST", "/api/generate"): _generate,
+            ("POST", "/api/chat"): _chat,
+        },
+        **options,
+    )
+
+
+def _split_sentences(text: str) -> list[str]:
+    return [part for part in re.split(r"(?<=[.!?])\s+", text.strip()) if part]
+
+
+def fake_wtpsplit_server(**options) -> FakeServer:
+    def _split(body):
+        texts = body.get("texts", "")
+        texts = texts if isinstance(texts, list) else [texts]
+        return 200, {"segments": [_split_sentences(text) for text in texts]}
+
+    return FakeServer({("POST", "/split"): _split}, **options)
+
+
+def fake_isanlp_server(**options) -> FakeServer:
+    def _rst(body):
+        # 按逗号和连词切分，返回闭区间 [start, end] 列表
+        text = body.get("text", "")
+        spans = []
+        start = 0
+        for match in re.finditer(r"(?<=,)\s+|\s+(?=and |while |where )", text):
+            spans.append([start, match.start() - 1])
+            start = match.end()
+        spans.append([start, len(text) - 1])
+        return 200, [span for span in spans if span[1] >= span[0]]
+
+    return FakeServer({("POST", "/rst"): _rst}, **options)
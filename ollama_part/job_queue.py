@@ -0,0 +1,434 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+try:
+    import config as _config
+except ImportError:
+    try:
+        from . import config as _config
+    except ImportError:
+        _config = None
+
+JOB_QUEUE_NAME = "jobs.sqlite3"
+# 各阶段以字符串报告结果；以这些前缀开头的视为失败
+FAILURE_PREFIXES = (
+    "Error", "Failed", "File not found", "Unknown", "Invalid", "Cancelled", "No PDF", "Incomplete",
+)
+# 每个端点同时运行的任务数和每分钟最多启动的任务数（0 表示不限）
+JOB_ENDPOINT_LIMITS = getattr(_config, "JOB_ENDPOINT_LIMITS", None) if _config else None
+DEFAULT_ENDPOINT_LIMITS = {
+    "ollama": {"concurrency": 2, "per_minute": 0},
+    "wtpsplit": {"concurrency": 2, "per_minute": 0},
+    "isanlp": {"concurrency": 2, "per_minute": 0},
+    # 打包只读写本地文件
+    "local": {"concurrency": 1, "per_minute": 0},
+}
+JOB_OCR_CHUNK_PAGES = getattr(_config, "JOB_OCR_CHUNK_PAGES", 4) if _config else 4
+JOB_RST_CHUNK_PAGES = getattr(_config, "JOB_RST_CHUNK_PAGES", 16) if _config else 16
+JOB_MAX_ATTEMPTS = getattr(_config, "JOB_MAX_ATTEMPTS", 3) if _config else 3
+# 运行中的任务由取到它的进程定期续租；租约过期（进程已退出）的任务才会重新排队
+JOB_LEASE_SECONDS = getattr(_config, "JOB_LEASE_SECONDS", 60) if _config else 60
+
+# 阶段 -> (使用的端点, 必须先完成的阶段)
+STAGE_ENDPOINTS = {"ocr": "ollama", "split": "wtpsplit", "rst": "isanlp", "pack": "local"}
+STAGE_AFTER = {"ocr": None, "split": "ocr", "rst": "split", "pack": "rst"}
+
+
+class JobQueue:
+    # 任务持久化在 SQLite 中；进程退出后它运行中的任务在租约过期后回到排队状态，已完成的任务不会重做
+    def __init__(self, path: str, lease_seconds: float | None = None):
+        self.path = path
+        self.lease_seconds = JOB_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        # 同一进程中的多个队列对象也各自持有自己的任务
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY,"
+            " pdf_path TEXT NOT NULL,"
+            " stage TEXT NOT NULL,"
+            " first_page INTEGER NOT NULL,"
+            " last_page INTEGER NOT NULL,"
+            " priority INTEGER NOT NULL DEFAULT 0,"
+            " state TEXT NOT NULL DEFAULT 'queued',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " result TEXT,"
+            " updated REAL NOT NULL DEFAULT 0,"
+            " owner TEXT,"
+            " lease REAL NOT NULL DEFAULT 0,"
+            " UNIQUE (pdf_path, stage, first_page))"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            # 旧版队列文件没有租约列；其中运行中的任务租约为 0，下次取任务时重新排队
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN lease REAL NOT NULL DEFAULT 0")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_next ON jobs (state, stage, priority DESC, id)"
+        )
+
+    @classmethod
+    def for_cache_root(cls, cache_root: str) -> "JobQueue":
+        return cls(os.path.join(cache_root, JOB_QUEUE_NAME))
+
+    def add_document(self,
+                     pdf_path: str,
+                     page_count: int,
+                     priority: int = 0,
+                     stages: tuple[str, ...] = ("ocr", "split", "rst", "pack")) -> int:
+        # OCR 和 RST 按页段拆成多个任务，分句和打包按整本书进行；重复添加不会产生重复任务
+        rows = []
+        for stage in stages:
+            if stage in ("split", "pack"):
+                rows.append((pdf_path, stage, 1, page_count, priority))
+                continue
+            chunk = JOB_OCR_CHUNK_PAGES if stage == "ocr" else JOB_RST_CHUNK_PAGES
+            for first_page in range(1, page_count + 1, chunk):
+                last_page = min(page_count, first_page + chunk - 1)
+                rows.append((pdf_path, stage, first_page, last_page, priority))
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO jobs (pdf_path, stage, first_page, last_page, priority)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            # 已存在但未完成的任务按新的优先级调整
+            self._conn.execute(
+                "UPDATE jobs SET priority = ? WHERE pdf_path = ? AND state = 'queued'",
+                (priority, pdf_path),
+            )
+            self._conn.execute("COMMIT")
+            return self._conn.total_changes - before
+
+    def claim(self, stage: str) -> tuple[int, str, int, int] | None:
+        # 取出该阶段优先级最高、且前置阶段已经没有未完成（或失败）任务的一项。
+        # 查询和更新在同一个写事务里，多个进程共用队列时不会取到同一项
+        after = STAGE_AFTER[stage]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                self._requeue_expired(now)
+                row = self._conn.execute(
+                    "SELECT id, pdf_path, first_page, last_page FROM jobs AS job"
+                    " WHERE state = 'queued' AND stage = ?"
+                    " AND NOT EXISTS (SELECT 1 FROM jobs AS prior"
+                    "  WHERE prior.pdf_path = job.pdf_path AND prior.stage = ?"
+                    "  AND prior.state IN ('queued', 'running', 'failed', 'blocked'))"
+                    " ORDER BY priority DESC, id LIMIT 1",
+                    (stage, after or ""),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET state = 'running', attempts = attempts + 1, updated = ?,"
+                        " owner = ?, lease = ? WHERE id = ?",
+                        (now, self.owner, now + self.lease_seconds, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return tuple(row) if row is not None else None
+
+    def _requeue_expired(self, now: float) -> None:
+        # 调用方已开启写事务
+        self._conn.execute(
+            "UPDATE jobs SET state = 'queued', owner = NULL WHERE state = 'running' AND lease < ?",
+            (now,),
+        )
+
+    def renew(self) -> int:
+        # 延长本进程所有运行中任务的租约；调度器在租约到期前定期调用
+        with self._lock:
+            now = time.time()
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease = ? WHERE state = 'running' AND owner = ?",
+                (now + self.lease_seconds, self.owner),
+            )
+            return cursor.rowcount
+
+    def release(self) -> int:
+        # 放弃本进程运行中的任务（例如强制退出时），其他进程可以立即取走
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET state = 'queued', owner = NULL WHERE state = 'running' AND owner = ?",
+                (self.owner,),
+            )
+            return cursor.rowcount
+
+    def finish(self, job_id: int, result: str, ok: bool) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT pdf_path, stage, attempts FROM jobs"
+                    " WHERE id = ? AND state = 'running' AND owner = ?",
+                    (job_id, self.owner),
+                ).fetchone()
+                if row is None:
+                    # 租约已过期，任务已被其他进程重新取走，以对方的结果为准
+                    self._conn.execute("COMMIT")
+                    return
+                pdf_path, stage, attempts = row
+                if ok:
+                    state = "done"
+                else:
+                    state = "queued" if attempts < JOB_MAX_ATTEMPTS else "failed"
+                self._conn.execute(
+                    "UPDATE jobs SET state = ?, result = ?, updated = ?, owner = NULL WHERE id = ?",
+                    (state, result, time.time(), job_id),
+                )
+                if state == "failed":
+                    # 后续阶段等这一项重试成功后再运行，不计入待处理数
+                    self._set_later_stages(pdf_path, stage, ("queued",), "blocked")
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def retry_failed(self) -> int:
+        # 失败的任务和依赖它们的后续阶段任务一起重新排队；
+        # 后续阶段即使已经完成也要重跑，清单会跳过确实已完成的页面
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._conn.total_changes
+                failed = self._conn.execute(
+                    "SELECT DISTINCT pdf_path, stage FROM jobs WHERE state = 'failed'"
+                ).fetchall()
+                self._conn.execute(
+                    "UPDATE jobs SET state = 'queued', attempts = 0 WHERE state = 'failed'"
+                )
+                for pdf_path, stage in failed:
+                    self._set_later_stages(pdf_path, stage, ("blocked", "done"), "queued")
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._conn.total_changes - before
+
+    def _set_later_stages(self, pdf_path: str, stage: str, states: tuple[str, ...], state: str) -> None:
+        later = _later_stages(stage)
+        if not later:
+            return
+        self._conn.execute(
+            f"UPDATE jobs SET state = ?, attempts = 0 WHERE pdf_path = ?"
+            f" AND stage IN ({','.join('?' * len(later))})"
+            f" AND state IN ({','.join('?' * len(states))})",
+            (state, pdf_path, *later, *states),
+        )
+
+    def pending(self) -> int:
+        # 包括其他进程正在运行的任务；租约过期的算作排队
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'running')"
+            ).fetchone()[0]
+
+    def counts(self) -> dict[str, dict[str, int]]:
+        # {阶段: {状态: 任务数}}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage, state, COUNT(*) FROM jobs GROUP BY stage, state"
+            ).fetchall()
+        counts: dict[str, dict[str, int]] = {}
+        for stage, state, count in rows:
+            counts.setdefault(stage, {})[state] = count
+        return counts
+
+    def failures(self) -> list[tuple[str, str, int, int, str]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT pdf_path, stage, first_page, last_page, result FROM jobs"
+                " WHERE state = 'failed' ORDER BY id"
+            ).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _later_stages(stage: str) -> list[str]:
+    later = []
+    while True:
+        stage = next((after for after, before in STAGE_AFTER.items() if before == stage), None)
+        if stage is None:
+            return later
+        later.append(stage)
+
+
+class EndpointBudget:
+    # 并发上限加上每分钟启动次数的令牌桶
+    def __init__(self, concurrency: int, per_minute: float = 0):
+        self.concurrency = max(1, int(concurrency))
+        self.per_minute = float(per_minute or 0)
+        self.in_flight = 0
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.per_minute:
+            # 桶容量为 1：不允许空闲一段时间后瞬间连发
+            self._tokens = min(1.0, self._tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def available(self, now: float) -> bool:
+        self._refill(now)
+        return self.in_flight < self.concurrency and (not self.per_minute or self._tokens >= 1)
+
+    def wait_seconds(self, now: float) -> float:
+        self._refill(now)
+        if not self.per_minute or self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) * 60 / self.per_minute
+
+    def start(self) -> None:
+        self.in_flight += 1
+        if self.per_minute:
+            self._tokens -= 1
+
+    def finish(self) -> None:
+        self.in_flight -= 1
+
+
+def endpoint_budgets(limits: dict | None = None) -> dict[str, EndpointBudget]:
+    limits = limits or JOB_ENDPOINT_LIMITS or {}
+    budgets = {}
+    for endpoint, default in DEFAULT_ENDPOINT_LIMITS.items():
+        limit = dict(default, **limits.get(endpoint, {}))
+        budgets[endpoint] = EndpointBudget(limit["concurrency"], limit["per_minute"])
+    return budgets
+
+
+class JobScheduler:
+    # 每个端点各有独立的并发和速率预算，某一阶段排满时其他阶段仍然可以继续取任务
+    def __init__(self,
+                 service,
+                 queue: JobQueue,
+                 budgets: dict[str, EndpointBudget] | None = None,
+                 options: dict | None = None,
+                 on_event=None):
+        self.service = service
+        self.queue = queue
+        self.budgets = budgets or endpoint_budgets()
+        # 传给各阶段的参数，例如 model、text_mode、min_length
+        self.options = options or {}
+        self._on_event = on_event
+        self._warmed = False
+
+    def _emit(self, event: str, **fields) -> None:
+        if self._on_event is not None:
+            self._on_event(event, **fields)
+
+    def _run_job(self, stage: str, pdf_path: str, first_page: int, last_page: int) -> str:
+        pages = list(range(first_page, last_page + 1))
+        result = str(self._run_stage(stage, pdf_path, pages))
+        if result.startswith(FAILURE_PREFIXES):
+            return result
+        # 阶段返回 ok 不代表这一段都完成了（例如分句停在某一页），以清单为准
+        unfinished = self.service.unfinished_pages(pdf_path, stage, pages)
+        if isinstance(unfinished, str):
+            return unfinished
+        if unfinished:
+            return f"Incomplete: {len(unfinished)} page(s) not finished, first {unfinished[0]}"
+        return result
+
+    def _run_stage(self, stage: str, pdf_path: str, pages: list[int]) -> str:
+        if stage == "ocr":
+            return self.service.get_pdfimg_text(
+                pdf_path,
+                model=self.options.get("model"),
+                concurrency=1,
+                text_mode=self.options.get("text_mode"),
+                pages=pages,
+                warm_up=False,
+            )
+        if stage == "split":
+            return self.service.split_document(
+                pdf_path,
+                threshold=self.options.get("threshold"),
+                mode=self.options.get("segment_mode"),
+            )
+        if stage == "rst":
+            return self.service.rst_document(
+                pdf_path,
+                min_length=self.options.get("min_length", 120),
+                concurrency=1,
+                pages=pages,
+            )
+        if stage == "pack":
+            return self.service.pack_document(pdf_path)
+        raise ValueError(f"Unknown stage: {stage}")
+
+    def run(self, cancel_event: threading.Event | None = None) -> dict[str, dict[str, int]]:
+        ocr_jobs = self.queue.counts().get("ocr", {})
+        if not self._warmed and self.options.get("model") and ocr_jobs.get("queued"):
+            self.service.warm_up_model(self.options["model"])
+            self._warmed = True
+        total_slots = sum(budget.concurrency for budget in self.budgets.values())
+        running: dict[Future, tuple[int, str, str]] = {}
+        renewed = time.monotonic()
+        with ThreadPoolExecutor(max_workers=total_slots, thread_name_prefix="job") as pool:
+            while True:
+                if running and time.monotonic() - renewed >= self.queue.lease_seconds / 3:
+                    self.queue.renew()
+                    renewed = time.monotonic()
+                if cancel_event is None or not cancel_event.is_set():
+                    now = time.monotonic()
+                    for stage, endpoint in STAGE_ENDPOINTS.items():
+                        budget = self.budgets[endpoint]
+                        while budget.available(now):
+                            job = self.queue.claim(stage)
+                            if job is None:
+                                break
+                            job_id, pdf_path, first_page, last_page = job
+                            budget.start()
+                            future = pool.submit(self._run_job, stage, pdf_path, first_page, last_page)
+                            running[future] = (job_id, stage, pdf_path)
+                            self._emit(
+                                "job_start",
+                                job=job_id,
+                                stage=stage,
+                                document=pdf_path,
+                                pages=[first_page, last_page],
+                            )
+                if not running:
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    if not self.queue.pending():
+                        break
+                # 有端点在等速率令牌时定时醒来，否则等任意任务结束
+                delays = [
+                    budget.wait_seconds(time.monotonic())
+                    for budget in self.budgets.values()
+                    if budget.in_flight < budget.concurrency
+                ]
+                timeout = min([delay for delay in delays if delay > 0] or [1.0])
+                # 等速率令牌时也要按时续租
+                timeout = min(timeout, self.queue.lease_seconds / 3)
+                if not running:
+                    time.sleep(timeout)
+                    continue
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id, stage, pdf_path = running.pop(future)
+                    self.budgets[STAGE_ENDPOINTS[stage]].finish()
+                    try:
+                        result = str(future.result())
+                    except Exception as exc:
+                        result = f"Error: {exc}"
+                    ok = not result.startswith(FAILURE_PREFIXES)
+                    self.queue.finish(job_id, result, ok)
+                    self._emit("job_done", job=job_id, stage=stage, document=pdf_path, ok=ok, result=result)
+        return self.queue.counts()
@@ -0,0 +1,269 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from book_store import BookStore
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import config as _config
+except ImportError:
+    try:
+        from . import config as _config
+    except ImportError:
+        _config = None
+
+MANIFEST_NAME = "manifest.json"
+# 逐页标记时最多每隔这么久写一次清单；每次写入的是整个文件，逐页写会随页数平方增长
+MANIFEST_CHECKPOINT_SECONDS = getattr(_config, "MANIFEST_CHECKPOINT_SECONDS", 2.0) if _config else 2.0
+PAGE_STAGES = ("rendered", "ocr", "split", "fixed", "rst")
+
+
+class DocumentManifest:
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self._path = os.path.join(cache_dir, MANIFEST_NAME)
+        self._lock = threading.RLock()
+        # 本进程已修改、还没有写入磁盘的页面状态和模型；保存时合并到磁盘上的最新清单
+        self._dirty_pages: dict[str, dict] = {}
+        self._dirty_models: list[str] = []
+        self._file_state = None
+        self._saved_at = time.monotonic()
+        self._data = self._load()
+
+    @staticmethod
+    def exists(cache_dir: str) -> bool:
+        return os.path.exists(os.path.join(cache_dir, MANIFEST_NAME))
+
+    @staticmethod
+    def is_document_dir(cache_dir: str) -> bool:
+        # 有清单或页面文件的目录才是一本书；缓存根目录下的其他目录（音频缓存等）跳过
+        if DocumentManifest.exists(cache_dir):
+            return True
+        with os.scandir(cache_dir) as entries:
+            return any(entry.name.startswith("page_") for entry in entries)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _read_file(self) -> dict | None:
+        try:
+            with open(self._path, "r", encoding="utf-8") as handle:
+                data = json.load(handle)
+            if isinstance(data, dict) and isinstance(data.get("pages"), dict):
+                return data
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def _load(self) -> dict:
+        self._file_state = self._stat()
+        data = self._read_file()
+        if data is not None:
+            return data
+        # 没有清单（或清单损坏）时，从磁盘上已有的页面文件重建一次
+        data = {"digest": "", "names": [], "page_count": 0, "models": [], "pages": {}}
+        if os.path.isdir(self.cache_dir):
+            data["pages"] = self._scan_pages()
+            if BookStore.exists(self.cache_dir):
+                # 已打包的页面文件已删除，状态以 book.sqlite3 中的记录为准
+                store = BookStore.for_cache_dir(self.cache_dir)
+                for page_number, state in store.states().items():
+                    data["pages"].setdefault(page_number, {}).update(state)
+                store.close()
+        return data
+
+    def _scan_pages(self) -> dict[str, dict]:
+        pages: dict[str, dict] = {}
+        for name in os.listdir(self.cache_dir):
+            if not name.startswith("page_"):
+                continue
+            stem, _, suffix = name.partition(".")
+            try:
+                page_number = int(stem.split("_", 1)[1])
+            except (IndexError, ValueError):
+                continue
+            state = pages.setdefault(str(page_number), {})
+            if suffix == "png":
+                state["rendered"] = True
+            elif suffix == "json":
+                state["ocr"] = True
+                state["empty"] = not _has_text(os.path.join(self.cache_dir, name))
+            elif suffix == "jsonl":
+                state["split"] = True
+            elif suffix == "fixed.jsonl":
+                state["split"] = True
+                state["fixed"] = True
+            elif suffix in ("rst.jsonl", "fixed.rst.jsonl"):
+                state["rst"] = True
+        return pages
+
+    def _refresh(self) -> None:
+        # 其他进程（例如共用任务队列的另一个 pipeline_cli）更新了清单时重新读取，
+        # 再叠加本进程尚未保存的修改；调用方持有 self._lock
+        if self._stat() == self._file_state:
+            return
+        self._file_state = self._stat()
+        data = self._read_file()
+        if data is not None:
+            self._data = data
+            self._apply_dirty()
+
+    def _apply_dirty(self) -> None:
+        for page_number, state in self._dirty_pages.items():
+            self._data["pages"].setdefault(page_number, {}).update(state)
+        for model in self._dirty_models:
+            if model not in self._data["models"]:
+                self._data["models"].append(model)
+
+    def save(self) -> None:
+        # 在文件锁内读取磁盘上的最新清单并合并本进程的修改，多个进程写同一本书时不会互相覆盖
+        with self._lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with _file_lock(self._path + ".lock"):
+                data = self._read_file()
+                if data is not None:
+                    # describe 写入的文档信息以本进程为准
+                    for key in ("digest", "page_count"):
+                        data[key] = self._data.get(key, data.get(key))
+                    data["names"] = list(dict.fromkeys(data.get("names", []) + self._data["names"]))
+                    self._data = data
+                    self._apply_dirty()
+                temp_path = f"{self._path}.{os.getpid()}.tmp"
+                with open(temp_path, "w", encoding="utf-8") as handle:
+                    json.dump(self._data, handle, ensure_ascii=False)
+                os.replace(temp_path, self._path)
+                self._file_state = self._stat()
+            self._dirty_pages.clear()
+            self._dirty_models.clear()
+            self._saved_at = time.monotonic()
+
+    def checkpoint(self) -> None:
+        # 配合 mark(save=False) 使用：距上次保存超过 MANIFEST_CHECKPOINT_SECONDS 才写入；
+        # 调用方在一批页面结束后仍需 save()
+        with self._lock:
+            if (self._dirty_pages or self._dirty_models) and \
+                    time.monotonic() - self._saved_at >= MANIFEST_CHECKPOINT_SECONDS:
+                self.save()
+
+    @property
+    def digest(self) -> str:
+        return self._data.get("digest", "")
+
+    @property
+    def page_count(self) -> int:
+        return int(self._data.get("page_count") or 0)
+
+    @property
+    def names(self) -> list[str]:
+        return list(self._data.get("names", []))
+
+    @property
+    def models(self) -> list[str]:
+        return list(self._data.get("models", []))
+
+    def describe(self, digest: str, name: str, page_count: int) -> None:
+        with self._lock:
+            self._data["digest"] = digest
+            self._data["page_count"] = page_count
+            if name and name not in self._data["names"]:
+                self._data["names"].append(name)
+            self.save()
+
+    def page(self, page_number: int) -> dict:
+        with self._lock:
+            self._refresh()
+            return dict(self._data["pages"].get(str(page_number), {}))
+
+    def mark(self, pages, save: bool = True, **state) -> None:
+        if isinstance(pages, int):
+            pages = [pages]
+        with self._lock:
+            for page_number in pages:
+                self._data["pages"].setdefault(str(page_number), {}).update(state)
+                self._dirty_pages.setdefault(str(page_number), {}).update(state)
+            model = state.get("model")
+            if model and model not in self._data["models"]:
+                self._data["models"].append(model)
+                self._dirty_models.append(model)
+            if save:
+                self.save()
+
+    def pages_with(self, stage: str) -> list[int]:
+        with self._lock:
+            self._refresh()
+            return sorted(
+                int(page_number)
+                for page_number, state in self._data["pages"].items()
+                if state.get(stage)
+            )
+
+    def pending(self, stage: str, page_count: int | None = None) -> list[int]:
+        page_count = self.page_count if page_count is None else page_count
+        with self._lock:
+            self._refresh()
+            pages = self._data["pages"]
+            return [
+                page_number
+                for page_number in range(1, page_count + 1)
+                if not pages.get(str(page_number), {}).get(stage)
+            ]
+
+    def status(self) -> dict:
+        with self._lock:
+            self._refresh()
+            counts = {stage: 0 for stage in PAGE_STAGES}
+            skipped: dict[str, int] = {}
+            for state in self._data["pages"].values():
+                for stage in PAGE_STAGES:
+                    if state.get(stage):
+                        counts[stage] += 1
+                if state.get("skipped"):
+                    skipped[state["skipped"]] = skipped.get(state["skipped"], 0) + 1
+            return {
+                "digest": self.digest,
+                "names": self.names,
+                "page_count": self.page_count,
+                "models": self.models,
+                "pages": counts,
+                "skipped": skipped,
+            }
+
+
+def _has_text(path: str) -> bool:
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            return bool(json.load(handle).get("text"))
+    except Exception:
+        return False
+
+
+@contextmanager
+def _file_lock(path: str):
+    # 跨进程的排他锁；锁文件本身不删除
+    with open(path, "a+b") as handle:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
@@ -5,12 +5,13 @@ from PySide6.QtWidgets import QApplication
 from ui import MainWindow
 from controller import MainController
 from services import ollama_services
+from tts_services import tts_services
 
 def run():
     app = QApplication(sys.argv)
     view = MainWindow()
     service = ollama_services()
-    controller = MainController(view, service)  # Pass the service instance here
+    controller = MainController(view, service, tts_service=tts_services())  # Pass the service instance here
     view.show()
     app.exec()
 
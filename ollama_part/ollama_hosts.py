@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from collections.abc import Callable, Iterator
+from typing import TYPE_CHECKING
+
+import tracing
+
+if TYPE_CHECKING:
+    from ollama import Client
+
+try:
+    import config as _config
+except ImportError:
+    try:
+        from . import config as _config
+    except ImportError:
+        _config = None
+
+# 例如 ["http://gpu1:11434", {"url": "http://gpu2:11434", "concurrency": 4}]；
+# 环境变量 OLLAMA_HOSTS 写成 "http://gpu1:11434=2,http://gpu2:11434=4"
+OLLAMA_HOSTS = getattr(_config, "OLLAMA_HOSTS", None) if _config else None
+OLLAMA_HOST_CONCURRENCY = getattr(_config, "OLLAMA_HOST_CONCURRENCY", 1) if _config else 1
+# 出错的主机在这段时间内不再分配新请求
+OLLAMA_HOST_COOLDOWN_SECONDS = (
+    getattr(_config, "OLLAMA_HOST_COOLDOWN_SECONDS", 30.0) if _config else 30.0
+)
+
+
+class OllamaHost:
+    def __init__(self, url: str, concurrency: int, headers: dict | None = None):
+        self.url = url.rstrip("/")
+        # 0 表示不限制，由调用方的并发数决定
+        self.concurrency = max(0, int(concurrency))
+        self._headers = headers or {}
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.in_flight = 0
+        self.unhealthy_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.busy_seconds = 0.0
+        self.first_request = 0.0
+        self.last_request = 0.0
+        self.last_error = ""
+
+    @property
+    def client(self) -> "Client":
+        # 第一次真正调用模型时才导入 ollama，只做分句/RST 的进程不必加载它
+        with self._client_lock:
+            if self._client is None:
+                from ollama import Client
+
+                self._client = Client(host=self.url, headers=self._headers)
+            return self._client
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.unhealthy_until
+
+    def stats(self) -> dict:
+        elapsed = self.last_request - self.first_request
+        return {
+            "url": self.url,
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "healthy": self.healthy(time.monotonic()),
+            "requests": self.requests,
+            "failures": self.failures,
+            "avg_seconds": round(self.busy_seconds / self.requests, 3) if self.requests else 0.0,
+            "per_minute": round(self.requests / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            "last_error": self.last_error,
+        }
+
+
+def parse_hosts(value, default_url: str, default_concurrency: int) -> list[tuple[str, int]]:
+    if not value:
+        return [(default_url, 0)]
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(",") if item.strip()]
+    hosts = []
+    for item in value:
+        if isinstance(item, dict):
+            hosts.append((item["url"], int(item.get("concurrency", default_concurrency))))
+            continue
+        url, sep, concurrency = str(item).rpartition("=")
+        if sep and concurrency.isdigit():
+            hosts.append((url, int(concurrency)))
+        else:
+            hosts.append((str(item), default_concurrency))
+    return hosts
+
+
+def is_host_failure(exc: BaseException) -> bool:
+    # 连接失败、超时和 5xx 说明主机本身有问题；4xx（例如模型不存在）只换主机重试
+    import httpx
+    from ollama import ResponseError
+
+    if isinstance(exc, (ConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(exc, ResponseError):
+        return exc.status_code >= 500
+    return False
+
+
+class OllamaHostPool:
+    def __init__(self, hosts: list[tuple[str, int]], headers: dict | None = None):
+        if not hosts:
+            raise ValueError("At least one Ollama host is required.")
+        self.hosts = [OllamaHost(url, concurrency, headers) for url, concurrency in hosts]
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_config(cls, default_url: str, headers: dict | None = None) -> "OllamaHostPool":
+        value = os.getenv("OLLAMA_HOSTS") or OLLAMA_HOSTS
+        return cls(parse_hosts(value, default_url, OLLAMA_HOST_CONCURRENCY), headers)
+
+    @property
+    def capacity(self) -> int:
+        # 有不限并发的主机时返回 0
+        if any(host.concurrency == 0 for host in self.hosts):
+            return 0
+        return sum(host.concurrency for host in self.hosts)
+
+    def acquire(self, exclude: set[str] | None = None) -> OllamaHost:
+        exclude = exclude or set()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                candidates = [host for host in self.hosts if host.url not in exclude]
+                if not candidates:
+                    raise RuntimeError("No Ollama host left to try.")
+                healthy = [host for host in candidates if host.healthy(now)]
+                # 全部主机都在冷却时，仍然选最早恢复的一台，而不是直接失败
+                pool = healthy or [min(candidates, key=lambda host: host.unhealthy_until)]
+                free = [
+                    host
+                    for host in pool
+                    if host.concurrency == 0 or host.in_flight < host.concurrency
+                ]
+                if free:
+                    host = min(free, key=lambda host: host.in_flight / (host.concurrency or 1))
+                    host.in_flight += 1
+                    if not host.first_request:
+                        host.first_request = time.monotonic()
+                    return host
+                self._condition.wait(timeout=1.0)
+
+    def release(self, host: OllamaHost, seconds: float, error: BaseException | None = None) -> None:
+        with self._condition:
+            host.in_flight -= 1
+            host.requests += 1
+            host.busy_seconds += seconds
+            host.last_request = time.monotonic()
+            if error is not None:
+                host.failures += 1
+                host.last_error = str(error)
+                if is_host_failure(error):
+                    host.unhealthy_until = time.monotonic() + OLLAMA_HOST_COOLDOWN_SECONDS
+            else:
+                host.unhealthy_until = 0.0
+            self._condition.notify_all()
+
+    def run(self, fn: Callable[["Client"], object], attempts: int | None = None):
+        # 最空闲的健康主机执行 fn(client)；失败后换一台没试过的主机
+        attempts = attempts or len(self.hosts)
+        tried: set[str] = set()
+        last_error: BaseException | None = None
+        for _ in range(attempts):
+            try:
+                host = self.acquire(tried)
+            except RuntimeError:
+                break
+            if tried:
+                tracing.add("retries")
+            started = time.monotonic()
+            try:
+                result = fn(host.client)
+            except Exception as exc:
+                self.release(host, time.monotonic() - started, exc)
+                tried.add(host.url)
+                last_error = exc
+                continue
+            self.release(host, time.monotonic() - started)
+            return result
+        raise last_error or RuntimeError("No Ollama host available.")
+
+    def stream(self, fn: Callable[["Client"], Iterator]) -> Iterator:
+        # 还没收到任何内容前失败可以换主机；已经输出内容后直接抛出，由调用方断点续传
+        tried: set[str] = set()
+        last_error: BaseException | None = None
+        for _ in range(len(self.hosts)):
+            try:
+                host = self.acquire(tried)
+            except RuntimeError:
+                break
+            if tried:
+                tracing.add("retries")
+            started = time.monotonic()
+            produced = False
+            try:
+                for item in fn(host.client):
+                    produced = True
+                    yield item
+            except Exception as exc:
+                self.release(host, time.monotonic() - started, exc)
+                if produced:
+                    raise
+                tried.add(host.url)
+                last_error = exc
+                continue
+            except BaseException:
+                self.release(host, time.monotonic() - started)
+                raise
+            self.release(host, time.monotonic() - started)
+            return
+        raise last_error or RuntimeError("No Ollama host available.")
+
+    def stats(self) -> list[dict]:
+        with self._condition:
+            return [host.stats() for host in self.hosts]
@@ -0,0 +1,135 @@
+import hashlib
+
+try:
+    import config as _config
+except ImportError:
+    try:
+        from . import config as _config
+    except ImportError:
+        _config = None
+
+PAGE_FILTER_ENABLED = getattr(_config, "PAGE_FILTER_ENABLED", True) if _config else True
+PAGE_THUMBNAIL_DPI = getattr(_config, "PAGE_THUMBNAIL_DPI", 24) if _config else 24
+# 页面中深色像素的比例低于该值视为空白页（页边距不计入）
+BLANK_INK_RATIO = getattr(_config, "BLANK_INK_RATIO", 0.001) if _config else 0.001
+# 256 位差值哈希允许的最大汉明距离；同一页重复渲染时为 0
+PAGE_HASH_MAX_DISTANCE = getattr(_config, "PAGE_HASH_MAX_DISTANCE", 3) if _config else 3
+# 墨迹少的页面（章节页、分隔页）哈希大多相同，不做相似比较
+DENSE_INK_RATIO = getattr(_config, "DENSE_INK_RATIO", 0.02) if _config else 0.02
+INK_THRESHOLD = 160
+MARGIN_RATIO = 0.05
+HASH_SIZE = 16
+
+
+def parse_pgm_stream(data: bytes) -> list[tuple[int, int, bytes]]:
+    # pdftoppm -gray 不指定输出文件时把各页的 P5 PGM 依次写到 stdout
+    images = []
+    offset = 0
+    while offset < len(data):
+        fields = []
+        while len(fields) < 4:
+            while offset < len(data) and data[offset:offset + 1].isspace():
+                offset += 1
+            if data[offset:offset + 1] == b"#":
+                offset = data.index(b"\n", offset) + 1
+                continue
+            end = offset
+            while end < len(data) and not data[end:end + 1].isspace():
+                end += 1
+            if end == offset:
+                break
+            fields.append(data[offset:end])
+            offset = end
+        if len(fields) < 4:
+            break
+        if fields[0] != b"P5" or int(fields[3]) > 255:
+            raise ValueError("Expected an 8-bit binary PGM image.")
+        width, height = int(fields[1]), int(fields[2])
+        offset += 1
+        images.append((width, height, data[offset:offset + width * height]))
+        offset += width * height
+    return images
+
+
+_INK_TABLE = bytes(1 if value < INK_THRESHOLD else 0 for value in range(256))
+_QUANTIZE_TABLE = bytes(value >> 4 for value in range(256))
+
+
+def ink_coverage(width: int, height: int, pixels: bytes) -> float:
+    # 去掉四周页边距，避免扫描件的阴影和裁切线被算作内容
+    x0 = int(width * MARGIN_RATIO)
+    y0 = int(height * MARGIN_RATIO)
+    x1 = max(x0 + 1, width - x0)
+    y1 = max(y0 + 1, height - y0)
+    inner = b"".join(pixels[row * width + x0:row * width + x1] for row in range(y0, y1))
+    if not inner:
+        return 0.0
+    return inner.translate(_INK_TABLE).count(1) / len(inner)
+
+
+def dhash(width: int, height: int, pixels: bytes, size: int = HASH_SIZE) -> int:
+    # 差值哈希：缩成 (size + 1) x size 的灰度网格，比较左右相邻格子的亮度
+    columns = size + 1
+    cells = []
+    for grid_y in range(size):
+        y0 = grid_y * height // size
+        y1 = max(y0 + 1, (grid_y + 1) * height // size)
+        row_cells = []
+        for grid_x in range(columns):
+            x0 = grid_x * width // columns
+            x1 = max(x0 + 1, (grid_x + 1) * width // columns)
+            total = 0
+            for row in range(y0, y1):
+                total += sum(pixels[row * width + x0:row * width + x1])
+            row_cells.append(total / ((x1 - x0) * (y1 - y0)))
+        cells.append(row_cells)
+    value = 0
+    for row_cells in cells:
+        for left, right in zip(row_cells, row_cells[1:]):
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming(left: int, right: int) -> int:
+    return (left ^ right).bit_count()
+
+
+def page_signature(width: int, height: int, pixels: bytes) -> dict:
+    return {
+        "ink": round(ink_coverage(width, height, pixels), 5),
+        "phash": f"{dhash(width, height, pixels):0{HASH_SIZE * HASH_SIZE // 4}x}",
+        "image_digest": hashlib.sha1(pixels.translate(_QUANTIZE_TABLE)).hexdigest(),
+    }
+
+
+def is_blank(signature: dict) -> bool:
+    return signature["ink"] < BLANK_INK_RATIO
+
+
+def find_duplicate(signature: dict, known: dict[int, dict]) -> int | None:
+    # known: {页码: 签名}；只有量化后的像素完全一致才算重复，可以直接复用文本
+    for page_number, other in known.items():
+        if other.get("image_digest") == signature["image_digest"]:
+            return page_number
+    return None
+
+
+def find_similar(signature: dict,
+                 known: dict[int, dict],
+                 max_distance: int | None = None) -> int | None:
+    # 哈希接近的页面只是提示：只差一个数字或一行字的两页也会落在阈值内，
+    # 不能据此复用文本，仍然要 OCR
+    max_distance = PAGE_HASH_MAX_DISTANCE if max_distance is None else max_distance
+    if signature["ink"] < DENSE_INK_RATIO:
+        return None
+    page_hash = int(signature["phash"], 16)
+    best = None
+    best_distance = max_distance + 1
+    for page_number, other in known.items():
+        if other.get("ink", 0) < DENSE_INK_RATIO or not other.get("phash"):
+            continue
+        distance = hamming(page_hash, int(other["phash"], 16))
+        if distance < best_distance:
+            best = page_number
+            best_distance = distance
+    return best
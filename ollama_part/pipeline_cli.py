@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+# job_queue 只依赖标准库；services（以及 requests、ollama）在第一个阶段运行时才加载，
+# 不导入任何 Qt 模块，可以在没有图形环境的服务器上运行
+from job_queue import FAILURE_PREFIXES
+
+# pack 把已经完成所有阶段的页面并入 book.sqlite3，删除逐页的小文件
+STAGES = ("render", "ocr", "split", "fix", "rst", "pack")
+DEFAULT_STAGES = ("ocr", "split", "rst", "pack")
+PROGRESS_INTERVAL = 1.0
+
+
+def _emit(event: str, **fields) -> None:
+    # 每行一个 JSON 对象，便于其他程序逐行读取
+    record = {"event": event, "time": round(time.time(), 3)}
+    record.update(fields)
+    sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def _progress(pdf_path: str, stage: str):
+    last = 0.0
+
+    def report(done: int, total: int) -> None:
+        nonlocal last
+        now = time.monotonic()
+        if done < total and now - last < PROGRESS_INTERVAL:
+            return
+        last = now
+        _emit("progress", document=pdf_path, stage=stage, done=done, total=total)
+
+    return report
+
+
+def find_pdfs(paths: list[str], recursive: bool = False) -> list[str]:
+    pdf_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                for root, _, names in os.walk(path):
+                    pdf_paths.extend(
+                        os.path.join(root, name) for name in names if name.lower().endswith(".pdf")
+                    )
+            else:
+                pdf_paths.extend(
+                    entry.path
+                    for entry in os.scandir(path)
+                    if entry.is_file() and entry.name.lower().endswith(".pdf")
+                )
+        else:
+            pdf_paths.append(path)
+    return sorted(dict.fromkeys(os.path.abspath(path) for path in pdf_paths))
+
+
+def run_stage(service, stage: str, pdf_path: str, args, cancel_event: threading.Event) -> str:
+    progress = _progress(pdf_path, stage)
+    if stage == "render":
+        return service.render_document(pdf_path, progress=progress)
+    if stage == "ocr":
+        return service.get_pdfimg_text(
+            pdf_path,
+            model=args.model,
+            concurrency=args.concurrency,
+            cancel_event=cancel_event,
+            progress=progress,
+            text_mode=args.text_mode,
+        )
+    if stage == "split":
+        # 指定了 fix 阶段时边界留给 fix 处理
+        return service.split_document(
+            pdf_path,
+            threshold=args.threshold,
+            mode=args.segment_mode,
+            fix="fix" not in args.stages,
+        )
+    if stage == "fix":
+        # stream 模式下页面已经标记为 fixed，这里不会再有请求
+        return service.fix_document_boundaries(pdf_path, threshold=args.threshold)
+    if stage == "rst":
+        return service.rst_document(
+            pdf_path,
+            min_length=args.min_length,
+            concurrency=args.rst_concurrency,
+            progress=progress,
+        )
+    if stage == "pack":
+        return service.pack_document(pdf_path)
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def run_queue(args) -> int:
+    # 把文档加入持久化队列后按端点预算交错执行；不带路径时继续上次未完成的队列
+    from job_queue import STAGE_ENDPOINTS, JobQueue, JobScheduler
+    from services import ollama_services
+    from utility import get_pdf_page_count
+
+    service = ollama_services(cache_root=os.path.abspath(args.cache_dir) if args.cache_dir else None)
+    queue = JobQueue.for_cache_root(service._cache_root)
+    if args.retry_failed:
+        _emit("requeued", jobs=queue.retry_failed())
+    stages = tuple(stage for stage in args.stages if stage in STAGE_ENDPOINTS)
+    for pdf_path in find_pdfs(args.paths, args.recursive):
+        page_count = get_pdf_page_count(pdf_path)
+        if isinstance(page_count, str):
+            _emit("error", document=pdf_path, message=page_count)
+            continue
+        added = queue.add_document(pdf_path, page_count, priority=args.priority, stages=stages)
+        _emit("queued", document=pdf_path, jobs=added, priority=args.priority)
+
+    cancel_event = threading.Event()
+
+    def _on_interrupt(signum, frame):
+        if cancel_event.is_set():
+            raise KeyboardInterrupt
+        cancel_event.set()
+        _emit("interrupting", message="Finishing running jobs; press Ctrl+C again to abort.")
+
+    signal.signal(signal.SIGINT, _on_interrupt)
+    scheduler = JobScheduler(
+        service,
+        queue,
+        options={
+            "model": args.model,
+            "text_mode": args.text_mode,
+            "segment_mode": args.segment_mode,
+            "threshold": args.threshold,
+            "min_length": args.min_length,
+        },
+        on_event=_emit,
+    )
+    _emit("start", pending=queue.pending(), stages=list(stages))
+    try:
+        counts = scheduler.run(cancel_event)
+    except KeyboardInterrupt:
+        # 交还运行中的任务，其他进程或下次运行不必等租约过期
+        queue.release()
+        _emit("interrupted", message="Aborted; run again to resume.")
+        return 130
+    failures = queue.failures()
+    for pdf_path, stage, first_page, last_page, result in failures:
+        _emit("failed", document=pdf_path, stage=stage, pages=[first_page, last_page], result=result)
+    if cancel_event.is_set():
+        _emit("interrupted", message="Stopped; run again to resume.", jobs=counts)
+        return 130
+    _emit("done", jobs=counts)
+    return 1 if failures else 0
+
+
+def run_search(args) -> int:
+    from services import ollama_services
+
+    service = ollama_services(cache_root=os.path.abspath(args.cache_dir) if args.cache_dir else None)
+    if args.reindex:
+        _emit("index", **service.reindex())
+    if args.search:
+        started = time.perf_counter()
+        hits = service.search_sentences(args.search, limit=args.limit, context=args.context)
+        for hit in hits:
+            _emit("hit", **hit)
+        _emit("done", hits=len(hits), seconds=round(time.perf_counter() - started, 4))
+    return 0
+
+
+def run(args) -> int:
+    if args.search or args.reindex:
+        return run_search(args)
+    if args.queue:
+        return run_queue(args)
+    pdf_paths = find_pdfs(args.paths, args.recursive)
+    if not pdf_paths:
+        _emit("error", message="No PDF files found.")
+        return 1
+
+    from services import ollama_services
+
+    service = ollama_services(cache_root=os.path.abspath(args.cache_dir) if args.cache_dir else None)
+    cancel_event = threading.Event()
+
+    def _on_interrupt(signum, frame):
+        # 第一次 Ctrl+C 让当前阶段在页面边界处停下并保存进度；第二次直接退出
+        if cancel_event.is_set():
+            raise KeyboardInterrupt
+        cancel_event.set()
+        _emit("interrupting", message="Finishing in-flight pages; press Ctrl+C again to abort.")
+
+    signal.signal(signal.SIGINT, _on_interrupt)
+    failed = 0
+    _emit("start", documents=len(pdf_paths), stages=list(args.stages))
+    try:
+        for pdf_path in pdf_paths:
+            # 清单记录了每页的完成状态，重复运行只处理剩下的页面
+            _emit("document", document=pdf_path, status=service.get_cache_status(pdf_path))
+            for stage in args.stages:
+                started = time.perf_counter()
+                try:
+                    result = run_stage(service, stage, pdf_path, args, cancel_event)
+                except Exception as exc:
+                    result = f"Error: {exc}"
+                if cancel_event.is_set():
+                    _emit("interrupted", message="Stopped; run again to resume.")
+                    return 130
+                ok = not str(result).startswith(FAILURE_PREFIXES)
+                _emit(
+                    "stage",
+                    document=pdf_path,
+                    stage=stage,
+                    ok=ok,
+                    result=result,
+                    seconds=round(time.perf_counter() - started, 3),
+                )
+                if not ok:
+                    failed += 1
+                    # 后面的阶段依赖这一阶段的输出，换下一本书
+                    break
+    except KeyboardInterrupt:
+        _emit("interrupted", message="Aborted; run again to resume.")
+        return 130
+    _emit("done", documents=len(pdf_paths), failed=failed)
+    return 1 if failed else 0
+
+
+def _stage_list(value: str) -> tuple[str, ...]:
+    stages = tuple(item.strip() for item in value.split(",") if item.strip())
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown stage(s): {', '.join(unknown)}")
+    # 按流水线顺序执行，与参数顺序无关
+    return tuple(stage for stage in STAGES if stage in stages)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Run the PDF pipeline without the GUI. Progress is printed as JSON lines; "
+                    "finished pages are skipped, so rerunning resumes."
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="PDF files or directories containing PDFs (optional with --queue).",
+    )
+    parser.add_argument(
+        "--stages",
+        type=_stage_list,
+        default=DEFAULT_STAGES,
+        help=f"Comma-separated stages from {', '.join(STAGES)} (default: {','.join(DEFAULT_STAGES)}). "
+             "pack moves finished pages into book.sqlite3 and deletes their page files.",
+    )
+    parser.add_argument("--recursive", action="store_true", help="Search directories recursively.")
+    parser.add_argument("--cache-dir", default="", help="Cache root (default: the GUI's cache).")
+    parser.add_argument("--model", default=None, help="Ollama vision model for OCR.")
+    parser.add_argument("--concurrency", type=int, default=None, help="In-flight OCR pages.")
+    parser.add_argument(
+        "--text-mode",
+        default=None,
+        choices=("auto", "text", "ocr"),
+        help="Use the PDF text layer, OCR, or both (default from config).",
+    )
+    parser.add_argument(
+        "--segment-mode",
+        default=None,
+        choices=("stream", "pages"),
+        help="Sentence splitting mode (default from config).",
+    )
+    parser.add_argument("--threshold", type=float, default=None, help="wtpsplit threshold.")
+    parser.add_argument("--min-length", type=int, default=120, help="RST split threshold.")
+    parser.add_argument("--rst-concurrency", type=int, default=None, help="In-flight RST requests.")
+    parser.add_argument(
+        "--queue",
+        action="store_true",
+        help="Add the documents to the persistent job queue and run it, interleaving pages "
+             "across documents with per-endpoint limits.",
+    )
+    parser.add_argument("--priority", type=int, default=0, help="Queue priority (higher first).")
+    parser.add_argument("--retry-failed", action="store_true", help="Requeue failed queue jobs.")
+    parser.add_argument(
+        "--search",
+        default="",
+        help='Search indexed sentences instead of running stages; "quoted phrase", prefix*.',
+    )
+    parser.add_argument("--context", type=int, default=0, help="Preceding sentences per hit.")
+    parser.add_argument("--limit", type=int, default=50, help="Maximum number of hits.")
+    parser.add_argument(
+        "--reindex",
+        action="store_true",
+        help="Index sentences already in the cache (only changed pages are rebuilt).",
+    )
+    args = parser.parse_args(argv)
+    if not args.paths and not (args.queue or args.search or args.reindex):
+        parser.error("at least one path is required unless --queue, --search or --reindex is given")
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+import os
+import re
+import sqlite3
+import threading
+from collections.abc import Iterable
+
+from book_store import BookStore
+from utility import iter_jsonl_texts
+
+SEARCH_INDEX_NAME = "search_index.sqlite3"
+# 中日韩文字没有空格分词，逐字作为词元，短语查询时按相邻位置匹配
+_CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TOKEN_PATTERN = re.compile(rf"[{_CJK}]|[^\W_{_CJK}]+")
+_QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+_PREFIX_END = "\U0010ffff"
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_PATTERN.findall(text.casefold())
+
+
+def parse_query(query: str) -> list[list[tuple[str, bool]]]:
+    # 返回若干必须同时满足的条件；每个条件是一串相邻的 (词元, 是否前缀匹配)。
+    # 引号内为短语，以 * 结尾的词按前缀匹配
+    # 不带引号的词拆出多个词元时（例如 e-mail、学习）同样要求相邻
+    clauses = []
+    for phrase, word in _QUERY_PATTERN.findall(query):
+        part = phrase or word
+        terms = [(token, False) for token in tokenize(part)]
+        if not terms:
+            continue
+        if part.endswith("*"):
+            terms[-1] = (terms[-1][0], True)
+        clauses.append(terms)
+    return clauses
+
+
+class SearchIndex:
+    # 倒排索引：词元 -> (文档, 页码, 页内序号, 词位置)；按页增量更新
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " id INTEGER PRIMARY KEY,"
+            " digest TEXT NOT NULL UNIQUE,"
+            " name TEXT NOT NULL)"
+        )
+        # signature 记录索引时源文件的大小和修改时间，用来判断是否需要重建这一页
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " doc INTEGER NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " page INTEGER NOT NULL,"
+            " signature TEXT NOT NULL,"
+            " PRIMARY KEY (doc, kind, page)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sentences ("
+            " id INTEGER PRIMARY KEY,"
+            " doc INTEGER NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " page INTEGER NOT NULL,"
+            " idx INTEGER NOT NULL,"
+            " text TEXT NOT NULL,"
+            " UNIQUE (doc, kind, page, idx))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " token TEXT NOT NULL,"
+            " sentence INTEGER NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " PRIMARY KEY (token, sentence, position)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS postings_sentence ON postings (sentence)"
+        )
+
+    @classmethod
+    def for_cache_root(cls, cache_root: str) -> "SearchIndex":
+        return cls(os.path.join(cache_root, SEARCH_INDEX_NAME))
+
+    def _document_id(self, digest: str, name: str) -> int:
+        self._conn.execute(
+            "INSERT INTO documents (digest, name) VALUES (?, ?)"
+            " ON CONFLICT(digest) DO UPDATE SET name = excluded.name",
+            (digest, name),
+        )
+        return self._conn.execute(
+            "SELECT id FROM documents WHERE digest = ?", (digest,)
+        ).fetchone()[0]
+
+    def _replace_page(self, doc: int, kind: str, page_number: int, texts: list[str]) -> None:
+        old = [
+            row[0]
+            for row in self._conn.execute(
+                "SELECT id FROM sentences WHERE doc = ? AND kind = ? AND page = ?",
+                (doc, kind, page_number),
+            )
+        ]
+        if old:
+            marks = ",".join("?" * len(old))
+            self._conn.execute(f"DELETE FROM postings WHERE sentence IN ({marks})", old)
+            self._conn.execute(f"DELETE FROM sentences WHERE id IN ({marks})", old)
+        for idx, text in enumerate(texts, start=1):
+            sentence_id = self._conn.execute(
+                "INSERT INTO sentences (doc, kind, page, idx, text) VALUES (?, ?, ?, ?, ?)",
+                (doc, kind, page_number, idx, text),
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO postings (token, sentence, position) VALUES (?, ?, ?)",
+                [(token, sentence_id, position) for position, token in enumerate(tokenize(text))],
+            )
+
+    def update_document(self,
+                        cache_dir: str,
+                        name: str,
+                        page_count: int,
+                        kinds: tuple[str, ...] = ("split", "rst"),
+                        store: BookStore | None = None,
+                        pages: Iterable[int] | None = None) -> int:
+        # 只重建源文件有变化的页面；返回重建的页数。
+        # 已打包的页面没有逐页文件，保留原有索引，只在从未索引过时从 book.sqlite3 读取
+        digest = os.path.basename(os.path.normpath(cache_dir))
+        changed = 0
+        with self._lock:
+            doc = self._document_id(digest, name)
+            indexed = {
+                (kind, page_number): signature
+                for kind, page_number, signature in self._conn.execute(
+                    "SELECT kind, page, signature FROM pages WHERE doc = ?", (doc,)
+                )
+            }
+        page_numbers = sorted(set(pages)) if pages is not None else range(1, page_count + 1)
+        for kind in kinds:
+            suffixes = ("fixed.rst.jsonl", "rst.jsonl") if kind == "rst" else ("fixed.jsonl", "jsonl")
+            for page_number in page_numbers:
+                path = None
+                for suffix in suffixes:
+                    candidate = os.path.join(cache_dir, f"page_{page_number}.{suffix}")
+                    if os.path.exists(candidate):
+                        path = candidate
+                        break
+                if path is not None:
+                    stat = os.stat(path)
+                    signature = f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+                    if indexed.get((kind, page_number)) == signature:
+                        continue
+                    texts = list(iter_jsonl_texts(path))
+                elif store is not None and (kind, page_number) not in indexed:
+                    texts = store.get_segments(page_number, kind)
+                    if texts is None:
+                        continue
+                    signature = "packed"
+                else:
+                    continue
+                with self._lock:
+                    self._conn.execute("BEGIN")
+                    try:
+                        self._replace_page(doc, kind, page_number, texts)
+                        self._conn.execute(
+                            "INSERT INTO pages (doc, kind, page, signature) VALUES (?, ?, ?, ?)"
+                            " ON CONFLICT(doc, kind, page) DO UPDATE SET signature = excluded.signature",
+                            (doc, kind, page_number, signature),
+                        )
+                        self._conn.execute("COMMIT")
+                    except BaseException:
+                        self._conn.execute("ROLLBACK")
+                        raise
+                changed += 1
+        return changed
+
+    def _clause_sql(self, terms: list[tuple[str, bool]]) -> tuple[str, list]:
+        # 相邻词元通过 position 连接，单个词元就是普通的词项查询
+        joins = []
+        conditions = []
+        params: list = []
+        for offset, (token, prefix) in enumerate(terms):
+            alias = f"p{offset}"
+            if offset:
+                joins.append(
+                    f" JOIN postings AS {alias} ON {alias}.sentence = p0.sentence"
+                    f" AND {alias}.position = p0.position + {offset}"
+                )
+            if prefix:
+                conditions.append(f"{alias}.token >= ? AND {alias}.token < ?")
+                params.extend([token, token + _PREFIX_END])
+            else:
+                conditions.append(f"{alias}.token = ?")
+                params.append(token)
+        sql = "SELECT p0.sentence FROM postings AS p0" + "".join(joins)
+        return sql + " WHERE " + " AND ".join(conditions), params
+
+    def search(self,
+               query: str,
+               kind: str = "split",
+               digest: str | None = None,
+               limit: int = 50) -> list[dict]:
+        clauses = parse_query(query)
+        if not clauses:
+            return []
+        parts = []
+        params: list = []
+        for terms in clauses:
+            sql, clause_params = self._clause_sql(terms)
+            parts.append(sql)
+            params.extend(clause_params)
+        sql = (
+            "SELECT s.id, d.digest, d.name, s.page, s.idx, s.text"
+            " FROM sentences AS s JOIN documents AS d ON d.id = s.doc"
+            f" WHERE s.id IN ({' INTERSECT '.join(parts)}) AND s.kind = ?"
+        )
+        params.append(kind)
+        if digest is not None:
+            sql += " AND d.digest = ?"
+            params.append(digest)
+        sql += " ORDER BY d.name, s.page, s.idx LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [_sentence_dict(row) for row in rows]
+
+    def neighbours(self, sentence_id: int, before: int = 3, after: int = 0) -> list[dict]:
+        # 同一文档中按 (页码, 页内序号) 前后相邻的句子，包含自身
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT doc, kind, page, idx FROM sentences WHERE id = ?", (sentence_id,)
+            ).fetchone()
+            if row is None:
+                return []
+            doc, kind, page_number, idx = row
+            select = (
+                "SELECT s.id, d.digest, d.name, s.page, s.idx, s.text"
+                " FROM sentences AS s JOIN documents AS d ON d.id = s.doc"
+                " WHERE s.doc = ? AND s.kind = ?"
+            )
+            previous = self._conn.execute(
+                select + " AND (s.page, s.idx) < (?, ?) ORDER BY s.page DESC, s.idx DESC LIMIT ?",
+                (doc, kind, page_number, idx, before),
+            ).fetchall()
+            following = self._conn.execute(
+                select + " AND (s.page, s.idx) >= (?, ?) ORDER BY s.page, s.idx LIMIT ?",
+                (doc, kind, page_number, idx, after + 1),
+            ).fetchall()
+        return [_sentence_dict(item) for item in reversed(previous)] + [
+            _sentence_dict(item) for item in following
+        ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            documents, sentences, postings = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM documents), (SELECT COUNT(*) FROM sentences),"
+                " (SELECT COUNT(*) FROM postings)"
+            ).fetchone()
+        return {"documents": documents, "sentences": sentences, "postings": postings}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _sentence_dict(row) -> dict:
+    sentence_id, digest, name, page_number, idx, text = row
+    return {
+        "id": sentence_id,
+        "document": name,
+        "digest": digest,
+        "page": page_number,
+        "idx": idx,
+        "text": text,
+    }
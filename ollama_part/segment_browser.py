@@ -0,0 +1,138 @@
+from PySide6.QtCore import QAbstractListModel, QModelIndex, Qt, QTimer, Signal
+from PySide6.QtWidgets import (
+    QHBoxLayout,
+    QLineEdit,
+    QListView,
+    QSpinBox,
+    QVBoxLayout,
+    QWidget,
+)
+
+from segment_rows import SegmentRows
+
+FETCH_ROWS = 500
+SEARCH_DELAY_MS = 250
+
+
+class SegmentListModel(QAbstractListModel):
+    # 行数按 FETCH_ROWS 逐步增加；文本只在视图请求可见行时读取
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows: SegmentRows | None = None
+        self._loaded = 0
+
+    @property
+    def rows(self) -> SegmentRows | None:
+        return self._rows
+
+    def set_rows(self, rows: SegmentRows | None):
+        self.beginResetModel()
+        self._rows = rows
+        self._loaded = 0
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._loaded
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._rows is not None and self._loaded < len(self._rows)
+
+    def fetchMore(self, parent=QModelIndex()):
+        self.ensure_loaded(self._loaded + FETCH_ROWS - 1)
+
+    def ensure_loaded(self, row: int):
+        if self._rows is None:
+            return
+        target = min(len(self._rows), row + 1)
+        if target <= self._loaded:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, target - 1)
+        self._loaded = target
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or self._rows is None:
+            return None
+        row = index.row()
+        if role == Qt.DisplayRole:
+            return f"{row + 1}. {self._rows.text(row)}"
+        if role == Qt.ToolTipRole:
+            page_number, idx = self._rows.locate(row)
+            return f"page {page_number}, #{idx}"
+        return None
+
+
+class SegmentBrowser(QWidget):
+    # 选中的句子编号（从 1 开始），以及请求查找 (关键字, 起始行)
+    sentence_selected = Signal(int)
+    search_requested = Signal(str, int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.model = SegmentListModel(self)
+        self.list_view = QListView()
+        self.list_view.setModel(self.model)
+        # 所有行等高，视图不必逐行测量
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setWordWrap(False)
+        self.jump_box = QSpinBox()
+        self.jump_box.setMinimum(1)
+        self.jump_box.setMaximum(1)
+        self.jump_box.setPrefix("#")
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("search")
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(SEARCH_DELAY_MS)
+
+        controls = QHBoxLayout()
+        controls.addWidget(self.jump_box)
+        controls.addWidget(self.search_edit)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(controls)
+        layout.addWidget(self.list_view)
+
+        self.jump_box.editingFinished.connect(self._jump_box_on_finished)
+        self.search_edit.textChanged.connect(lambda _: self._search_timer.start())
+        self.search_edit.returnPressed.connect(self._search_next)
+        self._search_timer.timeout.connect(self._search_from_current)
+        self.list_view.selectionModel().currentChanged.connect(self._on_current_changed)
+
+    def set_rows(self, rows: SegmentRows | None):
+        self.model.set_rows(rows)
+        self.jump_box.setMaximum(max(1, len(rows) if rows is not None else 1))
+
+    def jump_to(self, sentence_id: int):
+        row = sentence_id - 1
+        if row < 0 or self.model.rows is None or row >= len(self.model.rows):
+            return
+        self.model.ensure_loaded(row)
+        index = self.model.index(row)
+        self.list_view.setCurrentIndex(index)
+        self.list_view.scrollTo(index, QListView.PositionAtCenter)
+
+    def show_search_result(self, row):
+        if row is not None:
+            self.jump_to(row + 1)
+
+    def _current_row(self) -> int:
+        index = self.list_view.currentIndex()
+        return index.row() if index.isValid() else 0
+
+    def _jump_box_on_finished(self):
+        self.jump_to(self.jump_box.value())
+
+    def _search_from_current(self):
+        if self.search_edit.text():
+            self.search_requested.emit(self.search_edit.text(), self._current_row())
+
+    def _search_next(self):
+        self._search_timer.stop()
+        if self.search_edit.text():
+            self.search_requested.emit(self.search_edit.text(), self._current_row() + 1)
+
+    def _on_current_changed(self, current, previous):
+        if current.isValid():
+            self.jump_box.setValue(current.row() + 1)
+            self.sentence_selected.emit(current.row() + 1)
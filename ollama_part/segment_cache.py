@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import config as _config
+except ImportError:
+    try:
+        from . import config as _config
+    except ImportError:
+        _config = None
+
+SEGMENT_CACHE_MAX_ENTRIES = (
+    getattr(_config, "SEGMENT_CACHE_MAX_ENTRIES", 500_000) if _config else 500_000
+)
+SEGMENT_CACHE_MAX_BYTES = (
+    getattr(_config, "SEGMENT_CACHE_MAX_BYTES", 512 * 1024 * 1024) if _config else 512 * 1024 * 1024
+)
+
+
+class SegmentCache:
+    def __init__(self,
+                 path: str,
+                 max_entries: int | None = None,
+                 max_bytes: int | None = None):
+        self.path = path
+        self.max_entries = max_entries or SEGMENT_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or SEGMENT_CACHE_MAX_BYTES
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS segments ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(segments)")}
+        if "size" not in columns:
+            self._conn.execute("ALTER TABLE segments ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("UPDATE segments SET size = length(CAST(value AS BLOB))")
+        if "last_used" not in columns:
+            self._conn.execute("ALTER TABLE segments ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS segments_last_used ON segments (last_used)"
+        )
+        entries, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM segments"
+        ).fetchone()
+        self._entries = entries
+        self._bytes = total_bytes
+        self._hits: dict[str, int] = {}
+        self._misses: dict[str, int] = {}
+        self._evictions = 0
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        # 例如 ("isanlp", endpoint, text)；只保存哈希，不保存原文
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str, kind: str = ""):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM segments WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._misses[kind] = self._misses.get(kind, 0) + 1
+                return None
+            self._hits[kind] = self._hits.get(kind, 0) + 1
+            self._conn.execute(
+                "UPDATE segments SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+        return json.loads(row[0])
+
+    def put(self, key: str, value) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM segments WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO segments (key, value, size, last_used)"
+                " VALUES (?, ?, ?, ?)",
+                (key, payload, size, time.time()),
+            )
+            if old is None:
+                self._entries += 1
+                self._bytes += size
+            else:
+                self._bytes += size - old[0]
+            if self._entries > self.max_entries or self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # 最近最少使用的条目先淘汰，一次多删 10% 以免每次写入都触发
+        target_entries = int(self.max_entries * 0.9)
+        target_bytes = int(self.max_bytes * 0.9)
+        cursor = self._conn.execute(
+            "SELECT key, size FROM segments ORDER BY last_used"
+        )
+        doomed = []
+        entries = self._entries
+        total_bytes = self._bytes
+        for key, size in cursor:
+            if entries <= target_entries and total_bytes <= target_bytes:
+                break
+            doomed.append((key,))
+            entries -= 1
+            total_bytes -= size
+        cursor.close()
+        self._conn.execute("BEGIN")
+        self._conn.executemany("DELETE FROM segments WHERE key = ?", doomed)
+        self._conn.execute("COMMIT")
+        self._entries = entries
+        self._bytes = total_bytes
+        self._evictions += len(doomed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": self._entries,
+                "bytes": self._bytes,
+                "hits": dict(self._hits),
+                "misses": dict(self._misses),
+                "evictions": self._evictions,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,145 @@
+import bisect
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Iterator
+
+from book_store import BookStore
+from utility import iter_jsonl_texts
+
+try:
+    import config as _config
+except ImportError:
+    try:
+        from . import config as _config
+    except ImportError:
+        _config = None
+
+# 同时保留在内存中的页数；浏览整本书时内存只和这个值有关
+SEGMENT_ROWS_CACHED_PAGES = getattr(_config, "SEGMENT_ROWS_CACHED_PAGES", 64) if _config else 64
+
+
+class SegmentRows:
+    # 整本书的句子按 (页码, 页内序号) 排成连续的行号（从 0 开始）。
+    # 打开时只统计每页的行数，文本在读取时按页加载并做 LRU 缓存。
+    def __init__(self,
+                 cache_dir: str,
+                 page_count: int,
+                 kind: str = "split",
+                 store: BookStore | None = None,
+                 cached_pages: int | None = None):
+        self.cache_dir = cache_dir
+        self.page_count = page_count
+        self.kind = kind
+        self._store = store
+        self._cached_pages = max(1, cached_pages or SEGMENT_ROWS_CACHED_PAGES)
+        self._pages: OrderedDict[int, list[str]] = OrderedDict()
+        # 界面线程和 TTS 预取线程会同时读取
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def _page_path(self, page_number: int) -> str | None:
+        prefix = os.path.join(self.cache_dir, f"page_{page_number}")
+        suffixes = ("fixed.rst.jsonl", "rst.jsonl") if self.kind == "rst" else ("fixed.jsonl", "jsonl")
+        for suffix in suffixes:
+            path = f"{prefix}.{suffix}"
+            if os.path.exists(path):
+                return path
+        return None
+
+    def refresh(self) -> None:
+        # 重新统计行数；流水线写入新的分句结果后调用
+        store_counts = self._store.segment_counts(self.kind) if self._store is not None else {}
+        sources: list[tuple[int, str | None]] = []
+        starts: list[int] = []
+        total = 0
+        for page_number in range(1, self.page_count + 1):
+            path = self._page_path(page_number)
+            if path is not None:
+                with open(path, "rb") as handle:
+                    count = sum(1 for line in handle if line.strip())
+            elif page_number in store_counts:
+                count = store_counts[page_number]
+            else:
+                continue
+            if not count:
+                continue
+            sources.append((page_number, path))
+            starts.append(total)
+            total += count
+        with self._lock:
+            self._sources = sources
+            self._starts = starts
+            self._total = total
+            self._pages.clear()
+
+    def __len__(self) -> int:
+        return self._total
+
+    def _read_page(self, position: int) -> list[str]:
+        page_number, path = self._sources[position]
+        if path is not None:
+            return list(iter_jsonl_texts(path))
+        return self._store.get_segments(page_number, self.kind) or []
+
+    def _page_texts(self, position: int) -> list[str]:
+        with self._lock:
+            texts = self._pages.get(position)
+            if texts is not None:
+                self._pages.move_to_end(position)
+                return texts
+        texts = self._read_page(position)
+        with self._lock:
+            self._pages[position] = texts
+            if len(self._pages) > self._cached_pages:
+                self._pages.popitem(last=False)
+        return texts
+
+    def locate(self, row: int) -> tuple[int, int]:
+        # 行号 -> (页码, 页内序号，从 1 开始)
+        if not 0 <= row < self._total:
+            raise IndexError(row)
+        position = bisect.bisect_right(self._starts, row) - 1
+        return self._sources[position][0], row - self._starts[position] + 1
+
+    def row_of(self, page_number: int, idx: int = 1) -> int | None:
+        position = bisect.bisect_left(self._sources, (page_number,))
+        if position >= len(self._sources) or self._sources[position][0] != page_number:
+            return None
+        return self._starts[position] + idx - 1
+
+    def text(self, row: int) -> str:
+        if not 0 <= row < self._total:
+            raise IndexError(row)
+        position = bisect.bisect_right(self._starts, row) - 1
+        texts = self._page_texts(position)
+        offset = row - self._starts[position]
+        # 文件在打开后被改写时行数可能对不上
+        return texts[offset] if offset < len(texts) else ""
+
+    def _iter_from(self, row: int) -> Iterator[tuple[int, str]]:
+        # 顺序扫描时绕过页面缓存，避免把正在显示的页面挤出去
+        position = bisect.bisect_right(self._starts, row) - 1
+        while position < len(self._sources):
+            start = self._starts[position]
+            texts = self._pages.get(position) or self._read_page(position)
+            for offset in range(max(0, row - start), len(texts)):
+                yield start + offset, texts[offset]
+            position += 1
+
+    def find(self, query: str, start: int = 0, wrap: bool = True) -> int | None:
+        # 从 start 行开始向后查找包含 query 的行（不区分大小写）
+        query = query.casefold()
+        if not query or not self._total:
+            return None
+        start = min(max(0, start), self._total - 1)
+        for row, text in self._iter_from(start):
+            if query in text.casefold():
+                return row
+        if wrap and start:
+            for row, text in self._iter_from(0):
+                if row >= start:
+                    break
+                if query in text.casefold():
+                    return row
+        return None
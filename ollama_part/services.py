@@ -1,16 +1,49 @@
-
 import base64
 import json
+import logging
 import os
+import struct
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
 import requests
-from ollama import Client
 
+import tracing
+import transport
+from book_store import BookStore
+from manifest import DocumentManifest
+from ollama_hosts import OllamaHostPool
+from page_filter import (
+    PAGE_FILTER_ENABLED,
+    PAGE_THUMBNAIL_DPI,
+    find_duplicate,
+    find_similar,
+    is_blank,
+    page_signature,
+)
+from search_index import SearchIndex
+from segment_cache import SegmentCache
+from segment_rows import SegmentRows
 from utility import (
+    JsonlBatchWriter,
+    _jsonl_line,
+    _read_jsonl_texts,
+    _write_jsonl,
     fix_page_boundary,
+    get_pdf_cache_dir,
+    get_pdf_digest,
     get_pdf_page_count,
-    get_pdf_page_image,
-    split_json_to_jsonl,
+    get_pdf_page_sizes,
+    get_pdf_text_layer,
+    is_text_layer_usable,
+    iter_document_sentences,
+    iter_jsonl_texts,
+    render_pdf_page_bytes,
+    render_pdf_page_thumbnails,
+    render_pdf_pages,
+    split_json_files_to_jsonl,
     split_text_with_isanlp_rst,
 )
 
@@ -24,15 +57,51 @@ except ImportError:
 
 OLLAMA_BASE_URL = getattr(_config, "OLLAMA_BASE_URL", "") if _config else ""
 OLLAMA_TOKEN = getattr(_config, "TOKEN", "") if _config else ""
+OCR_CONCURRENCY = getattr(_config, "OCR_CONCURRENCY", 1) if _config else 1
+RENDER_BATCH_PAGES = getattr(_config, "RENDER_BATCH_PAGES", 16) if _config else 16
+WTPSPLIT_BATCH_PAGES = getattr(_config, "WTPSPLIT_BATCH_PAGES", 16) if _config else 16
+WTPSPLIT_BATCH_CHARS = getattr(_config, "WTPSPLIT_BATCH_CHARS", 20000) if _config else 20000
+OLLAMA_KEEP_ALIVE = getattr(_config, "OLLAMA_KEEP_ALIVE", "30m") if _config else "30m"
+MODELS_CACHE_TTL = getattr(_config, "MODELS_CACHE_TTL", 300) if _config else 300
+RST_CONCURRENCY = getattr(_config, "RST_CONCURRENCY", 4) if _config else 4
+SEGMENT_CACHE_PATH = getattr(_config, "SEGMENT_CACHE_PATH", "") if _config else ""
+PARTIAL_CHECKPOINT_SECONDS = getattr(_config, "PARTIAL_CHECKPOINT_SECONDS", 2.0) if _config else 2.0
+# 例如 {"dpi": 150, "gray": True, "image_format": "jpeg", "max_pixels": 1_000_000}
+OCR_IMAGE_OPTIONS = getattr(_config, "OCR_IMAGE_OPTIONS", None) if _config else None
+# "auto"：有可用文本层的页面直接用 pdftotext；"text"：只用文本层；"ocr"：全部走视觉模型
+TEXT_LAYER_MODE = getattr(_config, "TEXT_LAYER_MODE", "auto") if _config else "auto"
+TEXT_LAYER_BATCH_PAGES = getattr(_config, "TEXT_LAYER_BATCH_PAGES", 64) if _config else 64
+TEXT_LAYER_MODES = ("auto", "text", "ocr")
+# stream: 按页顺序带着上一页的尾句分句，每页只请求一次；pages: 逐页分句后再修补相邻页边界
+SEGMENT_MODE = getattr(_config, "SEGMENT_MODE", "stream") if _config else "stream"
+SEGMENT_MODES = ("stream", "pages")
+# 分句/RST 结果写出后同步更新全文索引
+SEARCH_INDEX_ENABLED = getattr(_config, "SEARCH_INDEX_ENABLED", True) if _config else True
+SEARCH_INDEX_PATH = getattr(_config, "SEARCH_INDEX_PATH", "") if _config else ""
+# 旧版缓存的 page_N.png 由 pdftoppm 默认分辨率渲染
+LEGACY_RENDER_DPI = 150
+
+logger = logging.getLogger(__name__)
 
 
 class ollama_services:
-    def __init__(self):
-        self._client = Client(
-            host=self._base_url() or "http://localhost:11434",
+    def __init__(self, cache_root: str | None = None):
+        self._hosts = OllamaHostPool.from_config(
+            self._base_url() or "http://localhost:11434",
             headers=self._auth_headers(),
         )
-        self._cache_root = os.path.join(os.path.dirname(__file__), "cache")
+        self._cache_root = cache_root or os.path.join(os.path.dirname(__file__), "cache")
+        self._manifests: dict[str, DocumentManifest] = {}
+        self._manifests_lock = threading.Lock()
+        self._stores: dict[str, BookStore] = {}
+        self._models_cache: tuple[float, list[str]] | None = None
+        self._segment_cache: SegmentCache | None = None
+        self._search_index: SearchIndex | None = None
+
+    @property
+    def _client(self):
+        # 第一台主机；模型列表等单次调用使用它
+        return self._hosts.hosts[0].client
 
     def _auth_headers(self):
         token = os.getenv("OLLAMA_TOKEN", OLLAMA_TOKEN)
@@ -43,19 +112,40 @@ class ollama_services:
     def _base_url(self):
         return os.getenv("OLLAMA_BASE_URL", OLLAMA_BASE_URL).rstrip("/")
 
-    def get_models(self):
+    def get_models(self, refresh: bool = False):
+        # 模型列表短时间内基本不变，缓存 MODELS_CACHE_TTL 秒；错误结果不缓存
+        cached = self._models_cache
+        if not refresh and cached and time.monotonic() - cached[0] < MODELS_CACHE_TTL:
+            return list(cached[1])
         try:
-            response = requests.get(
+            response = transport.get(
                 f"{self._base_url()}/api/tags",
                 headers=self._auth_headers(),
-                timeout=200,
             )
             response.raise_for_status()
             data = response.json()
-            return [model["name"] for model in data.get("models", [])]
+            models = [model["name"] for model in data.get("models", [])]
         except requests.RequestException as exc:
             return [f"Error: {exc}"]
-        
+        self._models_cache = (time.monotonic(), models)
+        return list(models)
+
+    def warm_up_model(self, model: str | None, keep_alive: str | int | None = None) -> str:
+        if not model:
+            return "No model selected."
+        # 不带 prompt 的 generate 请求只加载模型，不生成内容；每台主机都预热
+        errors = []
+        for host in self._hosts.hosts:
+            try:
+                host.client.generate(
+                    model=model,
+                    keep_alive=keep_alive if keep_alive is not None else OLLAMA_KEEP_ALIVE,
+                )
+            except Exception as exc:
+                errors.append(f"{host.url}: {exc}")
+        if len(errors) == len(self._hosts.hosts):
+            return f"Error: {'; '.join(errors)}"
+        return "ok"
 
     def say_hello(self, select_model: str):
         if not select_model:
@@ -66,11 +156,10 @@ class ollama_services:
             "stream": False,
         }
         try:
-            response = requests.post(
+            response = transport.post(
                 f"{self._base_url()}/api/generate",
                 json=payload,
                 headers=self._auth_headers(),
-                timeout=200,
             )
             response.raise_for_status()
             data = response.json()
@@ -78,13 +167,55 @@ class ollama_services:
         except requests.RequestException as exc:
             return f"Error: {exc}"
 
-    def get_pdfimg_text(self, pdf_path: str, model: str | None = None):
+    def say_hello_stream(self, select_model: str) -> Iterator[str]:
+        if not select_model:
+            yield "No model selected."
+            return
+        payload = {
+            "model": select_model,
+            "prompt": "Say hello!",
+            "stream": True,
+        }
+        try:
+            response = transport.post(
+                f"{self._base_url()}/api/generate",
+                json=payload,
+                headers=self._auth_headers(),
+                stream=True,
+            )
+            response.raise_for_status()
+            with response:
+                # 每行是一个 JSON 对象，done 为 true 时结束
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    token = data.get("response", "")
+                    if token:
+                        yield token
+                    if data.get("done"):
+                        break
+        except requests.RequestException as exc:
+            yield f"Error: {exc}"
+
+    def get_pdfimg_text(self,
+                        pdf_path: str,
+                        model: str | None = None,
+                        concurrency: int | None = None,
+                        image_options: dict | None = None,
+                        cancel_event: threading.Event | None = None,
+                        progress: Callable[[int, int], None] | None = None,
+                        on_token: Callable[[int, str], None] | None = None,
+                        on_page_finished: Callable[[int], None] | None = None,
+                        text_mode: str | None = None,
+                        filter_pages: bool | None = None,
+                        pages: list[int] | None = None,
+                        warm_up: bool = True):
         if not pdf_path:
             return "No PDF path."
-
-        pdf_name = os.path.splitext(os.path.basename(pdf_path))[0] or "unknown"
-        cache_dir = os.path.join(self._cache_root, pdf_name)
-        os.makedirs(cache_dir, exist_ok=True)
+        text_mode = text_mode or TEXT_LAYER_MODE
+        if text_mode not in TEXT_LAYER_MODES:
+            return f"Unknown text mode: {text_mode}"
 
         page_count = get_pdf_page_count(pdf_path)
         if isinstance(page_count, str):
@@ -92,44 +223,592 @@ class ollama_services:
         if page_count < 1:
             return "Invalid page count."
 
-    # 找到第一个缺失或无效的页面
-        start_page = 1
-        for page_num in range(1, page_count + 1):
-            text_path = os.path.join(cache_dir, f"page_{page_num}.json")
-            if not os.path.exists(text_path):
-                start_page = page_num
-                break
+        manifest = self._open_document(pdf_path, page_count)
+        # 清单记录了每页状态，一次读取即可找到所有缺失的页面
+        pending = manifest.pending("ocr", page_count)
+        if pages is not None:
+            # 只处理指定的页面，例如任务队列中的一段
+            wanted = set(pages)
+            pending = [page_number for page_number in pending if page_number in wanted]
+        if not pending:
+            return "ok"
+
+        if text_mode != "ocr":
+            total = len(pending)
+            pending, failures = self._read_text_layer(
+                pdf_path, manifest, pending, force=text_mode == "text"
+            )
+            if progress is not None:
+                progress(page_count - len(pending) - len(failures), page_count)
+            if text_mode == "text":
+                return _format_failures(failures, total)
+            if not pending:
+                return "ok"
+
+        deferred: dict[int, int] = {}
+        if PAGE_FILTER_ENABLED if filter_pages is None else filter_pages:
+            pending, deferred = self._filter_pages(pdf_path, manifest, pending)
+            if not pending and not deferred:
+                return "ok"
+
+        concurrency = max(1, int(concurrency or self._hosts.capacity or OCR_CONCURRENCY))
+        # 预先加载模型，避免第一页承担冷启动延迟；失败时各页会各自报错
+        if warm_up:
+            self.warm_up_model(model)
+        if image_options is None:
+            image_options = OCR_IMAGE_OPTIONS
+        on_page_done = None
+        if progress is not None:
+            done_before = page_count - len(pending) - len(deferred)
+
+            def on_page_done(done: int):
+                progress(done_before + done, page_count)
+
+        failures = self._ocr_pages(
+            pdf_path,
+            manifest,
+            pending,
+            model,
+            concurrency,
+            image_options,
+            cancel_event,
+            on_page_done,
+            on_token,
+            on_page_finished,
+        )
+        failures.update(self._copy_duplicates(manifest, deferred))
+        if cancel_event is not None and cancel_event.is_set():
+            remaining = len(manifest.pending("ocr", page_count))
+            return f"Cancelled: {page_count - remaining} of {page_count} pages done."
+        return _format_failures(failures, len(pending) + len(deferred))
+
+    def _open_document(self, pdf_path: str, page_count: int) -> DocumentManifest:
+        cache_dir = get_pdf_cache_dir(pdf_path, self._cache_root)
+        pdf_name = os.path.splitext(os.path.basename(pdf_path))[0] or "unknown"
+        legacy_dir = os.path.join(self._cache_root, pdf_name)
+        # 旧版缓存按文件名存放，首次打开时迁移到内容哈希目录
+        if (not os.path.exists(cache_dir)
+                and os.path.isdir(legacy_dir)
+                and not DocumentManifest.exists(legacy_dir)):
+            # 同名的另一本书也会找到这个目录，内容对不上时保留原样
+            mismatch = self._legacy_mismatch(pdf_path, legacy_dir, page_count)
+            if mismatch:
+                logger.warning("Not migrating legacy cache %s for %s: %s", legacy_dir, pdf_path, mismatch)
+            else:
+                self._migrate_legacy_dir(legacy_dir, cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        manifest = self._manifest_for_dir(cache_dir)
+        if manifest.page_count != page_count or pdf_name not in manifest.names:
+            manifest.describe(get_pdf_digest(pdf_path), pdf_name, page_count)
+        return manifest
+
+    def _legacy_mismatch(self, pdf_path: str, legacy_dir: str, page_count: int) -> str | None:
+        # 返回旧缓存不属于这本书的原因：页码超出页数，或渲染图尺寸与对应页面不符
+        renders: list[tuple[int, str]] = []
+        for entry in os.scandir(legacy_dir):
+            stem, _, suffix = entry.name.partition(".")
+            if not stem.startswith("page_"):
+                continue
             try:
-                with open(text_path, "r", encoding="utf-8") as handle:
-                    cached = json.load(handle)
-                if not cached.get("text"):
-                    start_page = page_num
-                    break
-            except Exception:
-                start_page = page_num
-                break
+                page_number = int(stem[len("page_"):])
+            except ValueError:
+                continue
+            if page_number > page_count:
+                return f"page {page_number} is beyond the {page_count} pages of this PDF"
+            if suffix == "png":
+                renders.append((page_number, entry.path))
+        if not renders:
+            return None
+        sizes = get_pdf_page_sizes(pdf_path)
+        if isinstance(sizes, str):
+            return sizes
+        for page_number, path in renders:
+            image_size = _png_size(path)
+            if image_size is None or page_number not in sizes:
+                continue
+            expected = [round(points * LEGACY_RENDER_DPI / 72) for points in sizes[page_number]]
+            # 页面可能旋转了 90 度；像素取整差 1 以内
+            if not any(
+                abs(image_size[0] - width) <= 1 and abs(image_size[1] - height) <= 1
+                for width, height in (expected, expected[::-1])
+            ):
+                return (
+                    f"page_{page_number}.png is {image_size[0]}x{image_size[1]},"
+                    f" expected {expected[0]}x{expected[1]}"
+                )
+        return None
 
-        for page_number in range(start_page, page_count + 1):
-            text_path = os.path.join(cache_dir, f"page_{page_number}.json")
-            image_path = os.path.join(cache_dir, f"page_{page_number}.png")
-            if not os.path.exists(image_path):
-                render_result = get_pdf_page_image(
-                    pdf_path,
+    def _migrate_legacy_dir(self, legacy_dir: str, cache_dir: str) -> None:
+        # 逐个文件移动：os.link 在目标已存在时失败，不会覆盖其他进程刚写入的新结果
+        with self._manifests_lock:
+            os.makedirs(cache_dir, exist_ok=True)
+            for entry in os.scandir(legacy_dir):
+                if not entry.is_file():
+                    continue
+                target = os.path.join(cache_dir, entry.name)
+                try:
+                    os.link(entry.path, target)
+                except FileExistsError:
+                    continue
+                os.remove(entry.path)
+            try:
+                os.rmdir(legacy_dir)
+            except OSError:
+                pass
+
+    def _manifest_for_dir(self, cache_dir: str) -> DocumentManifest:
+        cache_dir = os.path.abspath(cache_dir)
+        with self._manifests_lock:
+            manifest = self._manifests.get(cache_dir)
+            if manifest is None:
+                manifest = DocumentManifest(cache_dir)
+                self._manifests[cache_dir] = manifest
+            return manifest
+
+    def _store_for_dir(self, cache_dir: str) -> BookStore:
+        cache_dir = os.path.abspath(cache_dir)
+        with self._manifests_lock:
+            store = self._stores.get(cache_dir)
+            if store is None:
+                store = BookStore.for_cache_dir(cache_dir)
+                self._stores[cache_dir] = store
+            return store
+
+    def pack_document(self, pdf_path: str) -> str:
+        # 流水线的最后一个阶段（pipeline_cli 默认在 rst 之后运行）；重复运行只处理新完成的页面
+        page_count = get_pdf_page_count(pdf_path)
+        if isinstance(page_count, str):
+            return page_count
+        manifest = self._open_document(pdf_path, page_count)
+        cache_dir = manifest.cache_dir
+        store = self._store_for_dir(cache_dir)
+
+        # 把逐页的小文件并入 book.sqlite3；只有不会再被后续阶段改写的页面才删除原文件
+        packed = []
+        removed = 0
+        for page_number in range(1, page_count + 1):
+            state = manifest.page(page_number)
+            if state.get("packed"):
+                continue
+            paths = self._page_files(cache_dir, page_number)
+            if "json" in paths:
+                with open(paths["json"], "r", encoding="utf-8") as handle:
+                    store.put_page_text(
+                        page_number,
+                        json.load(handle).get("text", ""),
+                        state.get("model"),
+                    )
+            split_path = paths.get("fixed.jsonl") or paths.get("jsonl")
+            if split_path:
+                store.put_segments(page_number, _read_jsonl_texts(split_path), kind="split")
+            rst_path = paths.get("fixed.rst.jsonl") or paths.get("rst.jsonl")
+            if rst_path:
+                store.put_segments(page_number, _read_jsonl_texts(rst_path), kind="rst")
+            store.set_state(page_number, **state)
+
+            if state.get("ocr") and "png" in paths:
+                os.remove(paths.pop("png"))
+                removed += 1
+            # 两侧相邻页也已修复边界，之后不会再读写这一页的文件
+            final = (
+                state.get("ocr")
+                and state.get("rst")
+                and (state.get("fixed") or page_count == 1)
+                and (page_number == 1 or manifest.page(page_number - 1).get("fixed"))
+                and (page_number == page_count or manifest.page(page_number + 1).get("fixed"))
+            )
+            if not final:
+                continue
+            for path in paths.values():
+                os.remove(path)
+                removed += 1
+            packed.append(page_number)
+        if packed:
+            for page_number in packed:
+                store.set_state(page_number, packed=True)
+            manifest.mark(packed, packed=True)
+        return f"Packed {len(packed)} of {page_count} pages; removed {removed} files."
+
+    def _page_files(self, cache_dir: str, page_number: int) -> dict[str, str]:
+        paths = {}
+        for suffix in ("png", "json", "jsonl", "fixed.jsonl", "rst.jsonl", "fixed.rst.jsonl"):
+            path = os.path.join(cache_dir, f"page_{page_number}.{suffix}")
+            if os.path.exists(path):
+                paths[suffix] = path
+        return paths
+
+    def get_page_segments(self,
+                          pdf_path: str,
+                          page_number: int,
+                          kind: str = "split") -> list[str] | None:
+        page_count = get_pdf_page_count(pdf_path)
+        if isinstance(page_count, str):
+            return None
+        cache_dir = self._open_document(pdf_path, page_count).cache_dir
+        if BookStore.exists(cache_dir):
+            segments = self._store_for_dir(cache_dir).get_segments(page_number, kind)
+            if segments is not None:
+                return segments
+        paths = self._page_files(cache_dir, page_number)
+        if kind == "rst":
+            path = paths.get("fixed.rst.jsonl") or paths.get("rst.jsonl")
+        else:
+            path = paths.get("fixed.jsonl") or paths.get("jsonl")
+        return _read_jsonl_texts(path) if path else None
+
+    def get_sentence(self, pdf_path: str, sentence_id: int, kind: str = "split"):
+        # 按整本书内的句子编号随机读取，需要先 pack_document（流水线的 pack 阶段）
+        page_count = get_pdf_page_count(pdf_path)
+        if isinstance(page_count, str):
+            return page_count
+        cache_dir = self._open_document(pdf_path, page_count).cache_dir
+        if not BookStore.exists(cache_dir):
+            return "Document is not packed."
+        return self._store_for_dir(cache_dir).get_sentence(sentence_id, kind)
+
+    def open_segment_rows(self, pdf_path: str, kind: str = "split") -> SegmentRows:
+        # 整本书的句子按行号随机读取；同时覆盖逐页文件和已打包到 book.sqlite3 的页面
+        page_count = get_pdf_page_count(pdf_path)
+        if isinstance(page_count, str):
+            raise ValueError(page_count)
+        cache_dir = self._open_document(pdf_path, page_count).cache_dir
+        store = self._store_for_dir(cache_dir) if BookStore.exists(cache_dir) else None
+        return SegmentRows(cache_dir, page_count, kind=kind, store=store)
+
+    def sentence_reader(self,
+                        pdf_path: str,
+                        kind: str = "split",
+                        rows: SegmentRows | None = None) -> Callable[[int], tuple | None]:
+        # 返回 编号（从 1 开始，与句子浏览器一致）-> (句子文本, (页码, 页内序号)) 的函数，供 TTS 预取使用；
+        # 位置来自 SegmentRows，逐页文件和已打包的页面都适用。传入 rows 时复用已经打开的 SegmentRows
+        if rows is None:
+            rows = self.open_segment_rows(pdf_path, kind)
+
+        def _read(sentence_id: int) -> tuple[str, tuple[int, int]] | None:
+            if not 1 <= sentence_id <= len(rows):
+                return None
+            return rows.text(sentence_id - 1), rows.locate(sentence_id - 1)
+
+        return _read
+
+    def get_cache_status(self, pdf_path: str):
+        page_count = get_pdf_page_count(pdf_path)
+        if isinstance(page_count, str):
+            return page_count
+        return self._open_document(pdf_path, page_count).status()
+
+    def _ocr_pages(self,
+                   pdf_path: str,
+                   manifest: DocumentManifest,
+                   pages: list[int],
+                   model: str | None,
+                   concurrency: int,
+                   image_options: dict | None = None,
+                   cancel_event: threading.Event | None = None,
+                   on_page_done: Callable[[int], None] | None = None,
+                   on_token: Callable[[int, str], None] | None = None,
+                   on_page_finished: Callable[[int], None] | None = None) -> dict[int, str]:
+        failures: dict[int, str] = {}
+        # Rendering runs on its own thread and stays ahead of the OCR calls.
+        # On disk each batch is a single pdftoppm invocation; in memory
+        # (image_options given) pages are streamed from stdout one at a time.
+        batch_size = 1 if image_options else RENDER_BATCH_PAGES
+        render_ahead = max(concurrency * 2, batch_size)
+        batches = iter(self._render_batches(pages, batch_size))
+        renders: dict[int, Future] = {}
+        in_flight: dict[Future, int] = {}
+        completed = 0
+
+        def _collect(done):
+            nonlocal completed
+            for future in done:
+                page_number = in_flight.pop(future)
+                exc = future.exception()
+                if exc is not None:
+                    failures[page_number] = str(exc)
+            completed += len(done)
+            if on_page_done is not None and done:
+                on_page_done(completed)
+
+        with ThreadPoolExecutor(max_workers=1) as render_pool, \
+                ThreadPoolExecutor(max_workers=concurrency) as ocr_pool:
+            scheduled = 0
+            for index, page_number in enumerate(pages):
+                # 协作式取消：不再提交新页面，等待已在处理中的页面结束
+                if cancel_event is not None and cancel_event.is_set():
+                    for future in renders.values():
+                        future.cancel()
+                    break
+                while scheduled < min(index + render_ahead, len(pages)):
+                    batch = next(batches)
+                    future = render_pool.submit(
+                        self._render_pages, pdf_path, manifest, batch, image_options
+                    )
+                    for batch_page in batch:
+                        renders[batch_page] = future
+                    scheduled += len(batch)
+                while len(in_flight) >= concurrency:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    _collect(done)
+                if cancel_event is not None and cancel_event.is_set():
+                    continue
+                future = ocr_pool.submit(
+                    self._ocr_page,
+                    manifest,
                     page_number,
-                    self._cache_root,
+                    model,
+                    renders.pop(page_number),
+                    on_token,
+                    on_page_finished,
                 )
-                if isinstance(render_result, str):
-                    return render_result
+                in_flight[future] = page_number
+            _collect(wait(in_flight).done)
+        manifest.save()
+        return failures
 
-            if not os.path.exists(image_path):
-                return "Cached image not found."
+    def _read_text_layer(self,
+                         pdf_path: str,
+                         manifest: DocumentManifest,
+                         pages: list[int],
+                         force: bool = False) -> tuple[list[int], dict[int, str]]:
+        # 返回 (仍需 OCR 的页面, 失败的页面)；force 时不做可用性判断，也不回退到 OCR
+        remaining: list[int] = []
+        failures: dict[int, str] = {}
+        for batch in self._render_batches(pages, TEXT_LAYER_BATCH_PAGES):
+            texts = get_pdf_text_layer(pdf_path, batch[0], batch[-1])
+            if isinstance(texts, str):
+                if force:
+                    failures.update({page_number: texts for page_number in batch})
+                else:
+                    remaining.extend(batch)
+                continue
+            saved = []
+            for page_number, text in zip(batch, texts):
+                if not (force or is_text_layer_usable(text)):
+                    remaining.append(page_number)
+                    continue
+                if not text:
+                    failures[page_number] = "No text layer."
+                    continue
+                self._write_page_text(manifest.cache_dir, page_number, text)
+                saved.append(page_number)
+            if saved:
+                manifest.mark(saved, ocr=True, text_layer=True)
+        return remaining, failures
 
-            with open(image_path, "rb") as handle:
-                image_payload = base64.b64encode(handle.read()).decode("ascii")
+    def _filter_pages(self,
+                      pdf_path: str,
+                      manifest: DocumentManifest,
+                      pages: list[int]) -> tuple[list[int], dict[int, int]]:
+        # 用低分辨率缩略图判断空白页和重复页；返回 (需要 OCR 的页面, {重复页: 待 OCR 的原页})
+        known: dict[int, dict] = {}
+        for page_number in manifest.pages_with("ocr"):
+            state = manifest.page(page_number)
+            if state.get("image_digest") and not state.get("skipped"):
+                known[page_number] = state
+        to_ocr: list[int] = []
+        deferred: dict[int, int] = {}
+        for batch in self._render_batches(pages, TEXT_LAYER_BATCH_PAGES):
+            images = render_pdf_page_thumbnails(pdf_path, batch[0], batch[-1], PAGE_THUMBNAIL_DPI)
+            if isinstance(images, str):
+                to_ocr.extend(batch)
+                continue
+            for page_number, (width, height, pixels) in zip(batch, images):
+                signature = page_signature(width, height, pixels)
+                if is_blank(signature):
+                    self._write_page_text(manifest.cache_dir, page_number, "")
+                    manifest.mark(page_number, save=False, ocr=True, skipped="blank", **signature)
+                    continue
+                source = find_duplicate(signature, known)
+                if source is None:
+                    # 哈希相近的页面只记录下来，照常 OCR
+                    similar = find_similar(signature, known)
+                    if similar is not None:
+                        signature = dict(signature, similar_to=similar)
+                    manifest.mark(page_number, save=False, **signature)
+                    known[page_number] = signature
+                    to_ocr.append(page_number)
+                elif manifest.page(source).get("ocr"):
+                    self._write_page_text(
+                        manifest.cache_dir, page_number, self._read_page_text(manifest, source)
+                    )
+                    manifest.mark(
+                        page_number,
+                        save=False,
+                        ocr=True,
+                        skipped="duplicate",
+                        duplicate_of=source,
+                        **signature,
+                    )
+                else:
+                    manifest.mark(page_number, save=False, **signature)
+                    deferred[page_number] = source
+        manifest.save()
+        return to_ocr, deferred
+
+    def _copy_duplicates(self,
+                         manifest: DocumentManifest,
+                         deferred: dict[int, int]) -> dict[int, str]:
+        failures: dict[int, str] = {}
+        for page_number, source in sorted(deferred.items()):
+            if not manifest.page(source).get("ocr"):
+                failures[page_number] = f"Duplicate of page {source}, which has no text."
+                continue
+            self._write_page_text(
+                manifest.cache_dir, page_number, self._read_page_text(manifest, source)
+            )
+            manifest.mark(page_number, save=False, ocr=True, skipped="duplicate", duplicate_of=source)
+        if deferred:
+            manifest.save()
+        return failures
 
+    def _read_page_text(self, manifest: DocumentManifest, page_number: int) -> str:
+        text_path = os.path.join(manifest.cache_dir, f"page_{page_number}.json")
+        if os.path.exists(text_path):
+            with open(text_path, "r", encoding="utf-8") as handle:
+                return json.load(handle).get("text", "")
+        # 已打包的页面只在 book.sqlite3 中
+        if BookStore.exists(manifest.cache_dir):
+            return self._store_for_dir(manifest.cache_dir).get_page_text(page_number) or ""
+        return ""
+
+    def _render_batches(self, pages: list[int], batch_size: int) -> list[list[int]]:
+        batches: list[list[int]] = []
+        for page_number in pages:
+            if (batches
+                    and batches[-1][-1] == page_number - 1
+                    and len(batches[-1]) < batch_size):
+                batches[-1].append(page_number)
+            else:
+                batches.append([page_number])
+        return batches
+
+    def _render_pages(self,
+                      pdf_path: str,
+                      manifest: DocumentManifest,
+                      batch: list[int],
+                      image_options: dict | None = None) -> bytes | None:
+        if image_options:
+            image_bytes = render_pdf_page_bytes(pdf_path, batch[0], **image_options)
+            if isinstance(image_bytes, str):
+                raise RuntimeError(image_bytes)
+            return image_bytes
+
+        render_result = render_pdf_pages(
+            pdf_path,
+            self._cache_root,
+            batch[0],
+            batch[-1],
+        )
+        if isinstance(render_result, str):
+            raise RuntimeError(render_result)
+        manifest.mark(batch, save=False, rendered=True)
+        manifest.checkpoint()
+        return None
+
+    def _ocr_page(self,
+                  manifest: DocumentManifest,
+                  page_number: int,
+                  model: str | None,
+                  render: Future,
+                  on_token: Callable[[int, str], None] | None = None,
+                  on_page_finished: Callable[[int], None] | None = None) -> None:
+        # on_page_finished 在这一页结束（成功或失败）后调用，界面据此切换正在显示的页面
+        try:
+            image_bytes = self._load_page_image(manifest, page_number, render.result())
+            if on_token is None:
+                text = self.ocr_image(image_bytes, model)
+            else:
+                text = self._ocr_page_streaming(manifest, page_number, image_bytes, model, on_token)
+            self._save_page_text(manifest, page_number, text, model)
+        finally:
+            if on_page_finished is not None:
+                on_page_finished(page_number)
+
+    def _ocr_page_streaming(self,
+                            manifest: DocumentManifest,
+                            page_number: int,
+                            image_bytes: bytes,
+                            model: str | None,
+                            on_token: Callable[[int, str], None]) -> str:
+        # 流式识别时定期保存已收到的文本；中断后从这段文本继续生成
+        partial_path = os.path.join(manifest.cache_dir, f"page_{page_number}.partial.json")
+        prefix = ""
+        if os.path.exists(partial_path):
             try:
-                response = self._client.chat(
+                with open(partial_path, "r", encoding="utf-8") as handle:
+                    prefix = json.load(handle).get("text", "")
+            except Exception:
+                prefix = ""
+        parts = [prefix] if prefix else []
+        if prefix:
+            on_token(page_number, prefix)
+
+        last_checkpoint = time.monotonic()
+        try:
+            for token in self.ocr_image_stream(image_bytes, model, prefix=prefix):
+                parts.append(token)
+                on_token(page_number, token)
+                if time.monotonic() - last_checkpoint >= PARTIAL_CHECKPOINT_SECONDS:
+                    self._write_partial(partial_path, "".join(parts))
+                    last_checkpoint = time.monotonic()
+        except BaseException:
+            if parts:
+                self._write_partial(partial_path, "".join(parts))
+            raise
+
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        return "".join(parts)
+
+    def _write_partial(self, partial_path: str, text: str) -> None:
+        temp_path = partial_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump({"text": text}, handle, ensure_ascii=False)
+        os.replace(temp_path, partial_path)
+
+    def _load_page_image(self,
+                         manifest: DocumentManifest,
+                         page_number: int,
+                         image_bytes: bytes | None) -> bytes:
+        if image_bytes is not None:
+            return image_bytes
+        image_path = os.path.join(manifest.cache_dir, f"page_{page_number}.png")
+        if not os.path.exists(image_path):
+            raise RuntimeError("Cached image not found.")
+        with tracing.span("image_read", page=page_number) as span:
+            with open(image_path, "rb") as handle:
+                image_bytes = handle.read()
+            span.set(bytes_in=len(image_bytes))
+        return image_bytes
+
+    def _save_page_text(self,
+                        manifest: DocumentManifest,
+                        page_number: int,
+                        text: str,
+                        model: str | None) -> None:
+        self._write_page_text(manifest.cache_dir, page_number, text)
+        # ocr 表示这一页已经识别过；没有文字的页面记为 empty，分句时照常通过，不再反复识别。
+        # 清单定期保存，调用方处理完一批页面后再 save()；中途崩溃时未保存的页面会重新识别
+        manifest.mark(page_number, save=False, ocr=True, empty=not text, model=model)
+        manifest.checkpoint()
+
+    def _write_page_text(self, cache_dir: str, page_number: int, text: str) -> None:
+        text_path = os.path.join(cache_dir, f"page_{page_number}.json")
+        # 先写临时文件再改名，中途崩溃不会留下半个 page_N.json
+        temp_path = text_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump({"text": text}, handle, ensure_ascii=False)
+        os.replace(temp_path, text_path)
+
+    def ocr_image(self, image_bytes: bytes, model: str | None = None) -> str:
+        image_payload = _encode_image(image_bytes)
+        with tracing.span("ollama_chat", model=model, bytes_out=len(image_payload)) as span:
+            response = self._hosts.run(
+                lambda client: client.chat(
                     model=model,
+                    keep_alive=OLLAMA_KEEP_ALIVE,
                     messages=[
                         {
                             "role": "user",
@@ -138,128 +817,496 @@ class ollama_services:
                         }
                     ],
                 )
-                text = getattr(response, "message", None)
-                text = getattr(text, "content", "") if text else ""
-                with open(text_path, "w", encoding="utf-8") as handle:
-                    json.dump({"text": text}, handle, ensure_ascii=False)
-            except Exception as exc:
-                return f"Error: {exc}"
+            )
+            text = getattr(response, "message", None)
+            content = getattr(text, "content", "") if text else ""
+            span.set(bytes_in=len(content.encode("utf-8")))
+        return content
+
+    def ocr_image_stream(self,
+                         image_bytes: bytes,
+                         model: str | None = None,
+                         prefix: str = "") -> Iterator[str]:
+        image_payload = _encode_image(image_bytes)
+        messages = [
+            {
+                "role": "user",
+                "content": "<image>\nFree OCR.",
+                "images": [image_payload],
+            }
+        ]
+        if prefix:
+            # 最后一条是 assistant 消息时，Ollama 会接着这段内容继续生成
+            messages.append({"role": "assistant", "content": prefix})
+        with tracing.span(
+            "ollama_chat",
+            model=model,
+            stream=True,
+            bytes_out=len(image_payload),
+            resumed=bool(prefix),
+        ) as span:
+            for chunk in self._hosts.stream(
+                lambda client: client.chat(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    keep_alive=OLLAMA_KEEP_ALIVE,
+                )
+            ):
+                message = getattr(chunk, "message", None)
+                token = getattr(message, "content", "") if message else ""
+                if token:
+                    span.add("bytes_in", len(token.encode("utf-8")))
+                    yield token
+
+    def split_cache_json_to_jsonl(self, threshold: float | None = None, mode: str | None = None):
+        mode = mode or SEGMENT_MODE
+        if mode not in SEGMENT_MODES:
+            raise ValueError(f"Unknown segment mode: {mode}")
+        if not os.path.isdir(self._cache_root):
+            return
+        for entry in os.scandir(self._cache_root):
+            if not entry.is_dir() or not DocumentManifest.is_document_dir(entry.path):
+                continue
+            manifest = self._manifest_for_dir(entry.path)
+            if mode == "stream":
+                self._stream_split_document(manifest, threshold)
+            elif not self._stream_segmented(manifest):
+                self._split_document(manifest, threshold)
+
+    def _stream_segmented(self, manifest: DocumentManifest) -> bool:
+        # stream 模式写出的记录带 [起始页, 结束页]，逐页模式的边界修复不能处理，这样的书只能继续用 stream
+        return bool(manifest.pages_with("segmenter"))
 
+    def _stream_split_document(self, manifest: DocumentManifest, threshold: float | None):
+        # 从第一页未完成的页面开始，沿连续已 OCR 的页面（包括空白页）顺序分句；
+        # 句子归入起始页的 page_N.fixed.jsonl，记录为 [序号, 文本, [起始页, 结束页]]
+        cache_dir = manifest.cache_dir
+        done = set(manifest.pages_with("ocr"))
+        start = next(
+            (page_number for page_number in sorted(done)
+             if not manifest.page(page_number).get("fixed")),
+            None,
+        )
+        if start is None:
+            return
+        end = start
+        while end + 1 in done:
+            end += 1
+        final = end >= manifest.page_count
+
+        def pages():
+            for page_number in range(start, end + 1):
+                yield page_number, self._read_page_text(manifest, page_number)
+
+        buffered: dict[int, list[tuple[str, list[int]]]] = {}
+        flushed: list[int] = []
+        next_page = start
+
+        def flush(batch: JsonlBatchWriter, until: int) -> None:
+            # 起始页小于 until 的句子都已输出，但只有最后一句不延伸到后面页面时才能落盘：
+            # 否则中断后从下一页重新分句，跨页句子的后半截会再输出一次
+            nonlocal next_page
+            safe = next_page - 1
+            reach = safe
+            for page_number in range(next_page, until):
+                for _, source_ref in buffered.get(page_number, []):
+                    reach = max(reach, source_ref[1])
+                if reach <= page_number:
+                    safe = page_number
+            while next_page <= safe:
+                path = self._segment_path(cache_dir, next_page, True)
+                with batch.open(path) as handle:
+                    for idx, (text, source_ref) in enumerate(buffered.pop(next_page, []), start=1):
+                        handle.write(_jsonl_line(idx, text, source_ref))
+                flushed.append(next_page)
+                next_page += 1
+
+        with JsonlBatchWriter() as batch:
+            for sentence in iter_document_sentences(
+                pages(),
+                threshold=threshold,
+                cache=self._get_segment_cache(),
+                final=final,
+            ):
+                first_page = sentence["source_ref"][0]
+                flush(batch, first_page)
+                buffered.setdefault(first_page, []).append((sentence["text"], sentence["source_ref"]))
+            if final:
+                flush(batch, end + 1)
+        for page_number in flushed:
+            raw_path = self._segment_path(cache_dir, page_number, False)
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+        if flushed:
+            manifest.mark(flushed, split=True, fixed=True, segmenter="stream")
+            self._update_index(manifest, flushed)
+
+    def render_document(self,
+                        pdf_path: str,
+                        progress: Callable[[int, int], None] | None = None) -> str:
+        # 只把尚未渲染的页面写成 page_N.png，不做 OCR
+        page_count = get_pdf_page_count(pdf_path)
+        if isinstance(page_count, str):
+            return page_count
+        manifest = self._open_document(pdf_path, page_count)
+        pending = [
+            page_number
+            for page_number in manifest.pending("rendered", page_count)
+            if not manifest.page(page_number).get("ocr")
+        ]
+        done = page_count - len(pending)
+        for batch in self._render_batches(pending, RENDER_BATCH_PAGES):
+            self._render_pages(pdf_path, manifest, batch)
+            done += len(batch)
+            if progress is not None:
+                progress(done, page_count)
+        manifest.save()
         return "ok"
 
-    def split_cache_json_to_jsonl(self, threshold: float | None = None):
-        cache_root = self._cache_root
-        fixed_suffix = ".fixed.jsonl"
+    def split_document(self,
+                       pdf_path: str,
+                       threshold: float | None = None,
+                       mode: str | None = None,
+                       fix: bool = True) -> str:
+        # 只处理一本书；stream 模式分句时已经处理了页边界，fix 不再起作用
+        mode = mode or SEGMENT_MODE
+        if mode not in SEGMENT_MODES:
+            return f"Unknown segment mode: {mode}"
+        page_count = get_pdf_page_count(pdf_path)
+        if isinstance(page_count, str):
+            return page_count
+        manifest = self._open_document(pdf_path, page_count)
+        if mode == "stream":
+            self._stream_split_document(manifest, threshold)
+        elif self._stream_segmented(manifest):
+            return "Invalid segment mode: this document was split in stream mode."
+        else:
+            self._split_pages(manifest, threshold)
+            if fix:
+                self._fix_boundaries(manifest, threshold)
+        return "ok"
 
-        def _page_number(filename: str) -> int | None:
-            if not filename.startswith("page_"):
-                return None
-            stem = os.path.splitext(filename)[0]
-            try:
-                return int(stem.split("_", 1)[1])
-            except (IndexError, ValueError):
-                return None
+    def fix_document_boundaries(self, pdf_path: str, threshold: float | None = None) -> str:
+        page_count = get_pdf_page_count(pdf_path)
+        if isinstance(page_count, str):
+            return page_count
+        self._fix_boundaries(self._open_document(pdf_path, page_count), threshold)
+        return "ok"
 
-        def _page_paths(dirpath: str, page_num: int) -> tuple[str | None, str | None]:
-            jsonl_path = os.path.join(dirpath, f"page_{page_num}.jsonl")
-            fixed_path = os.path.join(dirpath, f"page_{page_num}{fixed_suffix}")
-            return (jsonl_path if os.path.exists(jsonl_path) else None,
-                    fixed_path if os.path.exists(fixed_path) else None)
-
-        for dirpath, _, filenames in os.walk(cache_root):
-            json_files = [name for name in filenames if name.endswith(".json")]
-            for name in json_files:
-                input_path = os.path.join(dirpath, name)
-                output_path = os.path.splitext(input_path)[0] + ".jsonl"
-                fixed_path = os.path.splitext(input_path)[0] + fixed_suffix
-                # Skip if already converted (either raw or fixed).
-                if os.path.exists(output_path) or os.path.exists(fixed_path):
-                    continue
-                split_json_to_jsonl(input_path, threshold=threshold)
-
-        for dirpath, _, filenames in os.walk(cache_root):
-            # Build a page map across raw and fixed jsonl files.
-            page_nums = set()
-            for name in filenames:
-                if name.endswith(".jsonl"):
-                    page_num = _page_number(name)
-                    if page_num is not None:
-                        page_nums.add(page_num)
-
-            if not page_nums:
+    def rst_document(self,
+                     pdf_path: str,
+                     min_length: int = 120,
+                     concurrency: int | None = None,
+                     progress: Callable[[int, int], None] | None = None,
+                     pages: list[int] | None = None) -> str:
+        # 对已修复边界但还没有 RST 结果的页面拆分长句
+        page_count = get_pdf_page_count(pdf_path)
+        if isinstance(page_count, str):
+            return page_count
+        manifest = self._open_document(pdf_path, page_count)
+        # 只有一页的书没有页边界可修
+        ready = manifest.pages_with("split" if page_count == 1 else "fixed")
+        pending = [page_number for page_number in ready if not manifest.page(page_number).get("rst")]
+        if pages is not None:
+            wanted = set(pages)
+            pending = [page_number for page_number in pending if page_number in wanted]
+        failures: dict[int, str] = {}
+        for done, page_number in enumerate(pending, start=1):
+            fixed = bool(manifest.page(page_number).get("fixed"))
+            path = self._segment_path(manifest.cache_dir, page_number, fixed)
+            if os.path.exists(path):
+                try:
+                    result = self.split_long_sentences_in_jsonl(
+                        path,
+                        min_length=min_length,
+                        concurrency=concurrency,
+                    )
+                except (requests.RequestException, ValueError) as exc:
+                    failures[page_number] = str(exc)
+                else:
+                    # 空白页没有句子，也算处理完成
+                    if result.startswith("No text segments"):
+                        manifest.mark(page_number, rst=True)
+            if progress is not None:
+                progress(done, len(pending))
+        return _format_failures(failures, len(pending))
+
+    def unfinished_pages(self,
+                         pdf_path: str,
+                         stage: str,
+                         pages: list[int] | None = None) -> list[int] | str:
+        # 清单中该阶段还没有完成的页面；分句以边界修复完成为准（只有一页的书没有页边界）
+        page_count = get_pdf_page_count(pdf_path)
+        if isinstance(page_count, str):
+            return page_count
+        manifest = self._open_document(pdf_path, page_count)
+        if stage == "split" and page_count > 1:
+            stage = "fixed"
+        elif stage == "pack":
+            stage = "packed"
+        pending = manifest.pending(stage, page_count)
+        if pages is not None:
+            wanted = set(pages)
+            pending = [page_number for page_number in pending if page_number in wanted]
+        return pending
+
+    def _split_document(self, manifest: DocumentManifest, threshold: float | None):
+        self._split_pages(manifest, threshold)
+        self._fix_boundaries(manifest, threshold)
+
+    def _split_pages(self, manifest: DocumentManifest, threshold: float | None):
+        cache_dir = manifest.cache_dir
+        # Skip pages already converted (either raw or fixed).
+        pending = [
+            page_number
+            for page_number in manifest.pages_with("ocr")
+            if not manifest.page(page_number).get("split")
+        ]
+        for batch in self._split_batches(cache_dir, pending):
+            split_json_files_to_jsonl(
+                [os.path.join(cache_dir, f"page_{page_number}.json") for page_number in batch],
+                threshold=threshold,
+                cache=self._get_segment_cache(),
+            )
+            manifest.mark(batch, split=True)
+            self._update_index(manifest, batch)
+
+    def _fix_boundaries(self, manifest: DocumentManifest, threshold: float | None):
+        cache_dir = manifest.cache_dir
+        page_nums = manifest.pages_with("split")
+        fixed_pages: set[int] = set()
+        for page_num, next_num in zip(page_nums, page_nums[1:]):
+            if next_num != page_num + 1:
                 continue
 
-            page_nums = sorted(page_nums)
-            for page_num, next_num in zip(page_nums, page_nums[1:]):
-                if next_num != page_num + 1:
-                    continue
+            prev_fixed = bool(manifest.page(page_num).get("fixed"))
+            next_fixed = bool(manifest.page(next_num).get("fixed"))
+            # Skip if both sides are already fixed.
+            if prev_fixed and next_fixed:
+                continue
 
-                prev_raw, prev_fixed = _page_paths(dirpath, page_num)
-                next_raw, next_fixed = _page_paths(dirpath, next_num)
+            prev_path = self._segment_path(cache_dir, page_num, prev_fixed)
+            next_path = self._segment_path(cache_dir, next_num, next_fixed)
+            if not os.path.exists(prev_path) or not os.path.exists(next_path):
+                continue
 
-                # Skip if both sides are already fixed.
-                if prev_fixed and next_fixed:
-                    continue
+            # Fix boundary for the available pair.
+            fix_page_boundary(
+                prev_path,
+                next_path,
+                threshold=threshold,
+                cache=self._get_segment_cache(),
+            )
 
-                prev_path = prev_fixed or prev_raw
-                next_path = next_fixed or next_raw
-                if not prev_path or not next_path:
-                    continue
+            # Mark any raw files in this pair as fixed.
+            if not prev_fixed:
+                os.replace(prev_path, self._segment_path(cache_dir, page_num, True))
+            if not next_fixed:
+                os.replace(next_path, self._segment_path(cache_dir, next_num, True))
+            manifest.mark([page_num, next_num], fixed=True)
+            fixed_pages.update((page_num, next_num))
+        if fixed_pages:
+            self._update_index(manifest, fixed_pages)
+
+    def _split_batches(self, cache_dir: str, pages: list[int]) -> list[list[int]]:
+        # 每批最多 WTPSPLIT_BATCH_PAGES 页，总字符数（按 JSON 文件大小估算）
+        # 不超过 WTPSPLIT_BATCH_CHARS
+        batches: list[list[int]] = []
+        batch_chars = 0
+        for page_number in pages:
+            text_path = os.path.join(cache_dir, f"page_{page_number}.json")
+            page_chars = os.path.getsize(text_path) if os.path.exists(text_path) else 0
+            if (batches
+                    and len(batches[-1]) < WTPSPLIT_BATCH_PAGES
+                    and batch_chars + page_chars <= WTPSPLIT_BATCH_CHARS):
+                batches[-1].append(page_number)
+                batch_chars += page_chars
+            else:
+                batches.append([page_number])
+                batch_chars = page_chars
+        return batches
+
+    def _segment_path(self, cache_dir: str, page_number: int, fixed: bool) -> str:
+        suffix = ".fixed.jsonl" if fixed else ".jsonl"
+        return os.path.join(cache_dir, f"page_{page_number}{suffix}")
+
+    def _mark_segment_file(self, path: str, **state) -> None:
+        cache_dir = os.path.dirname(os.path.abspath(path))
+        if not DocumentManifest.exists(cache_dir):
+            return
+        stem = os.path.basename(path).partition(".")[0]
+        if not stem.startswith("page_"):
+            return
+        try:
+            page_number = int(stem[len("page_"):])
+        except ValueError:
+            return
+        manifest = self._manifest_for_dir(cache_dir)
+        manifest.mark(page_number, **state)
+        self._update_index(manifest, [page_number])
+
+    def _get_search_index(self) -> SearchIndex:
+        with self._manifests_lock:
+            if self._search_index is None:
+                self._search_index = SearchIndex(
+                    SEARCH_INDEX_PATH or os.path.join(self._cache_root, "search_index.sqlite3")
+                )
+            return self._search_index
+
+    def _update_index(self, manifest: DocumentManifest, pages=None) -> int:
+        if not SEARCH_INDEX_ENABLED:
+            return 0
+        cache_dir = manifest.cache_dir
+        store = self._store_for_dir(cache_dir) if BookStore.exists(cache_dir) else None
+        return self._get_search_index().update_document(
+            cache_dir,
+            (manifest.names or [os.path.basename(cache_dir)])[0],
+            manifest.page_count,
+            store=store,
+            pages=pages,
+        )
+
+    def reindex(self) -> dict:
+        # 扫描整个缓存目录，只重建有变化的页面；用于索引建立之前已经处理过的书
+        if os.path.isdir(self._cache_root):
+            for entry in os.scandir(self._cache_root):
+                if entry.is_dir() and DocumentManifest.exists(entry.path):
+                    self._update_index(self._manifest_for_dir(entry.path))
+        return self._get_search_index().stats()
 
-                # Fix boundary for the available pair.
-                fix_page_boundary(prev_path, next_path, threshold=threshold)
+    def search_sentences(self,
+                         query: str,
+                         limit: int = 50,
+                         context: int = 0,
+                         kind: str = "split") -> list[dict]:
+        # 短语用引号，前缀以 * 结尾；context > 0 时附带每条结果前面的句子
+        hits = self._get_search_index().search(query, kind=kind, limit=limit)
+        if context:
+            index = self._get_search_index()
+            for hit in hits:
+                hit["context"] = index.neighbours(hit["id"], before=context)[:-1]
+        return hits
 
-                # Mark any raw files in this pair as fixed.
-                if prev_raw and not prev_fixed:
-                    os.replace(prev_raw, os.path.splitext(prev_raw)[0] + fixed_suffix)
-                if next_raw and not next_fixed:
-                    os.replace(next_raw, os.path.splitext(next_raw)[0] + fixed_suffix)
+    def get_neighbour_sentences(self, sentence_id: int, before: int = 3, after: int = 0) -> list[dict]:
+        return self._get_search_index().neighbours(sentence_id, before=before, after=after)
+
+    def _get_segment_cache(self) -> SegmentCache:
+        with self._manifests_lock:
+            if self._segment_cache is None:
+                self._segment_cache = SegmentCache(
+                    SEGMENT_CACHE_PATH or os.path.join(self._cache_root, "segment_cache.sqlite3")
+                )
+            return self._segment_cache
+
+    def get_segment_cache_stats(self) -> dict:
+        return self._get_segment_cache().stats()
+
+    def get_host_stats(self) -> list[dict]:
+        return self._hosts.stats()
+
+    def get_trace_summary(self) -> list[str]:
+        lines = [
+            f"{host['url']}: {host['requests']} requests, {host['per_minute']}/min, "
+            f"avg {host['avg_seconds']} s, in flight {host['in_flight']}, "
+            f"failures {host['failures']}, {'healthy' if host['healthy'] else 'cooling down'}"
+            for host in self._hosts.stats()
+        ]
+        tracer = tracing.get_tracer()
+        if not tracer.enabled:
+            return lines + ["Tracing is disabled; set TRACE_ENABLED or TRACE_PATH."]
+        for stage, stats in tracer.summary().items():
+            lines.append(
+                f"{stage}: {stats['count']} calls, avg {stats['avg_ms']} ms, "
+                f"max {stats['max_ms']} ms, errors {stats['errors']}, "
+                f"retries {stats['retries']}, "
+                f"cache {stats['cache_hits']}/{stats['cache_hits'] + stats['cache_misses']}, "
+                f"in {stats['bytes_in']} B, out {stats['bytes_out']} B"
+            )
+        if tracer.trace_path:
+            # Prometheus 快照写在追踪文件旁边
+            metrics_path = os.path.splitext(tracer.trace_path)[0] + ".prom"
+            tracer.write_prometheus(metrics_path)
+            lines.append(f"Metrics written to {metrics_path}")
+        return lines
 
     def split_long_sentences_in_jsonl(self,
                                       jsonl_path: str,
                                       min_length: int = 120,
                                       output_path: str | None = None,
                                       base_url: str | None = None,
-                                      token: str | None = None) -> str:
+                                      token: str | None = None,
+                                      concurrency: int | None = None) -> str:
         if not os.path.exists(jsonl_path):
             return f"File not found: {jsonl_path}"
 
         output_path = output_path or (os.path.splitext(jsonl_path)[0] + ".rst.jsonl")
-        texts: list[str] = []
-        changed = False
+        sentences = [text for text in iter_jsonl_texts(jsonl_path) if isinstance(text, str)]
 
-        with open(jsonl_path, "r", encoding="utf-8") as handle:
-            for line in handle:
-                line = line.strip()
-                if not line:
-                    continue
-                item = json.loads(line)
-                if not (isinstance(item, list) and len(item) >= 2):
-                    continue
-                text = item[1]
-                if not isinstance(text, str):
-                    continue
-                if len(text) >= min_length:
-                    segments = split_text_with_isanlp_rst(
+        # 长句并发发送给 RST 解析器，重复的句子只解析一次；结果按原顺序拼回
+        long_sentences = list(dict.fromkeys(
+            text for text in sentences if len(text) >= min_length
+        ))
+        cache = self._get_segment_cache()
+        concurrency = max(1, int(concurrency or RST_CONCURRENCY))
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            split_results = dict(zip(
+                long_sentences,
+                pool.map(
+                    lambda text: split_text_with_isanlp_rst(
                         text,
                         base_url=base_url,
                         token=token,
-                    )
-                    if segments:
-                        texts.extend(segments)
-                        changed = True
-                        continue
-                texts.append(text)
+                        cache=cache,
+                    ),
+                    long_sentences,
+                ),
+            ))
+
+        texts: list[str] = []
+        changed = False
+        for text in sentences:
+            segments = split_results.get(text)
+            if segments:
+                texts.extend(segments)
+                changed = True
+                continue
+            texts.append(text)
 
         if not texts:
             return f"No text segments found in {jsonl_path}"
 
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, "w", encoding="utf-8") as handle:
-            for idx, segment in enumerate(texts, start=1):
-                handle.write(json.dumps([idx, segment], ensure_ascii=False))
-                handle.write("\n")
+        _write_jsonl(texts, output_path)
 
+        self._mark_segment_file(jsonl_path, rst=True)
         if not changed:
             return f"No long segments found; wrote {output_path}"
         return f"Split long segments and wrote {output_path}"
+
+def _encode_image(image_bytes: bytes) -> str:
+    with tracing.span("image_base64", bytes_in=len(image_bytes)) as span:
+        image_payload = base64.b64encode(image_bytes).decode("ascii")
+        span.set(bytes_out=len(image_payload))
+    return image_payload
+
+
+def _png_size(path: str) -> tuple[int, int] | None:
+    # 只读 IHDR 中的宽和高
+    try:
+        with open(path, "rb") as handle:
+            header = handle.read(24)
+    except OSError:
+        return None
+    if len(header) < 24 or not header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return None
+    return struct.unpack(">II", header[16:24])
+
+
+def _format_failures(failures: dict[int, str], total: int) -> str:
+    if not failures:
+        return "ok"
+    details = "; ".join(
+        f"page {page_number}: {failures[page_number]}"
+        for page_number in sorted(failures)
+    )
+    return f"Error: {len(failures)} of {total} pages failed: {details}"
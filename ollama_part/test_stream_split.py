@@ -0,0 +1,83 @@
+import json
+import os
+import re
+
+import utility
+from services import ollama_services
+
+
+def _split_sentences(text, **kwargs):
+    # 按句号切分，代替 wtpsplit 服务
+    return [part for part in re.findall(r"[^.]+\.?\s*", text) if part.strip()]
+
+
+def _read_segments(path):
+    with open(path, "r", encoding="utf-8") as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def test_stream_split_passes_empty_middle_page(tmp_path, monkeypatch):
+    monkeypatch.setattr(utility, "split_text_with_wtpsplit", _split_sentences)
+    service = ollama_services(cache_root=str(tmp_path))
+    monkeypatch.setattr(service, "_get_segment_cache", lambda: None)
+    monkeypatch.setattr(service, "_update_index", lambda manifest, pages=None: 0)
+    manifest = service._manifest_for_dir(str(tmp_path / "doc"))
+    manifest.describe("doc", "doc", 3)
+    for page_number, text in ((1, "First sentence. Second sentence"), (2, ""), (3, "goes on here. Last one.")):
+        service._save_page_text(manifest, page_number, text, model=None)
+
+    assert manifest.page(2)["ocr"] and manifest.page(2)["empty"]
+    service._stream_split_document(manifest, threshold=None)
+
+    assert manifest.pending("fixed") == []
+    first = _read_segments(os.path.join(manifest.cache_dir, "page_1.fixed.jsonl"))
+    assert [item[1].strip() for item in first] == [
+        "First sentence.",
+        "Second sentence goes on here.",
+    ]
+    assert first[1][2] == [1, 3]
+    assert _read_segments(os.path.join(manifest.cache_dir, "page_2.fixed.jsonl")) == []
+    last = _read_segments(os.path.join(manifest.cache_dir, "page_3.fixed.jsonl"))
+    assert [item[1].strip() for item in last] == ["Last one."]
+
+
+def test_carry_kept_when_no_segments_returned(monkeypatch):
+    replies = iter([["Carried tail"], [], ["Carried tail next page text.", "Done."]])
+    monkeypatch.setattr(utility, "split_text_with_wtpsplit", lambda text, **kwargs: next(replies))
+    pages = [(1, "Carried tail"), (2, "next page"), (3, "text. Done.")]
+
+    sentences = list(utility.iter_document_sentences(pages))
+
+    assert [sentence["text"] for sentence in sentences] == ["Carried tail next page text.", "Done."]
+    assert sentences[0]["source_ref"] == [1, 3]
+
+
+def test_stream_split_resumes_without_duplicating_open_sentence(tmp_path, monkeypatch):
+    monkeypatch.setattr(utility, "split_text_with_wtpsplit", _split_sentences)
+    service = ollama_services(cache_root=str(tmp_path))
+    monkeypatch.setattr(service, "_get_segment_cache", lambda: None)
+    monkeypatch.setattr(service, "_update_index", lambda manifest, pages=None: 0)
+    manifest = service._manifest_for_dir(str(tmp_path / "doc"))
+    manifest.describe("doc", "doc", 3)
+    texts = {1: "A one. B two starts", 2: "ends here. C three. D four", 3: "goes on. E five."}
+    for page_number in (1, 2):
+        service._save_page_text(manifest, page_number, texts[page_number], model=None)
+    service._stream_split_document(manifest, threshold=None)
+
+    # 第 1 页最后一句延伸到第 2 页，第 2 页还没分完时两页都不能标记完成
+    assert manifest.pending("fixed") == [1, 2, 3]
+    service._save_page_text(manifest, 3, texts[3], model=None)
+    service._stream_split_document(manifest, threshold=None)
+
+    assert manifest.pending("fixed") == []
+    sentences = []
+    for page_number in (1, 2, 3):
+        path = os.path.join(manifest.cache_dir, f"page_{page_number}.fixed.jsonl")
+        sentences.extend((item[1].strip(), item[2]) for item in _read_segments(path))
+    assert sentences == [
+        ("A one.", [1, 1]),
+        ("B two starts ends here.", [1, 2]),
+        ("C three.", [2, 2]),
+        ("D four goes on.", [2, 3]),
+        ("E five.", [3, 3]),
+    ]
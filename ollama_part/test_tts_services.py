@@ -0,0 +1,64 @@
+import os
+
+from segment_rows import SegmentRows
+from services import ollama_services
+from tts_services import ToneEngine, tts_services
+from utility import _jsonl_line
+
+
+class _CountingEngine(ToneEngine):
+    def __init__(self):
+        self.calls = []
+
+    def synthesize(self, text, voice, speed):
+        self.calls.append((text, voice, speed))
+        return super().synthesize(text, voice, speed)
+
+
+def test_audio_cached_by_text_voice_and_speed(tmp_path):
+    engine = _CountingEngine()
+    service = tts_services(engine=engine, cache_dir=str(tmp_path), prefetch=0)
+
+    first = service.synthesize("Hello there.", voice="a", speed=1.0)
+    assert service.synthesize("Hello there.", voice="a", speed=1.0) == first
+    assert engine.calls == [("Hello there.", "a", 1.0)]
+
+    # 文本、音色、语速任一不同都重新合成
+    other_voice = service.synthesize("Hello there.", voice="b", speed=1.0)
+    other_speed = service.synthesize("Hello there.", voice="a", speed=1.5)
+    other_text = service.synthesize("Goodbye.", voice="a", speed=1.0)
+    assert len(engine.calls) == 4
+    assert len({first["path"], other_voice["path"], other_speed["path"], other_text["path"]}) == 4
+    assert other_speed["duration"] < first["duration"]
+    service.close()
+
+
+def test_get_utterance_prefetches_following_sentences(tmp_path):
+    engine = _CountingEngine()
+    service = tts_services(engine=engine, cache_dir=str(tmp_path), prefetch=2)
+    sentences = {1: ("One.", (1, 1)), 2: ("Two.", (1, 2)), 3: ("Three.", (2, 1)), 4: ("Four.", (2, 2))}
+
+    utterance = service.get_utterance(sentences.get, 1, voice="a", speed=1.0)
+    service._executor.shutdown(wait=True)
+
+    assert utterance["text"] == "One."
+    assert utterance["source_ref"] == (1, 1)
+    assert sorted(text for text, _, _ in engine.calls) == ["One.", "Three.", "Two."]
+    assert os.path.exists(service.audio_path("Three.", "a", 1.0))
+    assert not os.path.exists(service.audio_path("Four.", "a", 1.0))
+
+
+def test_sentence_reader_reports_page_and_index(tmp_path):
+    cache_dir = tmp_path / "doc"
+    cache_dir.mkdir()
+    (cache_dir / "page_1.fixed.jsonl").write_bytes(
+        _jsonl_line(1, "One.", [1, 1]) + _jsonl_line(2, "Two spans pages.", [1, 2])
+    )
+    (cache_dir / "page_2.jsonl").write_bytes(_jsonl_line(1, "Three."))
+    rows = SegmentRows(str(cache_dir), 2)
+
+    read = ollama_services(cache_root=str(tmp_path)).sentence_reader("", rows=rows)
+
+    assert read(2) == ("Two spans pages.", (1, 2))
+    assert read(3) == ("Three.", (2, 1))
+    assert read(4) is None
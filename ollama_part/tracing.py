@@ -0,0 +1,229 @@
+import contextvars
+import json
+import os
+import threading
+import time
+
+try:
+    import config as _config
+except ImportError:
+    try:
+        from . import config as _config
+    except ImportError:
+        _config = None
+
+# 设置 TRACE_PATH 后每个 span 追加一行 JSON；TRACE_ENABLED 只开启内存统计
+TRACE_PATH = os.getenv("TRACE_PATH", getattr(_config, "TRACE_PATH", "") if _config else "")
+TRACE_ENABLED = (
+    os.getenv("TRACE_ENABLED", "").lower() in ("1", "true", "yes")
+    or bool(getattr(_config, "TRACE_ENABLED", False) if _config else False)
+)
+# 直方图上界（秒）
+TRACE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNTERS = ("bytes_in", "bytes_out", "retries", "cache_hits", "cache_misses")
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("stage", "attrs", "_tracer", "_start", "_wall", "_token")
+
+    def __init__(self, tracer: "Tracer", stage: str, attrs: dict):
+        self.stage = stage
+        self.attrs = attrs
+        self._tracer = tracer
+
+    def __bool__(self):
+        return True
+
+    def __enter__(self):
+        self._wall = time.time()
+        self._token = _current_span.set(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._start
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # 生成器中的 span 可能在另一个上下文里结束
+            _current_span.set(None)
+        if exc_type is not None and "error" not in self.attrs:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        self._tracer._record(self, seconds)
+        return False
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def add(self, name: str, amount: int = 1) -> None:
+        self.attrs[name] = self.attrs.get(name, 0) + amount
+
+
+class _NullSpan:
+    # 关闭追踪时所有 span 共用这个对象；if span: 可以跳过只为追踪计算的属性
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def add(self, name: str, amount: int = 1) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    def __init__(self, trace_path: str = "", enabled: bool = False):
+        self.enabled = enabled or bool(trace_path)
+        self.trace_path = trace_path
+        self._lock = threading.Lock()
+        self._handle = None
+        self._stats: dict[str, dict] = {}
+
+    def span(self, stage: str, **attrs):
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, stage, attrs)
+
+    def enable(self, trace_path: str | None = None) -> None:
+        with self._lock:
+            if trace_path is not None and trace_path != self.trace_path:
+                self._close_handle()
+                self.trace_path = trace_path
+            self.enabled = True
+
+    def disable(self) -> None:
+        with self._lock:
+            self.enabled = False
+            self._close_handle()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_handle()
+
+    def _close_handle(self) -> None:
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def _record(self, span: Span, seconds: float) -> None:
+        line = None
+        if self.trace_path:
+            record = {
+                "stage": span.stage,
+                "start": round(span._wall, 6),
+                "seconds": round(seconds, 6),
+                "thread": threading.current_thread().name,
+            }
+            record.update(span.attrs)
+            line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            stats = self._stats.get(span.stage)
+            if stats is None:
+                stats = {
+                    "count": 0,
+                    "errors": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "buckets": [0] * len(TRACE_BUCKETS),
+                }
+                stats.update({name: 0 for name in COUNTERS})
+                self._stats[span.stage] = stats
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            if "error" in span.attrs:
+                stats["errors"] += 1
+            for index, bound in enumerate(TRACE_BUCKETS):
+                if seconds <= bound:
+                    stats["buckets"][index] += 1
+                    break
+            for name in COUNTERS:
+                value = span.attrs.get(name)
+                if value:
+                    stats[name] += int(value)
+            if line is not None:
+                if self._handle is None:
+                    directory = os.path.dirname(os.path.abspath(self.trace_path))
+                    os.makedirs(directory, exist_ok=True)
+                    self._handle = open(self.trace_path, "a", encoding="utf-8", buffering=1)
+                self._handle.write(line + "\n")
+
+    def summary(self) -> dict[str, dict]:
+        with self._lock:
+            result = {}
+            for stage, stats in sorted(self._stats.items()):
+                item = {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "total_seconds": round(stats["seconds"], 3),
+                    "avg_ms": round(stats["seconds"] / stats["count"] * 1000, 2),
+                    "max_ms": round(stats["max_seconds"] * 1000, 2),
+                }
+                item.update({name: stats[name] for name in COUNTERS})
+                result[stage] = item
+            return result
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            stages = {stage: dict(stats, buckets=list(stats["buckets"]))
+                      for stage, stats in sorted(self._stats.items())}
+        lines = [
+            "# HELP echo_stage_seconds Pipeline stage duration in seconds.",
+            "# TYPE echo_stage_seconds histogram",
+        ]
+        for stage, stats in stages.items():
+            cumulative = 0
+            for bound, count in zip(TRACE_BUCKETS, stats["buckets"]):
+                cumulative += count
+                lines.append(f'echo_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'echo_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}')
+            lines.append(f'echo_stage_seconds_sum{{stage="{stage}"}} {stats["seconds"]:.6f}')
+            lines.append(f'echo_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        for name in ("errors",) + COUNTERS:
+            lines.append(f"# TYPE echo_stage_{name}_total counter")
+            for stage, stats in stages.items():
+                lines.append(f'echo_stage_{name}_total{{stage="{stage}"}} {stats[name]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            handle.write(self.prometheus_text())
+        os.replace(temp_path, path)
+
+
+_tracer = Tracer(TRACE_PATH, enabled=TRACE_ENABLED)
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def span(stage: str, **attrs):
+    if not _tracer.enabled:
+        return _NULL_SPAN
+    return Span(_tracer, stage, attrs)
+
+
+def add(name: str, amount: int = 1) -> None:
+    # 计入当前线程/协程中最内层的 span，例如 transport 的重试次数
+    current = _current_span.get()
+    if current is not None:
+        current.add(name, amount)
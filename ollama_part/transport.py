@@ -0,0 +1,153 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+import tracing
+
+try:
+    import config as _config
+except ImportError:
+    try:
+        from . import config as _config
+    except ImportError:
+        _config = None
+
+HTTP_POOL_SIZE = getattr(_config, "HTTP_POOL_SIZE", 16) if _config else 16
+# 默认的 (连接超时, 读取超时)；wtpsplit 和 isanlp 在调用处传入各自的超时
+HTTP_TIMEOUT = getattr(_config, "HTTP_TIMEOUT", (10.0, 200.0)) if _config else (10.0, 200.0)
+HTTP_MAX_ATTEMPTS = getattr(_config, "HTTP_MAX_ATTEMPTS", 3) if _config else 3
+HTTP_BACKOFF_SECONDS = getattr(_config, "HTTP_BACKOFF_SECONDS", 1.0) if _config else 1.0
+HTTP_BACKOFF_MAX_SECONDS = getattr(_config, "HTTP_BACKOFF_MAX_SECONDS", 30.0) if _config else 30.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# 非幂等请求（默认所有 POST）只在服务器明确要求稍后再试时重试
+RETRY_AFTER_STATUSES = frozenset({429, 503})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session
+    with _session_lock:
+        if _session is None:
+            # requests 按 host 维护连接池；这里只调整池的大小并复用同一个 Session
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE,
+                pool_maxsize=HTTP_POOL_SIZE,
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def backoff_delay(attempt: int, retry_after: str | None = None) -> float:
+    if retry_after:
+        try:
+            return min(float(retry_after), HTTP_BACKOFF_MAX_SECONDS)
+        except ValueError:
+            pass
+    # Full jitter: a random delay up to the exponential cap.
+    cap = min(HTTP_BACKOFF_MAX_SECONDS, HTTP_BACKOFF_SECONDS * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+def _should_retry_status(response, idempotent: bool) -> bool:
+    if idempotent:
+        return response.status_code in RETRY_STATUSES
+    return response.status_code in RETRY_AFTER_STATUSES and "Retry-After" in response.headers
+
+
+def _not_sent(exc: requests.RequestException) -> bool:
+    # 连接没有建立，请求肯定没有到达服务器
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def request(method: str, url: str, idempotent: bool | None = None, **kwargs) -> requests.Response:
+    # 幂等请求在连接错误、超时和 429/5xx 时重试；其余请求（默认 POST）可能已经在服务器上执行，
+    # 只重试连接失败和带 Retry-After 的 429/503，读取超时不重试
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    session = get_session()
+    for attempt in range(HTTP_MAX_ATTEMPTS):
+        last_attempt = attempt == HTTP_MAX_ATTEMPTS - 1
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as exc:
+            if last_attempt or not (idempotent or _not_sent(exc)):
+                raise
+            tracing.add("retries")
+            time.sleep(backoff_delay(attempt))
+            continue
+        if not _should_retry_status(response, idempotent) or last_attempt:
+            return response
+        delay = backoff_delay(attempt, response.headers.get("Retry-After"))
+        response.close()
+        tracing.add("retries")
+        time.sleep(delay)
+    raise requests.ConnectionError(f"No attempts made for {url}")
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def _async_timeout(timeout):
+    import httpx
+
+    connect_timeout, read_timeout = timeout
+    return httpx.Timeout(read_timeout, connect=connect_timeout)
+
+
+def create_async_client():
+    import httpx
+
+    return httpx.AsyncClient(
+        timeout=_async_timeout(HTTP_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_POOL_SIZE,
+        ),
+    )
+
+
+async def async_request(client, method: str, url: str, idempotent: bool | None = None, **kwargs):
+    # 重试规则与 request 相同
+    import asyncio
+
+    import httpx
+
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    if isinstance(kwargs.get("timeout"), tuple):
+        kwargs["timeout"] = _async_timeout(kwargs["timeout"])
+    for attempt in range(HTTP_MAX_ATTEMPTS):
+        last_attempt = attempt == HTTP_MAX_ATTEMPTS - 1
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError as exc:
+            not_sent = isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout))
+            if last_attempt or not (idempotent or not_sent):
+                raise
+            tracing.add("retries")
+            await asyncio.sleep(backoff_delay(attempt))
+            continue
+        if not _should_retry_status(response, idempotent) or last_attempt:
+            return response
+        tracing.add("retries")
+        await asyncio.sleep(backoff_delay(attempt, response.headers.get("Retry-After")))
+    raise httpx.TransportError(f"No attempts made for {url}")
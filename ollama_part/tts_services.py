@@ -0,0 +1,208 @@
+import io
+import math
+import os
+import struct
+import threading
+import wave
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import tracing
+import transport
+from segment_cache import SegmentCache
+
+try:
+    import config as _config
+except ImportError:
+    try:
+        from . import config as _config
+    except ImportError:
+        _config = None
+
+# 为空时使用本地的占位引擎（只生成提示音，供测试和离线使用）
+TTS_BASE_URL = getattr(_config, "TTS_BASE_URL", "") if _config else ""
+TTS_VOICE = getattr(_config, "TTS_VOICE", "default") if _config else "default"
+TTS_SPEED = getattr(_config, "TTS_SPEED", 1.0) if _config else 1.0
+TTS_SPEED_RANGE = getattr(_config, "TTS_SPEED_RANGE", (0.5, 2.0)) if _config else (0.5, 2.0)
+# 播放第 i 句时在后台合成之后的句子数
+TTS_PREFETCH_SENTENCES = getattr(_config, "TTS_PREFETCH_SENTENCES", 3) if _config else 3
+TTS_PREFETCH_WORKERS = getattr(_config, "TTS_PREFETCH_WORKERS", 1) if _config else 1
+TTS_CACHE_DIR = getattr(_config, "TTS_CACHE_DIR", "") if _config else ""
+TONE_SAMPLE_RATE = 16000
+TONE_SECONDS_PER_CHAR = 0.06
+
+
+class ToneEngine:
+    # 本地占位引擎：按文本长度和语速生成一段 WAV，时长近似真实朗读
+    name = "tone"
+
+    def synthesize(self, text: str, voice: str, speed: float) -> bytes:
+        seconds = max(0.3, len(text) * TONE_SECONDS_PER_CHAR) / speed
+        frames = int(seconds * TONE_SAMPLE_RATE)
+        # 不同音色用不同音高，便于听出区别
+        frequency = 180 + sum(voice.encode("utf-8")) % 200
+        step = 2 * math.pi * frequency / TONE_SAMPLE_RATE
+        samples = struct.pack(
+            f"<{frames}h", *(int(3000 * math.sin(step * index)) for index in range(frames))
+        )
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as handle:
+            handle.setnchannels(1)
+            handle.setsampwidth(2)
+            handle.setframerate(TONE_SAMPLE_RATE)
+            handle.writeframes(samples)
+        return buffer.getvalue()
+
+
+class HttpTtsEngine:
+    # POST {"text", "voice", "speed", "format": "wav"}，响应体为 WAV 音频
+    name = "http"
+
+    def __init__(self, base_url: str, token: str | None = None):
+        self.base_url = base_url
+        self.token = token
+
+    def synthesize(self, text: str, voice: str, speed: float) -> bytes:
+        headers: dict[str, str] = {}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        response = transport.post(
+            self.base_url,
+            json={"text": text, "voice": voice, "speed": speed, "format": "wav"},
+            headers=headers,
+        )
+        response.raise_for_status()
+        return response.content
+
+
+def default_engine():
+    base_url = os.getenv("TTS_BASE_URL", TTS_BASE_URL)
+    if not base_url:
+        return ToneEngine()
+    token = os.getenv("TOKEN", getattr(_config, "TOKEN", "") if _config else "")
+    return HttpTtsEngine(base_url, token)
+
+
+def _sentence(sentence_at: Callable[[int], object], unit_id: int) -> tuple[str | None, object]:
+    # sentence_at 可以返回文本，或 (文本, source_ref)
+    value = sentence_at(unit_id)
+    if isinstance(value, tuple):
+        return value[0], value[1]
+    return value, None
+
+
+def wav_duration(path: str) -> float:
+    with wave.open(path, "rb") as handle:
+        return handle.getnframes() / handle.getframerate()
+
+
+class tts_services:
+    def __init__(self,
+                 engine=None,
+                 cache_dir: str | None = None,
+                 prefetch: int | None = None):
+        self.engine = engine or default_engine()
+        # 不放在文档缓存 cache/ 下：那里的每个子目录都会被当作一本书扫描
+        self._cache_dir = cache_dir or TTS_CACHE_DIR or os.path.join(
+            os.path.dirname(__file__), "tts_cache"
+        )
+        self.prefetch_count = TTS_PREFETCH_SENTENCES if prefetch is None else prefetch
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, TTS_PREFETCH_WORKERS), thread_name_prefix="tts-prefetch"
+        )
+        self._lock = threading.Lock()
+        # 正在合成的 key；预取和前台请求同一句时共用结果
+        self._in_flight: dict[str, Future] = {}
+        # 用户跳到别处后，旧位置排队中的预取不再执行
+        self._generation = 0
+
+    def _normalize(self, voice: str | None, speed: float | None) -> tuple[str, float]:
+        voice = voice or TTS_VOICE
+        speed = float(speed or TTS_SPEED)
+        low, high = TTS_SPEED_RANGE
+        if not low <= speed <= high:
+            raise ValueError(f"Speed must be between {low} and {high}.")
+        return voice, round(speed, 2)
+
+    def audio_path(self, text: str, voice: str | None = None, speed: float | None = None) -> str:
+        voice, speed = self._normalize(voice, speed)
+        key = SegmentCache.make_key("tts", self.engine.name, voice, speed, text)
+        return os.path.join(self._cache_dir, key[:2], f"{key}.wav")
+
+    def synthesize(self, text: str, voice: str | None = None, speed: float | None = None) -> dict:
+        # 返回 {"path", "duration"}；相同 (文本, 音色, 语速) 只合成一次
+        voice, speed = self._normalize(voice, speed)
+        path = self.audio_path(text, voice, speed)
+        with tracing.span("tts", bytes_out=len(text)) as span:
+            if os.path.exists(path):
+                span.set(cache_hits=1)
+                return {"path": path, "duration": wav_duration(path)}
+            span.set(cache_misses=1)
+            with self._lock:
+                future = self._in_flight.get(path)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._in_flight[path] = future
+            if not owner:
+                return future.result()
+            try:
+                audio = self.engine.synthesize(text, voice, speed)
+                span.set(bytes_in=len(audio))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, "wb") as handle:
+                    handle.write(audio)
+                os.replace(temp_path, path)
+                result = {"path": path, "duration": wav_duration(path)}
+            except BaseException as exc:
+                future.set_exception(exc)
+                raise
+            else:
+                future.set_result(result)
+            finally:
+                with self._lock:
+                    self._in_flight.pop(path, None)
+        return result
+
+    def get_utterance(self,
+                      sentence_at: Callable[[int], object],
+                      unit_id: int,
+                      voice: str | None = None,
+                      speed: float | None = None) -> dict | None:
+        # sentence_at(编号) 超出范围时返回 None；合成当前句后在后台预取之后 prefetch_count 句
+        text, source_ref = _sentence(sentence_at, unit_id)
+        if text is None:
+            return None
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        audio = self.synthesize(text, voice, speed)
+        for next_id in range(unit_id + 1, unit_id + 1 + self.prefetch_count):
+            self._executor.submit(self._prefetch, generation, sentence_at, next_id, voice, speed)
+        return {
+            "unit_id": unit_id,
+            "text": text,
+            "source_ref": source_ref,
+            "audio": audio,
+        }
+
+    def _prefetch(self,
+                  generation: int,
+                  sentence_at: Callable[[int], object],
+                  unit_id: int,
+                  voice: str | None,
+                  speed: float | None) -> None:
+        if generation != self._generation:
+            return
+        text, _ = _sentence(sentence_at, unit_id)
+        if text is None:
+            return
+        try:
+            self.synthesize(text, voice, speed)
+        except Exception:
+            # 预取失败不影响当前播放；真正播放这一句时会重新合成并报错
+            pass
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,34 +1,103 @@
 # ui/main_window.py
-from PySide6.QtWidgets import QWidget, QPushButton, QVBoxLayout, QListWidget, QTextEdit
-from PySide6.QtCore import Signal
+from PySide6.QtWidgets import (
+    QFileDialog,
+    QLineEdit,
+    QListWidget,
+    QProgressBar,
+    QPushButton,
+    QTextEdit,
+    QVBoxLayout,
+    QWidget,
+)
+from PySide6.QtCore import QUrl, Signal
+from PySide6.QtGui import QTextCursor
+
+from segment_browser import SegmentBrowser
 
 class MainWindow(QWidget):
 
     # Signal
     get_models_signal= Signal()
     say_hello_signal= Signal()
+    ocr_pdf_signal= Signal(str)
+    cancel_signal= Signal()
+    metrics_signal= Signal()
+    play_original_signal= Signal()
+    show_segments_signal= Signal()
+    search_library_signal= Signal(str)
 
     def __init__(self):
         super().__init__()
         self.get_models_button = QPushButton("get models")
         self.say_hello_button = QPushButton("say hello")
+        self.ocr_pdf_button = QPushButton("ocr pdf")
+        self.cancel_button = QPushButton("cancel")
+        self.metrics_button = QPushButton("metrics")
+        self.play_original_button = QPushButton("play original")
+        self.segments_button = QPushButton("segments")
+        self.library_search_edit = QLineEdit()
+        self.library_search_edit.setPlaceholderText('search all books: words, "phrase", prefix*')
+        # 播放器在第一次播放时创建；QtMultimedia 依赖系统音频库（libpulse 等），
+        # 缺少时只有播放不可用，界面其余部分照常启动
+        self.audio_output = None
+        self.player = None
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
         self.list_view = QListWidget()
+        self.segment_browser = SegmentBrowser()
+        self.segment_browser.setVisible(False)
         self.response_view = QTextEdit()
         self.response_view.setReadOnly(True)
         layout = QVBoxLayout(self)
         layout.addWidget(self.get_models_button)
         layout.addWidget(self.say_hello_button)
+        layout.addWidget(self.ocr_pdf_button)
+        layout.addWidget(self.cancel_button)
+        layout.addWidget(self.metrics_button)
+        layout.addWidget(self.play_original_button)
+        layout.addWidget(self.segments_button)
+        layout.addWidget(self.library_search_edit)
+        layout.addWidget(self.progress_bar)
         layout.addWidget(self.list_view)
+        layout.addWidget(self.segment_browser)
         layout.addWidget(self.response_view)
 
         self.get_models_button.clicked.connect(self._get_models_button_on_click)
         self.say_hello_button.clicked.connect(self._say_hello_button_on_click)
+        self.ocr_pdf_button.clicked.connect(self._ocr_pdf_button_on_click)
+        self.cancel_button.clicked.connect(self._cancel_button_on_click)
+        self.metrics_button.clicked.connect(self._metrics_button_on_click)
+        self.play_original_button.clicked.connect(self._play_original_button_on_click)
+        self.segments_button.clicked.connect(self._segments_button_on_click)
+        self.library_search_edit.returnPressed.connect(self._library_search_on_return)
 
     def _get_models_button_on_click(self):
         self.get_models_signal.emit()
 
     def _say_hello_button_on_click(self):
         self.say_hello_signal.emit()
+
+    def _ocr_pdf_button_on_click(self):
+        pdf_path, _ = QFileDialog.getOpenFileName(self, "Select PDF", "", "PDF (*.pdf)")
+        if pdf_path:
+            self.ocr_pdf_signal.emit(pdf_path)
+
+    def _cancel_button_on_click(self):
+        self.cancel_signal.emit()
+
+    def _metrics_button_on_click(self):
+        self.metrics_signal.emit()
+
+    def _play_original_button_on_click(self):
+        self.play_original_signal.emit()
+
+    def _segments_button_on_click(self):
+        self.show_segments_signal.emit()
+
+    def _library_search_on_return(self):
+        query = self.library_search_edit.text().strip()
+        if query:
+            self.search_library_signal.emit(query)
     
 
     def get_selected_value(self) -> str | None:
@@ -43,7 +112,46 @@ class MainWindow(QWidget):
             self.list_view.addItem(str(value))
 
     def show_response(self, text: str):
+        self.progress_bar.setVisible(False)
         self.response_view.setPlainText(text or "")
 
+    def append_response(self, text: str):
+        cursor = self.response_view.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+        self.response_view.setTextCursor(cursor)
+
+    def finish_stream(self, text: str):
+        self.progress_bar.setVisible(False)
+        self.append_response(f"\n\n{text or ''}")
+
+    def show_progress(self, done: int, total: int):
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setRange(0, max(total, 1))
+        self.progress_bar.setValue(done)
+
+    def show_segments(self, rows):
+        # rows 是 SegmentRows；只有可见行会被读取
+        self.progress_bar.setVisible(False)
+        self.segment_browser.set_rows(rows)
+        self.segment_browser.setVisible(True)
+
+    def play_audio(self, utterance):
+        if not utterance:
+            self.show_error("No sentence to play.")
+            return
+        if self.player is None:
+            try:
+                from PySide6.QtMultimedia import QAudioOutput, QMediaPlayer
+            except ImportError as exc:
+                self.show_error(f"Audio playback is unavailable: {exc}")
+                return
+            self.audio_output = QAudioOutput()
+            self.player = QMediaPlayer()
+            self.player.setAudioOutput(self.audio_output)
+        self.player.setSource(QUrl.fromLocalFile(utterance["audio"]["path"]))
+        self.player.play()
+
     def show_error(self, message: str):
+        self.progress_bar.setVisible(False)
         self.response_view.setPlainText(message or "Unknown error.")
@@ -1,10 +1,17 @@
+import contextlib
+import hashlib
 import json
 import os
+import shutil
 import subprocess
 import tempfile
-import time
+import threading
+from collections.abc import Iterable, Iterator
 
-import requests
+import tracing
+import transport
+from page_filter import parse_pgm_stream
+from segment_cache import SegmentCache
 
 try:
     import config as _config
@@ -14,115 +21,580 @@ except ImportError:
     except ImportError:
         _config = None
 
+JSONL_FSYNC = getattr(_config, "JSONL_FSYNC", True) if _config else True
+JSONL_BATCH_FILES = getattr(_config, "JSONL_BATCH_FILES", 64) if _config else 64
+TEXT_LAYER_MIN_CHARS = getattr(_config, "TEXT_LAYER_MIN_CHARS", 80) if _config else 80
+# 流式分句时带到下一页的句子数，以及携带文本的长度上限
+STREAM_CARRY_SENTENCES = getattr(_config, "STREAM_CARRY_SENTENCES", 1) if _config else 1
+STREAM_CARRY_MAX_CHARS = getattr(_config, "STREAM_CARRY_MAX_CHARS", 4000) if _config else 4000
+# 各端点的 (连接超时, 读取超时)；两者只做分析、没有副作用，请求按幂等处理，失败可以重发
+WTPSPLIT_TIMEOUT = getattr(_config, "WTPSPLIT_TIMEOUT", (10.0, 60.0)) if _config else (10.0, 60.0)
+ISANLP_TIMEOUT = getattr(_config, "ISANLP_TIMEOUT", (10.0, 120.0)) if _config else (10.0, 120.0)
 
-def get_pdf_page_count(pdf_path: str):
+_PDF_INFO_CACHE: dict[tuple[str, int, int], dict[str, str]] = {}
+_PDF_INFO_LOCK = threading.Lock()
+
+
+def get_pdf_info(pdf_path: str):
     if not pdf_path:
         return "No PDF path."
-    if not os.path.exists(pdf_path):
+    try:
+        stat = os.stat(pdf_path)
+    except OSError:
         return f"File not found: {pdf_path}"
 
+    # pdfinfo 的结果按 (路径, 大小, 修改时间) 缓存，文件变化后自动失效
+    key = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+    with _PDF_INFO_LOCK:
+        cached = _PDF_INFO_CACHE.get(key)
+    if cached is not None:
+        return cached
+
     cmd = ["pdfinfo", pdf_path]
-    try:
-        result = subprocess.run(
-            cmd,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
-    except Exception as exc:
-        return f"Error: {exc}"
+    with tracing.span("pdfinfo", bytes_in=stat.st_size) as span:
+        try:
+            result = subprocess.run(
+                cmd,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+        except Exception as exc:
+            span.set(error=str(exc))
+            return f"Error: {exc}"
 
+    info: dict[str, str] = {}
     for line in result.stdout.splitlines():
-        if line.startswith("Pages:"):
-            try:
-                return int(line.split(":", 1)[1].strip())
-            except ValueError:
-                return "Failed to parse page count."
-    return "Failed to read page count."
+        name, sep, value = line.partition(":")
+        if sep:
+            info[name.strip()] = value.strip()
+    with _PDF_INFO_LOCK:
+        _PDF_INFO_CACHE[key] = info
+    return info
+
+
+def get_pdf_page_count(pdf_path: str):
+    info = get_pdf_info(pdf_path)
+    if isinstance(info, str):
+        return info
+    if "Pages" not in info:
+        return "Failed to read page count."
+    try:
+        return int(info["Pages"])
+    except ValueError:
+        return "Failed to parse page count."
+
+
+_PDF_DIGEST_CACHE: dict[tuple[str, int, int], str] = {}
+
+
+def get_pdf_digest(pdf_path: str) -> str:
+    stat = os.stat(pdf_path)
+    key = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+    with _PDF_INFO_LOCK:
+        cached = _PDF_DIGEST_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    value = digest.hexdigest()
+    with _PDF_INFO_LOCK:
+        _PDF_DIGEST_CACHE[key] = value
+    return value
+
+
+def get_pdf_cache_dir(pdf_path: str, cache_root: str) -> str:
+    # 缓存目录按 PDF 内容哈希命名：同名不同书不会冲突，改名也能复用
+    return os.path.join(cache_root, get_pdf_digest(pdf_path)[:16])
 
 
 def get_pdf_page_image(pdf_path: str, page_number: int, cache_root: str):
+    if page_number < 1:
+        return "Invalid page number."
+    return render_pdf_pages(pdf_path, cache_root, page_number, page_number)
+
+
+def render_pdf_pages(pdf_path: str,
+                     cache_root: str,
+                     first_page: int = 1,
+                     last_page: int | None = None):
     if not pdf_path:
         return "No PDF path."
     if not os.path.exists(pdf_path):
         return f"File not found: {pdf_path}"
-    if page_number < 1:
-        return "Invalid page number."
 
-    pdf_name = os.path.splitext(os.path.basename(pdf_path))[0] or "unknown"
-    cache_dir = os.path.join(cache_root, pdf_name)
-    output_path = os.path.join(cache_dir, f"page_{page_number}.png")
-    if os.path.exists(output_path):
+    page_count = get_pdf_page_count(pdf_path)
+    if isinstance(page_count, str):
+        return page_count
+    last_page = page_count if last_page is None else min(last_page, page_count)
+    if first_page < 1 or last_page < first_page:
+        return "Invalid page range."
+
+    cache_dir = get_pdf_cache_dir(pdf_path, cache_root)
+    missing = [
+        page_number
+        for page_number in range(first_page, last_page + 1)
+        if not os.path.exists(os.path.join(cache_dir, f"page_{page_number}.png"))
+    ]
+    if not missing:
         return None
 
     os.makedirs(cache_dir, exist_ok=True)
-    with tempfile.TemporaryDirectory(prefix="echo_player_pdf_") as output_dir:
+    # 只渲染缺失页面的连续区间，每个区间一次 pdftoppm 调用
+    runs: list[tuple[int, int]] = []
+    for page_number in missing:
+        if runs and runs[-1][1] == page_number - 1:
+            runs[-1] = (runs[-1][0], page_number)
+        else:
+            runs.append((page_number, page_number))
+
+    for run_first, run_last in runs:
+        error = _render_page_run(pdf_path, cache_dir, run_first, run_last)
+        if error:
+            return error
+    return None
+
+
+def _render_page_run(pdf_path: str, cache_dir: str, first_page: int, last_page: int):
+    # Render into a scratch directory inside the cache so the final step is a
+    # rename on the same filesystem rather than a copy.
+    output_dir = tempfile.mkdtemp(prefix=".render_", dir=cache_dir)
+    try:
         cmd = [
             "pdftoppm",
             "-f",
-            str(page_number),
+            str(first_page),
             "-l",
-            str(page_number),
+            str(last_page),
             "-png",
-            "-singlefile",
             pdf_path,
-            os.path.join(output_dir, f"page_{page_number}"),
+            os.path.join(output_dir, "page"),
         ]
+        with tracing.span("render", first_page=first_page, last_page=last_page) as span:
+            try:
+                subprocess.run(
+                    cmd,
+                    check=True,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
+            except Exception as exc:
+                span.set(error=str(exc))
+                return f"Error: {exc}"
+            if span:
+                span.set(bytes_out=sum(
+                    entry.stat().st_size for entry in os.scandir(output_dir)
+                ))
+
+        # pdftoppm 输出 page-<补零页码>.png，补零宽度取决于总页数
+        rendered = set()
+        for name in os.listdir(output_dir):
+            stem, ext = os.path.splitext(name)
+            if ext != ".png" or not stem.startswith("page-"):
+                continue
+            try:
+                page_number = int(stem[len("page-"):])
+            except ValueError:
+                continue
+            os.replace(
+                os.path.join(output_dir, name),
+                os.path.join(cache_dir, f"page_{page_number}.png"),
+            )
+            rendered.add(page_number)
+        if not rendered.issuperset(range(first_page, last_page + 1)):
+            return "Failed to render page."
+        return None
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def get_pdf_text_layer(pdf_path: str, first_page: int, last_page: int):
+    if not pdf_path:
+        return "No PDF path."
+    if not os.path.exists(pdf_path):
+        return f"File not found: {pdf_path}"
+    if first_page < 1 or last_page < first_page:
+        return "Invalid page range."
+
+    # pdftotext 以换页符 \f 结束每一页，一次调用取出整个区间
+    cmd = [
+        "pdftotext",
+        "-f",
+        str(first_page),
+        "-l",
+        str(last_page),
+        "-enc",
+        "UTF-8",
+        pdf_path,
+        "-",
+    ]
+    with tracing.span("pdftotext", first_page=first_page, last_page=last_page) as span:
         try:
-            subprocess.run(
+            result = subprocess.run(
                 cmd,
                 check=True,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
             )
         except Exception as exc:
+            span.set(error=str(exc))
             return f"Error: {exc}"
+        span.set(bytes_out=len(result.stdout))
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    expected = last_page - first_page + 1
+    pages = pages[:expected] + [""] * (expected - len(pages))
+    return [page.strip() for page in pages]
+
+
+def is_text_layer_usable(text: str, min_chars: int | None = None) -> bool:
+    # 扫描件通常没有文本层，或者只有页码、乱码；这类页面仍然走 OCR
+    text = text.strip()
+    min_chars = TEXT_LAYER_MIN_CHARS if min_chars is None else min_chars
+    if len(text) < max(1, min_chars):
+        return False
+    visible = [ch for ch in text if not ch.isspace()]
+    if not visible:
+        return False
+    letters = sum(ch.isalpha() for ch in visible)
+    broken = sum(ch == "\ufffd" or (not ch.isprintable()) for ch in visible)
+    return letters / len(visible) >= 0.5 and broken / len(visible) < 0.01
+
+
+def render_pdf_page_thumbnails(pdf_path: str,
+                               first_page: int,
+                               last_page: int,
+                               dpi: int = 24):
+    if not pdf_path:
+        return "No PDF path."
+    if not os.path.exists(pdf_path):
+        return f"File not found: {pdf_path}"
+    if first_page < 1 or last_page < first_page:
+        return "Invalid page range."
+
+    # 低分辨率灰度 PGM 直接从 stdout 读取，用于空白页与重复页判断
+    cmd = [
+        "pdftoppm",
+        "-f",
+        str(first_page),
+        "-l",
+        str(last_page),
+        "-r",
+        str(dpi),
+        "-gray",
+        pdf_path,
+    ]
+    with tracing.span("thumbnail", first_page=first_page, last_page=last_page) as span:
+        try:
+            result = subprocess.run(
+                cmd,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        except Exception as exc:
+            span.set(error=str(exc))
+            return f"Error: {exc}"
+        span.set(bytes_out=len(result.stdout))
+    try:
+        images = parse_pgm_stream(result.stdout)
+    except ValueError as exc:
+        return f"Error: {exc}"
+    if len(images) != last_page - first_page + 1:
+        return "Failed to render page thumbnails."
+    return images
+
+
+_PDF_PAGE_SIZES_CACHE: dict[tuple[str, int, int], dict[int, tuple[float, float]]] = {}
 
-        temp_path = os.path.join(output_dir, f"page_{page_number}.png")
-        if not os.path.exists(temp_path):
-            return "Failed to render page."
-        with open(temp_path, "rb") as handle:
-            image_bytes = handle.read()
-        with open(output_path, "wb") as handle:
-            handle.write(image_bytes)
-        return None
+
+def get_pdf_page_sizes(pdf_path: str):
+    # 一次 pdfinfo -f 1 -l N 取出每一页的尺寸（点），按 (路径, 大小, 修改时间) 缓存
+    page_count = get_pdf_page_count(pdf_path)
+    if isinstance(page_count, str):
+        return page_count
+    stat = os.stat(pdf_path)
+    key = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+    with _PDF_INFO_LOCK:
+        cached = _PDF_PAGE_SIZES_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    cmd = ["pdfinfo", "-f", "1", "-l", str(page_count), pdf_path]
+    with tracing.span("pdfinfo", pages=page_count) as span:
+        try:
+            result = subprocess.run(
+                cmd,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+        except Exception as exc:
+            span.set(error=str(exc))
+            return f"Error: {exc}"
+
+    sizes: dict[int, tuple[float, float]] = {}
+    for line in result.stdout.splitlines():
+        # 例如 "Page    3 size: 612 x 792 pts (letter)"
+        name, sep, value = line.partition(":")
+        parts = name.split()
+        if not sep or len(parts) != 3 or parts[0] != "Page" or parts[2] != "size":
+            continue
+        values = value.split()
+        try:
+            sizes[int(parts[1])] = (float(values[0]), float(values[2]))
+        except (IndexError, ValueError):
+            continue
+    with _PDF_INFO_LOCK:
+        _PDF_PAGE_SIZES_CACHE[key] = sizes
+    return sizes
+
+
+def get_pdf_page_size(pdf_path: str, page_number: int | None = None):
+    # 指定页码时返回这一页的尺寸；各页大小或方向可能不同
+    if page_number is not None:
+        sizes = get_pdf_page_sizes(pdf_path)
+        if isinstance(sizes, str):
+            return sizes
+        if page_number in sizes:
+            return sizes[page_number]
+    info = get_pdf_info(pdf_path)
+    if isinstance(info, str):
+        return info
+    # 例如 "612 x 792 pts (letter)"
+    parts = info.get("Page size", "").split()
+    try:
+        return float(parts[0]), float(parts[2])
+    except (IndexError, ValueError):
+        return "Failed to read page size."
+
+
+def render_pdf_page_bytes(pdf_path: str,
+                          page_number: int,
+                          dpi: int = 150,
+                          gray: bool = False,
+                          image_format: str = "png",
+                          max_pixels: int | None = None,
+                          jpeg_quality: int = 85):
+    if not pdf_path:
+        return "No PDF path."
+    if not os.path.exists(pdf_path):
+        return f"File not found: {pdf_path}"
+    if page_number < 1:
+        return "Invalid page number."
+    if image_format not in ("png", "jpeg"):
+        return f"Unsupported image format: {image_format}"
+
+    if max_pixels:
+        # 按视觉模型的输入尺寸限制总像素数，超过时降低 DPI
+        page_size = get_pdf_page_size(pdf_path, page_number)
+        if isinstance(page_size, str):
+            return page_size
+        width = page_size[0] / 72 * dpi
+        height = page_size[1] / 72 * dpi
+        if width * height > max_pixels:
+            dpi = max(1, int(dpi * (max_pixels / (width * height)) ** 0.5))
+
+    cmd = [
+        "pdftoppm",
+        "-f",
+        str(page_number),
+        "-l",
+        str(page_number),
+        "-r",
+        str(dpi),
+        "-singlefile",
+    ]
+    if gray:
+        cmd.append("-gray")
+    if image_format == "jpeg":
+        cmd.extend(["-jpeg", "-jpegopt", f"quality={int(jpeg_quality)}"])
+    else:
+        cmd.append("-png")
+    # 不给输出前缀时 pdftoppm 把图像写到 stdout，不落盘
+    cmd.append(pdf_path)
+    with tracing.span("render", first_page=page_number, last_page=page_number, dpi=dpi) as span:
+        try:
+            result = subprocess.run(
+                cmd,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+        except Exception as exc:
+            span.set(error=str(exc))
+            return f"Error: {exc}"
+        span.set(bytes_out=len(result.stdout))
+    if not result.stdout:
+        return "Failed to render page."
+    return result.stdout
+
+
+def _jsonl_line(idx: int, segment, *extra) -> bytes:
+    return json.dumps([idx, segment, *extra], ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+class JsonlBatchWriter:
+    def __init__(self, max_pending: int | None = None, fsync: bool | None = None):
+        # 先把多个文件写到临时文件，commit 时统一改名；任何时刻磁盘上的文件要么是旧的要么是完整的新文件
+        self.max_pending = max(1, max_pending or JSONL_BATCH_FILES)
+        self.fsync = JSONL_FSYNC if fsync is None else fsync
+        self._pending: list[tuple[str, str]] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+        return False
+
+    @contextlib.contextmanager
+    def open(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as handle:
+                yield handle
+                handle.flush()
+                if self.fsync:
+                    os.fsync(handle.fileno())
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._pending.append((temp_path, path))
+        if len(self._pending) >= self.max_pending:
+            self.commit()
+
+    def write(self, path: str, segments, start: int = 1) -> None:
+        with self.open(path) as handle:
+            for idx, segment in enumerate(segments, start=start):
+                handle.write(_jsonl_line(idx, segment))
+
+    def commit(self) -> None:
+        directories = set()
+        for temp_path, path in self._pending:
+            os.replace(temp_path, path)
+            directories.add(os.path.dirname(os.path.abspath(path)))
+        self._pending.clear()
+        if not self.fsync:
+            return
+        # 每批每个目录只 fsync 一次，让改名本身落盘
+        for directory in directories:
+            try:
+                fd = os.open(directory, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.fsync(fd)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+    def discard(self) -> None:
+        for temp_path, _ in self._pending:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self._pending.clear()
 
 
 def _write_jsonl(segments, output_path: str):
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, "w", encoding="utf-8") as handle:
-        for idx, segment in enumerate(segments, start=1):
-            handle.write(json.dumps([idx, segment], ensure_ascii=False))
-            handle.write("\n")
+    with JsonlBatchWriter() as batch:
+        batch.write(output_path, segments)
 
 
-def _read_jsonl_texts(path: str) -> list[str]:
-    texts = []
+def iter_jsonl(path: str) -> Iterator:
     with open(path, "r", encoding="utf-8") as handle:
         for line in handle:
             line = line.strip()
-            if not line:
+            if line:
+                yield json.loads(line)
+
+
+def iter_jsonl_texts(path: str) -> Iterator[str]:
+    for item in iter_jsonl(path):
+        if isinstance(item, list) and len(item) >= 2:
+            yield item[1]
+
+
+def _read_jsonl_texts(path: str) -> list[str]:
+    return list(iter_jsonl_texts(path))
+
+
+def _jsonl_head(path: str, count: int) -> tuple[int, list]:
+    # 返回前 count 条记录以及它们之后的字节偏移
+    items = []
+    offset = 0
+    with open(path, "rb") as handle:
+        for line in handle:
+            offset += len(line)
+            if not line.strip():
                 continue
-            item = json.loads(line)
-            if isinstance(item, list) and len(item) >= 2:
-                texts.append(item[1])
-    return texts
+            items.append(json.loads(line))
+            if len(items) == count:
+                break
+    return offset, items
 
 
-def split_text_with_wtpsplit(text: str,
-                             threshold: float | None = None,
-                             base_url: str | None = None,
-                             token: str | None = None) -> list[str]:
+def _jsonl_tail(path: str, count: int, block_size: int = 8192) -> tuple[int, list]:
+    # 从文件末尾向前读，返回最后 count 条记录以及第一条的起始字节偏移
+    with open(path, "rb") as handle:
+        handle.seek(0, os.SEEK_END)
+        end = handle.tell()
+        position = end
+        data = b""
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            handle.seek(position)
+            data = handle.read(step) + data
+            # 不在文件开头时第一行可能不完整，需要多读到一行
+            if sum(1 for line in data.split(b"\n") if line.strip()) > count:
+                break
+    lines = data.split(b"\n")
+    offsets = []
+    cursor = position
+    for line in lines:
+        offsets.append(cursor)
+        cursor += len(line) + 1
+    chosen = [
+        index
+        for index, line in enumerate(lines)
+        if line.strip() and (position == 0 or index > 0)
+    ][-count:]
+    if not chosen:
+        return end, []
+    return offsets[chosen[0]], [json.loads(lines[index]) for index in chosen]
+
+
+def _wtpsplit_request(text: str | list[str],
+                      threshold: float | None,
+                      base_url: str | None,
+                      token: str | None) -> tuple[str, dict, dict]:
     base_url = (
         base_url
         if base_url is not None
-        else (getattr(_config, "WTPSPLIT_BASE_URL", "") if _config else "")
+        else os.getenv(
+            "WTPSPLIT_BASE_URL",
+            getattr(_config, "WTPSPLIT_BASE_URL", "") if _config else "",
+        )
     )
     token = (
         token
         if token is not None
-        else (getattr(_config, "TOKEN", "") if _config else "")
+        else os.getenv(
+            "TOKEN",
+            getattr(_config, "TOKEN", "") if _config else "",
+        )
     )
     if not base_url:
         raise ValueError("WTPSPLIT_BASE_URL is empty; set it to the /split endpoint URL.")
@@ -135,39 +607,93 @@ def split_text_with_wtpsplit(text: str,
         "Content-Type": "application/json",
         "Authorization": f"Bearer {token}",
     }
-    max_retries = 3
-    backoff_seconds = 1.0
-    response = None
-    for attempt in range(max_retries):
-        response = requests.post(base_url, headers=headers, json=payload, timeout=60)
-        if response.status_code != 503:
-            break
-        if attempt < max_retries - 1:
-            time.sleep(backoff_seconds)
-            backoff_seconds *= 2
-    if response is None or response.status_code == 503:
-        raise ValueError("WTPSPLIT request failed with 503 after retries.")
+    return base_url, headers, payload
+
+
+def _wtpsplit_segments(response, text: str | list[str]) -> list[str] | list[list[str]]:
+    if response.status_code in transport.RETRY_STATUSES:
+        raise ValueError(
+            f"WTPSPLIT request failed with {response.status_code} after retries."
+        )
     try:
         payload = response.json()
     except ValueError as exc:
         raise ValueError(f"Invalid JSON response: {exc}") from exc
 
     segments_nested = payload.get("segments", [])
+    if isinstance(text, list):
+        if len(segments_nested) != len(text):
+            raise ValueError(
+                f"WTPSPLIT returned {len(segments_nested)} groups for {len(text)} texts."
+            )
+        return [[seg for seg in group if seg] for group in segments_nested]
     return [seg for group in segments_nested for seg in group if seg]
 
 
-def split_text_with_isanlp_rst(text: str,
-                               base_url: str | None = None,
-                               token: str | None = None) -> list[str]:
+def _wtpsplit_cache_key(url: str, threshold: float | None, text: str) -> str:
+    return SegmentCache.make_key("wtpsplit", url, threshold, text)
+
+
+def split_text_with_wtpsplit(text: str | list[str],
+                             threshold: float | None = None,
+                             base_url: str | None = None,
+                             token: str | None = None,
+                             cache: SegmentCache | None = None) -> list[str] | list[list[str]]:
+    # 传入列表时为批量模式：一次请求分割多段文本，按输入顺序返回每段的句子列表
+    if isinstance(text, list) and not text:
+        return []
+    url, headers, payload = _wtpsplit_request(text, threshold, base_url, token)
+    texts = text if isinstance(text, list) else [text]
+    with tracing.span("wtpsplit", texts=len(texts)) as span:
+        if cache is None:
+            if span:
+                span.set(bytes_out=sum(len(item) for item in texts))
+            response = transport.post(
+                url, headers=headers, json=payload, timeout=WTPSPLIT_TIMEOUT, idempotent=True
+            )
+            span.set(bytes_in=len(response.content))
+            return _wtpsplit_segments(response, text)
+
+        # 结果只取决于 (文本, 阈值, 端点)，命中缓存的文本不再发送
+        keys = [_wtpsplit_cache_key(url, threshold, item) for item in texts]
+        groups = [cache.get(key, kind="wtpsplit") for key in keys]
+        missing = [index for index, group in enumerate(groups) if group is None]
+        span.set(cache_hits=len(texts) - len(missing), cache_misses=len(missing))
+        if missing:
+            missing_texts = [texts[index] for index in missing]
+            payload["texts"] = missing_texts
+            if span:
+                span.set(bytes_out=sum(len(item) for item in missing_texts))
+            response = transport.post(
+                url, headers=headers, json=payload, timeout=WTPSPLIT_TIMEOUT, idempotent=True
+            )
+            span.set(bytes_in=len(response.content))
+            for index, group in zip(missing, _wtpsplit_segments(response, missing_texts)):
+                groups[index] = group
+                cache.put(keys[index], group)
+    if isinstance(text, list):
+        return groups
+    return groups[0]
+
+
+def _isanlp_request(text: str,
+                    base_url: str | None,
+                    token: str | None) -> tuple[str, dict, dict]:
     base_url = (
         base_url
         if base_url is not None
-        else (getattr(_config, "ISANLP_RST_URL", "") if _config else "")
+        else os.getenv(
+            "ISANLP_RST_URL",
+            getattr(_config, "ISANLP_RST_URL", "") if _config else "",
+        )
     )
     token = (
         token
         if token is not None
-        else (getattr(_config, "TOKEN", "") if _config else "")
+        else os.getenv(
+            "TOKEN",
+            getattr(_config, "TOKEN", "") if _config else "",
+        )
     )
     if not base_url:
         raise ValueError("ISANLP_RST_URL is empty; set it to the isanlp rst endpoint URL.")
@@ -176,8 +702,10 @@ def split_text_with_isanlp_rst(text: str,
     headers: dict[str, str] = {}
     if token:
         headers["Authorization"] = f"Bearer {token}"
+    return base_url, headers, payload
 
-    response = requests.post(base_url, json=payload, headers=headers, timeout=120)
+
+def _isanlp_segments(response, text: str) -> list[str]:
     response.raise_for_status()
     try:
         data = response.json()
@@ -187,10 +715,35 @@ def split_text_with_isanlp_rst(text: str,
     return [text[start:end + 1] for start, end in data]
 
 
+def split_text_with_isanlp_rst(text: str,
+                               base_url: str | None = None,
+                               token: str | None = None,
+                               cache: SegmentCache | None = None) -> list[str]:
+    url, headers, payload = _isanlp_request(text, base_url, token)
+    with tracing.span("isanlp_rst", bytes_out=len(text)) as span:
+        # 相同句子、相同端点的结果只请求一次
+        key = SegmentCache.make_key("isanlp", url, text) if cache is not None else None
+        if key is not None:
+            cached = cache.get(key, kind="isanlp")
+            if cached is not None:
+                span.set(cache_hits=1)
+                return cached
+            span.set(cache_misses=1)
+        response = transport.post(
+            url, json=payload, headers=headers, timeout=ISANLP_TIMEOUT, idempotent=True
+        )
+        span.set(bytes_in=len(response.content))
+        segments = _isanlp_segments(response, text)
+    if key is not None:
+        cache.put(key, segments)
+    return segments
+
+
 def split_json_to_jsonl(input_path: str,
                         threshold: float | None = None,
                         base_url: str | None = None,
-                        token: str | None = None) -> bool:
+                        token: str | None = None,
+                        cache: SegmentCache | None = None) -> bool:
     with open(input_path, "r", encoding="utf-8") as handle:
         data = json.load(handle)
     text = data["text"]
@@ -199,37 +752,171 @@ def split_json_to_jsonl(input_path: str,
         threshold=threshold,
         base_url=base_url,
         token=token,
+        cache=cache,
     )
     output_path = os.path.splitext(input_path)[0] + ".jsonl"
     _write_jsonl(segments, output_path)
     return True
 
 
-def fix_page_boundary(prev_jsonl_path: str,
-                      next_jsonl_path: str,
-                      threshold: float | None = None,
-                      base_url: str | None = None,
-                      token: str | None = None) -> None:
-    prev_texts = _read_jsonl_texts(prev_jsonl_path)
-    next_texts = _read_jsonl_texts(next_jsonl_path)
-    if len(prev_texts) < 2 or len(next_texts) < 2:
-        return None
-
-    merged_texts = prev_texts[-2:] + next_texts[:2]
-    combined_text = " ".join(merged_texts)
-    segments = split_text_with_wtpsplit(
-        combined_text,
+def split_json_files_to_jsonl(input_paths: list[str],
+                              threshold: float | None = None,
+                              base_url: str | None = None,
+                              token: str | None = None,
+                              cache: SegmentCache | None = None) -> bool:
+    texts = []
+    for input_path in input_paths:
+        with open(input_path, "r", encoding="utf-8") as handle:
+            texts.append(json.load(handle)["text"])
+    groups = split_text_with_wtpsplit(
+        texts,
         threshold=threshold,
         base_url=base_url,
         token=token,
+        cache=cache,
     )
+    with JsonlBatchWriter() as batch:
+        for input_path, segments in zip(input_paths, groups):
+            batch.write(os.path.splitext(input_path)[0] + ".jsonl", segments)
+    return True
+
+
+def _boundary_window(prev_jsonl_path: str,
+                     next_jsonl_path: str) -> tuple[list[str], int, int, int] | None:
+    # 只读取上一页最后两条和下一页最前两条记录
+    prev_offset, prev_tail = _jsonl_tail(prev_jsonl_path, 2)
+    next_offset, next_head = _jsonl_head(next_jsonl_path, 2)
+    if len(prev_tail) < 2 or len(next_head) < 2:
+        return None
+    merged_texts = [item[1] for item in prev_tail + next_head]
+    return merged_texts, prev_offset, prev_tail[0][0], next_offset
+
+
+def _apply_boundary_fix(prev_jsonl_path: str,
+                        next_jsonl_path: str,
+                        window: tuple[list[str], int, int, int],
+                        segments: list[str]) -> None:
+    merged_texts, prev_offset, prev_start, next_offset = window
     if not segments:
         raise ValueError("No segments returned from wtpsplit.")
     if segments == merged_texts:
         return None
 
-    updated_prev = prev_texts[:-2] + segments
-    updated_next = next_texts[2:]
-    _write_jsonl(updated_prev, prev_jsonl_path)
-    _write_jsonl(updated_next, next_jsonl_path)
+    # 上一页：原样复制尾部之前的字节，再写入新的句子；下一页：去掉开头两条并重新编号。
+    # 下一页仍然整页重写：每行都带页内序号，去掉开头两条后后面每一行的序号都要改，
+    # 开头字节长度一变，文件其余部分也要整体移动，原子替换本来就要写出完整的新文件
+    with JsonlBatchWriter() as batch:
+        with batch.open(prev_jsonl_path) as handle, open(prev_jsonl_path, "rb") as source:
+            remaining = prev_offset
+            while remaining > 0:
+                chunk = source.read(min(1024 * 1024, remaining))
+                if not chunk:
+                    break
+                handle.write(chunk)
+                remaining -= len(chunk)
+            for idx, segment in enumerate(segments, start=prev_start):
+                handle.write(_jsonl_line(idx, segment))
+        with batch.open(next_jsonl_path) as handle, open(next_jsonl_path, "rb") as source:
+            source.seek(next_offset)
+            idx = 1
+            for line in source:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                handle.write(_jsonl_line(idx, item[1]))
+                idx += 1
     return None
+
+
+def fix_page_boundary(prev_jsonl_path: str,
+                      next_jsonl_path: str,
+                      threshold: float | None = None,
+                      base_url: str | None = None,
+                      token: str | None = None,
+                      cache: SegmentCache | None = None) -> None:
+    with tracing.span("fix_page_boundary") as span:
+        window = _boundary_window(prev_jsonl_path, next_jsonl_path)
+        if window is None:
+            span.set(skipped=True)
+            return None
+
+        merged_texts = window[0]
+        segments = split_text_with_wtpsplit(
+            " ".join(merged_texts),
+            threshold=threshold,
+            base_url=base_url,
+            token=token,
+            cache=cache,
+        )
+        span.set(changed=segments != merged_texts)
+        return _apply_boundary_fix(prev_jsonl_path, next_jsonl_path, window, segments)
+
+
+def _locate_segment(text: str, segment: str, cursor: int) -> tuple[int, int]:
+    needle = segment.strip()
+    position = text.find(needle, cursor) if needle else -1
+    if position < 0:
+        return cursor, min(len(text), cursor + len(segment))
+    return position, position + len(needle)
+
+
+def iter_document_sentences(pages: Iterable[tuple[int, str]],
+                            threshold: float | None = None,
+                            base_url: str | None = None,
+                            token: str | None = None,
+                            cache: SegmentCache | None = None,
+                            final: bool = True,
+                            carry_sentences: int | None = None) -> Iterator[dict]:
+    # 按页顺序分句：每页只请求一次，请求文本是上一页未完结的尾句加上本页文本。
+    # 尾句留到下一页再判断，因此输出的句子都已完整；source_ref 是句子跨越的 [起始页, 结束页]。
+    carry_sentences = max(1, carry_sentences or STREAM_CARRY_SENTENCES)
+    carry: list[tuple[str, int, int]] = []
+    for page_number, page_text in pages:
+        page_text = (page_text or "").strip()
+        if not page_text:
+            continue
+        carry_text = " ".join(text for text, _, _ in carry)
+        combined = f"{carry_text} {page_text}" if carry_text else page_text
+        page_start = len(carry_text) + 1 if carry_text else 0
+        # 携带的每个句子在 combined 中的起止位置
+        bounds = []
+        offset = 0
+        for text, first_page, last_page in carry:
+            bounds.append((offset, offset + len(text), first_page, last_page))
+            offset += len(text) + 1
+
+        segments = split_text_with_wtpsplit(
+            combined,
+            threshold=threshold,
+            base_url=base_url,
+            token=token,
+            cache=cache,
+        )
+        spans = []
+        cursor = 0
+        for segment in segments:
+            start, end = _locate_segment(combined, segment, cursor)
+            cursor = end
+            first_page = page_number
+            last_page = page_number
+            for carry_start, carry_end, carry_first, carry_last in bounds:
+                if carry_start <= start < carry_end + 1:
+                    first_page = carry_first
+                if carry_start < end <= carry_end + 1 and end <= page_start:
+                    last_page = carry_last
+            spans.append((segment, first_page, last_page))
+
+        if spans:
+            emit, carry = spans[:-carry_sentences], spans[-carry_sentences:]
+        else:
+            # 没有返回句子时携带的文本还没有输出，连同本页一起留给下一页
+            emit, carry = [], carry + [(page_text, page_number, page_number)]
+        if sum(len(text) for text, _, _ in carry) > STREAM_CARRY_MAX_CHARS:
+            # 一直找不到句末时不再无限累积
+            emit, carry = emit + carry, []
+        for text, first_page, last_page in emit:
+            yield {"text": text, "source_ref": [first_page, last_page]}
+    if final:
+        for text, first_page, last_page in carry:
+            yield {"text": text, "source_ref": [first_page, last_page]}
+